@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-19 01:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='cover_image_variants',
+            field=models.JSONField(blank=True, default=dict, help_text='Responsive copies of the cover image'),
+        ),
+    ]
@@ -59,6 +59,7 @@ class Campaign(models.Model):
     
     # Media
     cover_image = models.ImageField(upload_to='campaigns/covers/', null=True, blank=True)
+    cover_image_variants = models.JSONField(default=dict, blank=True, help_text="Responsive copies of the cover image")
     video_url = models.URLField(blank=True, null=True)
     
     # Transparency
@@ -75,6 +76,16 @@ class Campaign(models.Model):
     def __str__(self):
         return self.title
     
+    def save(self, *args, **kwargs):
+        new_image = bool(self.cover_image) and not self.cover_image._committed
+        if new_image or not self.cover_image:
+            self.cover_image_variants = {}
+        super().save(*args, **kwargs)
+        
+        if new_image:
+            from monitoring.thumbnails import queue_variants
+            queue_variants(self, 'cover_image')
+    
     @property
     def funding_percentage(self):
         if self.funding_goal > 0:
@@ -4,6 +4,7 @@ from .models import (
     CampaignMilestone, CampaignUpdate, CampaignVote, UserVote
 )
 from users.serializers import UserSerializer
+from monitoring.serializers import ImageVariantsField
 
 
 class CampaignMilestoneSerializer(serializers.ModelSerializer):
@@ -53,6 +54,7 @@ class CampaignListSerializer(serializers.ModelSerializer):
     days_remaining = serializers.ReadOnlyField()
     participant_count = serializers.ReadOnlyField()
     is_fully_funded = serializers.ReadOnlyField()
+    cover_image_variants = ImageVariantsField()
     
     class Meta:
         model = Campaign
@@ -60,7 +62,7 @@ class CampaignListSerializer(serializers.ModelSerializer):
                   'forest_name', 'county', 'funding_goal', 'current_funding',
                   'funding_percentage', 'trees_target', 'start_date', 'end_date',
                   'days_remaining', 'participant_count', 'is_fully_funded',
-                  'cover_image', 'creator', 'created_at']
+                  'cover_image', 'cover_image_variants', 'creator', 'created_at']
 
 
 class CampaignDetailSerializer(serializers.ModelSerializer):
@@ -76,6 +78,7 @@ class CampaignDetailSerializer(serializers.ModelSerializer):
     days_remaining = serializers.ReadOnlyField()
     participant_count = serializers.ReadOnlyField()
     is_fully_funded = serializers.ReadOnlyField()
+    cover_image_variants = ImageVariantsField()
     
     class Meta:
         model = Campaign
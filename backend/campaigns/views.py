@@ -4,10 +4,12 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from django_filters.rest_framework import DjangoFilterBackend
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q, Sum
 from decimal import Decimal
 import uuid
 
+from monitoring.revenue import record_contribution
 from .models import (
     Campaign, CampaignParticipant, CampaignContribution,
     CampaignMilestone, CampaignUpdate, CampaignVote, UserVote
@@ -95,28 +97,32 @@ class CampaignViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create contribution record
-        contribution = CampaignContribution.objects.create(
-            campaign=campaign,
-            participant=participant,
-            amount=amount,
-            payment_method=payment_method,
-            phone_number=phone_number,
-            message=message,
-            is_anonymous=is_anonymous,
-            transaction_id=f"CAMP-{uuid.uuid4().hex[:12].upper()}",
-            status='completed',  # In production, this would be 'pending' until payment confirmed
-            completed_at=timezone.now()
-        )
-        
-        # Update campaign funding
-        campaign.current_funding += amount
-        campaign.save()
-        
-        # Update participant total
-        participant.total_contributed += amount
-        participant.last_contribution_date = timezone.now()
-        participant.save()
+        with transaction.atomic():
+            # Create contribution record
+            contribution = CampaignContribution.objects.create(
+                campaign=campaign,
+                participant=participant,
+                amount=amount,
+                payment_method=payment_method,
+                phone_number=phone_number,
+                message=message,
+                is_anonymous=is_anonymous,
+                transaction_id=f"CAMP-{uuid.uuid4().hex[:12].upper()}",
+                status='completed',  # In production, this would be 'pending' until payment confirmed
+                completed_at=timezone.now()
+            )
+            
+            # Update campaign funding
+            campaign.current_funding += amount
+            campaign.save()
+            
+            # Update participant total
+            participant.total_contributed += amount
+            participant.last_contribution_date = timezone.now()
+            participant.save()
+            
+            # Add to the revenue rollups with the contribution itself
+            record_contribution(contribution)
         
         serializer = CampaignContributionSerializer(contribution)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
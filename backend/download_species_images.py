@@ -1,6 +1,5 @@
 import os
 import django
-import requests
 from pathlib import Path
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nilocate_project.settings')
@@ -8,6 +7,9 @@ django.setup()
 
 from trees.models import TreeSpecies
 from django.core.files.base import ContentFile
+from monitoring.http_client import get_client
+
+http = get_client('images')
 
 # High-quality tree images from Unsplash - species-specific where possible
 species_images = {
@@ -46,7 +48,7 @@ for scientific_name, img_data in species_images.items():
         print(f"   📥 Downloading image for {species.name}...")
         
         # Download the image
-        response = requests.get(img_data['url'], timeout=30)
+        response = http.get(img_data['url'])
         
         if response.status_code == 200:
             # Save the image to the species
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import TreeReport, AIAnalysis, Alert, IncidentReport
+from .models import TreeReport, AIAnalysis, AnalysisJob, ImageAnalysisCache, Alert, IncidentReport, DailyStats, InboundMessage, WebhookReceipt, RevenueRollup
 
 
 @admin.register(TreeReport)
@@ -12,8 +12,8 @@ class TreeReportAdmin(admin.ModelAdmin):
 
 @admin.register(AIAnalysis)
 class AIAnalysisAdmin(admin.ModelAdmin):
-    list_display = ['report', 'health_assessment', 'confidence_score', 'analyzed_at']
-    list_filter = ['health_assessment', 'analyzed_at']
+    list_display = ['report', 'health_assessment', 'confidence_score', 'source', 'analyzed_at']
+    list_filter = ['health_assessment', 'source', 'analyzed_at']
     search_fields = ['report__title', 'recommendations']
     readonly_fields = ['analyzed_at']
 
@@ -33,3 +33,47 @@ class IncidentReportAdmin(admin.ModelAdmin):
     search_fields = ['title', 'description', 'location_name', 'reporter__username']
     readonly_fields = ['created_at', 'updated_at', 'resolved_at']
 
+
+@admin.register(DailyStats)
+class DailyStatsAdmin(admin.ModelAdmin):
+    list_display = ['date', 'total_trees', 'healthy_trees', 'active_alerts', 'critical_alerts', 'reports_count']
+    date_hierarchy = 'date'
+    readonly_fields = ['computed_at']
+
+
+@admin.register(InboundMessage)
+class InboundMessageAdmin(admin.ModelAdmin):
+    list_display = ['phone_number', 'status', 'received_at', 'processed_at']
+    list_filter = ['status']
+    search_fields = ['phone_number', 'text', 'provider_message_id']
+    readonly_fields = ['received_at', 'processed_at']
+
+
+@admin.register(WebhookReceipt)
+class WebhookReceiptAdmin(admin.ModelAdmin):
+    list_display = ['source', 'key', 'created_at']
+    list_filter = ['source']
+    search_fields = ['key']
+
+
+@admin.register(RevenueRollup)
+class RevenueRollupAdmin(admin.ModelAdmin):
+    list_display = ['date', 'dimension', 'key', 'source', 'amount', 'transactions']
+    list_filter = ['dimension', 'source']
+    date_hierarchy = 'date'
+    search_fields = ['key']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'report', 'kind', 'status', 'requested_by', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status']
+    readonly_fields = ['created_at', 'started_at', 'finished_at']
+
+
+@admin.register(ImageAnalysisCache)
+class ImageAnalysisCacheAdmin(admin.ModelAdmin):
+    list_display = ['sha256', 'phash', 'hits', 'created_at', 'last_hit_at']
+    search_fields = ['sha256', 'phash']
+    readonly_fields = ['created_at', 'last_hit_at']
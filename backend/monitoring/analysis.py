@@ -0,0 +1,313 @@
+"""
+Background AI analysis of report images
+Requests queue an AnalysisJob and return at once; the `ai` worker calls
+Gemini and stores both the AIAnalysis and the response the client polls
+for. A report has at most one job in flight. bulk_analyze_reports() works
+through reports nobody asked to analyse.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .image_cache import analyze_image, cached_result, image_path, remember
+from .models import AIAnalysis, AIAnalysisPayload, Alert, AnalysisJob, TaskWatermark, TreeReport
+from .rate_limit import RateLimitExceeded
+from .services import GeminiAIService
+
+BULK_ANALYSIS_WATERMARK = 'bulk_analyze_reports'
+
+
+def submit_analysis(report, kind, user=None):
+    """
+    Queue AI analysis of `report`, or return the job already in flight
+    
+    Returns:
+        tuple: (AnalysisJob, created)
+    """
+    from .tasks import analyze_report_image
+    
+    # A worker lost mid-run must not block the report forever
+    AnalysisJob.objects.filter(
+        report=report,
+        status='running',
+        started_at__lt=timezone.now() - timedelta(seconds=settings.AI_ANALYSIS_JOB_TIMEOUT)
+    ).update(status='failed', error='Analysis timed out', finished_at=timezone.now())
+    
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                job = AnalysisJob.objects.create(report=report, kind=kind, requested_by=user)
+        except IntegrityError:
+            job = AnalysisJob.objects.filter(
+                report=report, status__in=AnalysisJob.ACTIVE_STATUSES
+            ).first()
+            if job is not None:
+                return job, False
+            # The job in flight finished in the meantime
+            job = AnalysisJob.objects.create(report=report, kind=kind, requested_by=user)
+        transaction.on_commit(lambda: analyze_report_image.delay(job.id))
+    return job, True
+
+
+def run_analysis_job(job_id):
+    """
+    Run one queued job; a redelivered or already finished job is skipped
+    
+    Returns:
+        AnalysisJob or None when the job was not queued
+    """
+    started = AnalysisJob.objects.filter(id=job_id, status='queued').update(
+        status='running', started_at=timezone.now()
+    )
+    if not started:
+        return None
+    
+    job = AnalysisJob.objects.select_related('report__tree').get(id=job_id)
+    try:
+        if job.kind == 'analyze_ai':
+            analysis = _analyze_for_dashboard(job.report)
+        else:
+            analysis = _analyze_report(job.report)
+        job.status = 'succeeded'
+        job.analysis = analysis
+        job.result = job_result(analysis)
+    except Exception as e:
+        job.status = 'failed'
+        job.error = f'AI analysis failed: {str(e)}'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'analysis', 'result', 'error', 'finished_at'])
+    return job
+
+
+def job_result(ai_analysis):
+    """
+    Result stored on a finished job
+    
+    Jobs are shared by both analyze endpoints, so the result carries the
+    report view (`analysis`) and the ranger dashboard view (`dashboard`).
+    """
+    from .serializers import AIAnalysisSerializer
+    
+    health = ai_analysis.health_assessment
+    return {
+        'analysis': AIAnalysisSerializer(ai_analysis).data,
+        'dashboard': {
+            'disease': ai_analysis.detected_issues,
+            'confidence': float(ai_analysis.confidence_score) / 100.0,
+            'recommendations': ai_analysis.recommendations,
+            'severity': 'high' if health in ['diseased', 'critical'] else
+                       'medium' if health == 'declining' else 'low',
+            'health_status': health,
+            'analysis_id': ai_analysis.id
+        },
+    }
+
+
+def _analyze_report(report):
+    """Create the report's AIAnalysis and update the tree when the AI is confident"""
+    existing = AIAnalysis.objects.filter(report=report).first()
+    if existing:
+        return existing
+    
+    # Run AI analysis, reusing the result for a photo seen before
+    analysis_result = analyze_image(report)
+    
+    # Create AIAnalysis record
+    ai_analysis = _build_analysis(report, analysis_result)
+    ai_analysis.save()
+    
+    alert = _apply_to_tree(report, analysis_result)
+    if alert is not None:
+        alert.save()
+    
+    return ai_analysis
+
+
+def _build_analysis(report, analysis_result):
+    return AIAnalysis(
+        report=report,
+        health_assessment=analysis_result['health_assessment'],
+        confidence_score=analysis_result['confidence_score'],
+        detected_issues=analysis_result['detected_issues'],
+        recommendations=analysis_result['recommendations'],
+        source=analysis_result.get('source', 'gemini'),
+        raw_analysis=analysis_result
+    )
+
+
+def _apply_to_tree(report, analysis_result):
+    """
+    Update tree health if the AI is confident
+    
+    Returns:
+        Unsaved Alert when the tree is diseased or critical, else None
+    """
+    if analysis_result['confidence_score'] <= 70:
+        return None
+    
+    report.tree.health_status = analysis_result['health_assessment']
+    report.tree.health_change_source = 'ai_analysis'
+    report.tree.save()
+    
+    # Create alert if health is critical
+    if analysis_result['health_assessment'] not in ['diseased', 'critical']:
+        return None
+    return Alert(
+        tree=report.tree,
+        report=report,
+        severity='high' if analysis_result['health_assessment'] == 'critical' else 'medium',
+        title=f"Tree Health Alert: {analysis_result['health_assessment'].title()}",
+        message=f"AI detected {analysis_result['health_assessment']} condition. {analysis_result['recommendations']}"
+    )
+
+
+def _analyze_for_dashboard(report):
+    """(Re)analyze a report for the ranger dashboard, replacing any earlier analysis"""
+    # Run AI analysis, reusing the result for a photo seen before
+    analysis_result = analyze_image(report)
+    
+    # Create or update AIAnalysis record
+    ai_analysis, _ = AIAnalysis.objects.update_or_create(
+        report=report,
+        defaults={
+            'health_assessment': analysis_result['health_assessment'],
+            'confidence_score': analysis_result['confidence_score'],
+            'detected_issues': analysis_result['detected_issues'],
+            'recommendations': analysis_result['recommendations'],
+            'source': analysis_result.get('source', 'gemini'),
+        }
+    )
+    AIAnalysisPayload.store(ai_analysis.id, analysis_result)
+    
+    # Create alert if health is critical
+    if analysis_result['health_assessment'] in ['diseased', 'critical']:
+        Alert.objects.create(
+            tree=report.tree,
+            report=report,
+            severity='critical' if analysis_result['health_assessment'] == 'critical' else 'high',
+            title=f"AI Detected Tree Health Issue",
+            message=f"AI analysis detected {analysis_result['health_assessment']} condition in {report.tree.tree_id}. {analysis_result['recommendations']}"
+        )
+    
+    return ai_analysis
+
+
+def unanalyzed_reports():
+    """
+    Reports with an image and no AIAnalysis
+    
+    A LEFT JOIN probing the unique report index of AIAnalysis, over the
+    report_with_image partial index.
+    """
+    return TreeReport.objects.filter(image__gt='', ai_analysis__isnull=True)
+
+
+def bulk_analyze_reports(limit=None, workers=None, batch_size=50):
+    """
+    Work through the backlog of reports that were never analysed
+    
+    Cached images are answered without Gemini; the rest are sent with up to
+    `workers` requests in flight, drawing on the shared Gemini quota while
+    leaving AI_BULK_ANALYSIS_RESERVE requests a minute for interactive
+    analysis. Each batch is written in one transaction and checkpointed, so
+    an interrupted run resumes where it stopped. Reports whose analysis
+    failed are retried on the next sweep of the backlog.
+    
+    Returns:
+        dict: summary counts
+    """
+    limit = limit or settings.AI_BULK_ANALYSIS_LIMIT
+    workers = workers or settings.AI_BULK_ANALYSIS_CONCURRENCY
+    position = TaskWatermark.get_position(BULK_ANALYSIS_WATERMARK)
+    summary = {'analyzed': 0, 'cached': 0, 'failed': 0, 'rate_limited': False, 'sweep_complete': False}
+    service = None
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while summary['analyzed'] + summary['failed'] < limit:
+            remaining = limit - summary['analyzed'] - summary['failed']
+            batch = list(
+                unanalyzed_reports().filter(id__gt=position)
+                .select_related('tree').order_by('id')[:min(batch_size, remaining)]
+            )
+            if not batch:
+                # Start the next sweep from the beginning to retry failures
+                TaskWatermark.reset(BULK_ANALYSIS_WATERMARK)
+                summary['sweep_complete'] = True
+                break
+            
+            results = {}
+            misses = []
+            for report in batch:
+                try:
+                    results[report.id] = cached_result(report)
+                except Exception as e:
+                    print(f"Cannot analyze report {report.id}: {str(e)}")
+                    results[report.id] = None
+                    continue
+                if results[report.id] is None:
+                    misses.append(report)
+                else:
+                    summary['cached'] += 1
+            
+            if misses:
+                service = service or GeminiAIService()
+                fresh = list(executor.map(lambda report: _call_gemini(service, report), misses))
+                first_limited = None
+                for report, result in zip(misses, fresh):
+                    if result is RateLimitExceeded:
+                        first_limited = first_limited or report.id
+                        continue
+                    results[report.id] = result
+                    remember(report, result)
+                if first_limited is not None:
+                    summary['rate_limited'] = True
+                    # Checkpoint before the first report left unanalysed
+                    batch = [r for r in batch if r.id < first_limited]
+            
+            analyzed, failed = _save_bulk_results(batch, results)
+            summary['analyzed'] += analyzed
+            summary['failed'] += failed
+            if batch:
+                position = batch[-1].id
+                TaskWatermark.advance(BULK_ANALYSIS_WATERMARK, position)
+            if summary['rate_limited']:
+                break
+    
+    return summary
+
+
+def _call_gemini(service, report):
+    try:
+        return service.analyze_tree_image(image_path(report), quota_reserve=settings.AI_BULK_ANALYSIS_RESERVE)
+    except RateLimitExceeded:
+        return RateLimitExceeded
+
+
+def _save_bulk_results(batch, results):
+    """Write one batch of bulk results; returns (analyzed, failed)"""
+    # Failed calls come back with no confidence; leave them for the next sweep
+    succeeded = [r for r in batch if results.get(r.id) and results[r.id]['confidence_score']]
+    
+    with transaction.atomic():
+        # Skip reports analysed interactively while the batch ran
+        taken = set(
+            AIAnalysis.objects.filter(report__in=succeeded).values_list('report_id', flat=True)
+        )
+        succeeded = [r for r in succeeded if r.id not in taken]
+        analyses = AIAnalysis.objects.bulk_create([_build_analysis(r, results[r.id]) for r in succeeded])
+        # bulk_create skips AIAnalysis.save(), which writes the payload
+        payloads = []
+        for analysis in analyses:
+            data, size = AIAnalysisPayload.compress(analysis.raw_analysis)
+            payloads.append(AIAnalysisPayload(analysis=analysis, data=data, size=size))
+        AIAnalysisPayload.objects.bulk_create(payloads)
+        
+        # One health update per tree, from its newest report
+        latest = {r.tree_id: r for r in succeeded if results[r.id]['confidence_score'] > 70}
+        alerts = [_apply_to_tree(r, results[r.id]) for r in latest.values()]
+        Alert.objects.bulk_create([alert for alert in alerts if alert is not None])
+    
+    return len(succeeded), len(batch) - len(succeeded) - len(taken)
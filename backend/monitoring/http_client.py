@@ -0,0 +1,192 @@
+"""
+Shared HTTP client for external providers
+Pooled sessions per host, explicit connect/read timeouts, bounded retries
+with jittered backoff and a per-provider circuit breaker. Every call is
+timed into the `http.<provider>.latency_ms` histogram.
+"""
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+RETRY_STATUSES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+# provider: (connect timeout, read timeout, retries)
+PROVIDERS = {
+    'mpesa': (3.05, 15, 2),
+    'africastalking': (3.05, 10, 2),
+    'firms': (5, 30, 2),
+    'openweather': (3.05, 10, 1),
+    'images': (5, 30, 2),
+}
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised without calling the provider while its circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker, kept per process
+    
+    After `threshold` failures in a row the circuit opens and calls fail
+    fast for `reset_timeout` seconds; then one trial call is let through
+    and its outcome closes or re-opens the circuit.
+    """
+    
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+    
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.failures >= self.threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url):
+    """Return the pooled session for the URL's scheme and host"""
+    parts = urlsplit(url)
+    origin = f'{parts.scheme}://{parts.netloc}'
+    with _sessions_lock:
+        session = _sessions.get(origin)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=20)
+            session.mount(f'{parts.scheme}://', adapter)
+            _sessions[origin] = session
+        return session
+
+
+class HttpClient:
+    """HTTP calls to one provider"""
+    
+    def __init__(self, provider, connect_timeout=3.05, read_timeout=10, retries=2,
+                 backoff=0.5, max_backoff=5.0, breaker=None):
+        self.provider = provider
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+    
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+    
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+    
+    def request(self, method, url, idempotent=None, expected_statuses=(), **kwargs):
+        """
+        Send a request, retrying transient failures
+        
+        Non-idempotent requests (POST by default) are only retried when the
+        connection could not be opened, so the provider never sees them twice.
+        5xx answers count against the circuit breaker unless listed in
+        `expected_statuses` (for APIs that use them for normal outcomes).
+        Raises CircuitOpenError while the provider's circuit is open and
+        requests exceptions once retries are used up.
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', self.timeout)
+        session = get_session(url)
+        
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                metrics.incr(f'http.{self.provider}.circuit_open')
+                raise CircuitOpenError(f"{self.provider} circuit is open")
+            
+            started = time.monotonic()
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                self._record(started, failed=True)
+                retryable = isinstance(e, requests.ConnectTimeout) or (
+                    idempotent and isinstance(e, (requests.ConnectionError, requests.Timeout))
+                )
+                if retryable and attempt < self.retries:
+                    attempt = self._sleep(attempt)
+                    continue
+                raise
+            
+            failed = response.status_code >= 500 and response.status_code not in expected_statuses
+            self._record(started, failed=failed)
+            if response.status_code in RETRY_STATUSES and idempotent and attempt < self.retries:
+                attempt = self._sleep(attempt, response.headers.get('Retry-After'))
+                continue
+            return response
+    
+    def _record(self, started, failed):
+        metrics.observe(f'http.{self.provider}.latency_ms', (time.monotonic() - started) * 1000)
+        if failed:
+            metrics.incr(f'http.{self.provider}.errors')
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+    
+    def _sleep(self, attempt, retry_after=None):
+        # Full jitter: spread retries from many workers over the backoff window
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), self.max_backoff))
+        metrics.incr(f'http.{self.provider}.retries')
+        time.sleep(delay)
+        return attempt + 1
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(provider):
+    """Return the process-wide client (and circuit breaker) for a provider"""
+    with _clients_lock:
+        client = _clients.get(provider)
+        if client is None:
+            connect_timeout, read_timeout, retries = PROVIDERS.get(provider, (3.05, 10, 1))
+            client = HttpClient(provider, connect_timeout, read_timeout, retries)
+            _clients[provider] = client
+        return client
@@ -0,0 +1,76 @@
+"""
+Idempotent webhook ingestion
+Africa's Talking and Safaricom retry deliveries they think were lost.
+A delivery is claimed by its provider key (message id, USSD sessionId,
+CheckoutRequestID) before anything is written or sent; repeats are seen in
+the shared cache, or in the WebhookReceipt table once the cache has
+forgotten them.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .metrics import incr
+from .models import WebhookReceipt
+
+
+def _cache_key(source, key):
+    # Keys may carry free text (USSD input), so hash them for the cache
+    return f"webhook:{source}:{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+
+
+def claim(source, key):
+    """
+    Record a delivery as handled
+    
+    Call inside the transaction that performs the delivery's writes, so a
+    failed attempt releases its claim and the provider's retry goes through.
+    
+    Returns:
+        bool: True for the first delivery, False for a repeat
+    
+    Raises:
+        ValueError: `key` is empty; a delivery without one cannot be deduplicated
+    """
+    if not key:
+        raise ValueError(f'{source} delivery has no idempotency key')
+    
+    cache_key = _cache_key(source, key)
+    if cache.get(cache_key):
+        incr(f'webhooks.{source}.duplicates')
+        return False
+    
+    try:
+        with transaction.atomic():
+            WebhookReceipt.objects.create(source=source, key=key[:200])
+    except IntegrityError:
+        cache.set(cache_key, 1, settings.WEBHOOK_DEDUPE_TTL)
+        incr(f'webhooks.{source}.duplicates')
+        return False
+    
+    transaction.on_commit(lambda: cache.set(cache_key, 1, settings.WEBHOOK_DEDUPE_TTL))
+    return True
+
+
+def cached_response(source, key):
+    """Response already returned for a delivery, if the cache still has it"""
+    if not key:
+        return None
+    return cache.get(_cache_key(source, f'{key}:response'))
+
+
+def remember_response(source, key, response, timeout=None):
+    """Keep a delivery's response so a retry gets the same answer"""
+    if key:
+        cache.set(_cache_key(source, f'{key}:response'), response, timeout or settings.WEBHOOK_DEDUPE_TTL)
+
+
+def prune_receipts(days=None):
+    """Delete receipts older than any provider will retry"""
+    cutoff = timezone.now() - timedelta(days=days or settings.WEBHOOK_RECEIPT_DAYS)
+    deleted, _ = WebhookReceipt.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
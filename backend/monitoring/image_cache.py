@@ -0,0 +1,156 @@
+"""
+Fingerprint cache for AI image analysis
+Report images are fingerprinted on upload with a SHA-256 and a 64-bit
+difference hash (dHash). Gemini results are stored per fingerprint, so a
+photo uploaded again - or resized, recompressed or re-sent over WhatsApp -
+is analysed without calling Gemini. Hits and misses are counted under the
+`ai_cache.` metrics.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import metrics
+from .models import ImageAnalysisCache
+from .services import GeminiAIService
+
+HASH_SIZE = 8
+BANDS = 4
+
+
+def perceptual_hash(image):
+    """64-bit difference hash of a PIL image as 16 hex digits"""
+    # Let the JPEG decoder downscale while decoding instead of loading full size
+    image.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+    image = ImageOps.exif_transpose(image).convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    pixels = list(image.getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            offset = row * (HASH_SIZE + 1) + col
+            bits = (bits << 1) | (pixels[offset] > pixels[offset + 1])
+    return f'{bits:016x}'
+
+
+def fingerprint_image(file):
+    """
+    Return (sha256, phash) for an image file or FieldFile
+    
+    phash is blank when the file cannot be decoded as an image.
+    """
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        digest.update(chunk)
+    
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            phash = perceptual_hash(image)
+    except Exception as e:
+        print(f"Could not compute perceptual hash: {str(e)}")
+        phash = ''
+    file.seek(0)
+    return digest.hexdigest(), phash
+
+
+def hamming_distance(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def _bands(phash):
+    width = len(phash) // BANDS
+    return {f'phash_band{i}': phash[i * width:(i + 1) * width] for i in range(BANDS)}
+
+
+def find_cached(sha256, phash, max_distance=None):
+    """
+    Return (ImageAnalysisCache, distance) for the closest cached image, or (None, None)
+    
+    Two hashes within 3 bits share at least one band, so near matches only
+    have to be compared against the rows found through the band indexes.
+    """
+    if max_distance is None:
+        max_distance = settings.AI_ANALYSIS_CACHE_MAX_DISTANCE
+    
+    entry = ImageAnalysisCache.objects.filter(sha256=sha256).first()
+    if entry is not None:
+        return entry, 0
+    if not phash or max_distance <= 0:
+        return None, None
+    
+    same_band = Q()
+    for field, value in _bands(phash).items():
+        same_band |= Q(**{field: value})
+    candidates = ImageAnalysisCache.objects.filter(same_band).only('id', 'sha256', 'phash', 'result')
+    best, best_distance = None, None
+    for candidate in candidates:
+        distance = hamming_distance(phash, candidate.phash)
+        if distance <= max_distance and (best is None or distance < best_distance):
+            best, best_distance = candidate, distance
+    return best, best_distance
+
+
+def store(sha256, phash, result):
+    """Cache a Gemini result; failed analyses and local triage verdicts are not cached"""
+    if not result.get('confidence_score') or result.get('source') == 'triage':
+        return None
+    try:
+        with transaction.atomic():
+            return ImageAnalysisCache.objects.create(sha256=sha256, phash=phash, result=result, **_bands(phash))
+    except IntegrityError:
+        # Another worker analysed the same image first
+        return None
+
+
+def cached_result(report):
+    """
+    Cached analysis for a report's image, or None on a miss
+    
+    Fingerprints reports uploaded before fingerprinting was added.
+    """
+    if not report.image_sha256:
+        with report.image.open('rb') as image_file:
+            report.image_sha256, report.image_phash = fingerprint_image(image_file)
+        type(report).objects.filter(pk=report.pk).update(
+            image_sha256=report.image_sha256, image_phash=report.image_phash
+        )
+    
+    entry, distance = find_cached(report.image_sha256, report.image_phash)
+    if entry is None:
+        metrics.incr('ai_cache.misses')
+        return None
+    
+    ImageAnalysisCache.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_hit_at=timezone.now())
+    metrics.incr('ai_cache.hits')
+    metrics.incr('ai_cache.exact_hits' if entry.sha256 == report.image_sha256 else 'ai_cache.near_hits')
+    print(f"AI cache hit for report {report.id} (distance {distance})")
+    return dict(entry.result)
+
+
+def remember(report, result):
+    """Cache a fresh Gemini result for the report's image"""
+    return store(report.image_sha256, report.image_phash, result)
+
+
+def analyze_image(report):
+    """
+    analyze_tree_image() for a report, served from the cache when possible
+    
+    Returns:
+        dict: Analysis result in GeminiAIService.analyze_tree_image() form
+    """
+    result = cached_result(report)
+    if result is None:
+        result = GeminiAIService().analyze_tree_image(image_path(report))
+        remember(report, result)
+    return result
+
+
+def image_path(report):
+    """The image Gemini should see: the downscaled AI variant when there is one"""
+    return (report.ai_image or report.image).path
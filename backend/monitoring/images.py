@@ -0,0 +1,76 @@
+"""
+Upload preprocessing for report, incident and tree images
+New uploads are turned upright from their EXIF orientation, stripped of
+metadata (EXIF carries GPS and device details), downscaled to
+IMAGE_MAX_DIMENSION and re-encoded before they reach storage. Report images
+also get a smaller AI_IMAGE_MAX_DIMENSION variant that is what Gemini sees.
+"""
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def resize_image(image, max_dimension):
+    """Upright, metadata-free copy of a PIL image no larger than max_dimension on either side"""
+    # JPEG can decode straight to a smaller scale, far cheaper than a full decode
+    image.draft('RGB', (max_dimension, max_dimension))
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('RGBA' if _has_alpha(image) else 'RGB')
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    return image
+
+
+def encode_image(image, quality):
+    """Encode as JPEG, or as PNG when the image has transparency; returns (bytes, extension)"""
+    output = io.BytesIO()
+    if image.mode == 'RGBA':
+        image.save(output, 'PNG', optimize=True)
+        return output.getvalue(), '.png'
+    image.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return output.getvalue(), '.jpg'
+
+
+def process_image(file, max_dimension=None, quality=None, suffix=''):
+    """
+    Preprocess an uploaded image file
+    
+    Returns:
+        ContentFile ready to assign to an ImageField, or None when the file
+        cannot be decoded (it is then stored as uploaded)
+    """
+    max_dimension = max_dimension or settings.IMAGE_MAX_DIMENSION
+    quality = quality or settings.IMAGE_QUALITY
+    try:
+        file.seek(0)
+        with Image.open(file) as image:
+            data, extension = encode_image(resize_image(image, max_dimension), quality)
+    except Exception as e:
+        print(f"Could not preprocess image {file.name}: {str(e)}")
+        return None
+    finally:
+        file.seek(0)
+    
+    stem = os.path.splitext(os.path.basename(file.name))[0]
+    return ContentFile(data, name=f'{stem}{suffix}{extension}')
+
+
+def preprocess_upload(field_file):
+    """The processed replacement for a new upload, or the file itself when it cannot be processed"""
+    return process_image(field_file) or field_file
+
+
+def ai_variant(field_file):
+    """Smaller copy of an image for AI analysis"""
+    return process_image(
+        field_file,
+        max_dimension=settings.AI_IMAGE_MAX_DIMENSION,
+        quality=settings.AI_IMAGE_QUALITY,
+        suffix='_ai'
+    )
@@ -0,0 +1,241 @@
+"""
+Batched processing of inbound SMS
+The webhook only stores the raw message; this module drains pending
+messages in batches, resolving trees and users with one query per batch,
+and sends the replies in bulk.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from trees.models import Tree
+from trees.status_cards import get_status_cards
+from users.models import User
+from users.phone import normalize_phone_number
+from .models import InboundMessage, IncidentReport
+
+HELP_TEXT = (
+    "Nilocate SMS Commands:\n"
+    "REPORT [TREE_ID] [TYPE] [DETAILS] - Report incident\n"
+    "STATUS [TREE_ID] - Check tree health\n"
+    "ADOPT [TREE_ID] - Get adoption info\n"
+    "HELP - Show this message"
+)
+
+# Words people type in an SMS report -> IncidentReport.incident_type
+INCIDENT_TYPE_MAP = {
+    'fire': 'fire',
+    'logging': 'illegal_logging',
+    'illegal_logging': 'illegal_logging',
+    'poaching': 'poaching',
+    'damage': 'vandalism',
+    'vandalism': 'vandalism',
+    'encroachment': 'encroachment',
+    'pollution': 'pollution',
+}
+
+
+def parse_command(text):
+    """
+    Split an SMS into (command, tree_id, extra)
+    
+    REPORT messages carry (incident_type, details) as extra.
+    """
+    parts = text.strip().split(' ', 3)
+    command = parts[0].upper()
+    
+    if command == 'REPORT':
+        if len(parts) < 4:
+            return 'REPORT_USAGE', None, None
+        return 'REPORT', parts[1], (INCIDENT_TYPE_MAP.get(parts[2].lower(), 'other'), parts[3])
+    
+    if command in ('STATUS', 'ADOPT'):
+        if len(parts) < 2 or not parts[1]:
+            return f'{command}_USAGE', None, None
+        return command, parts[1], None
+    
+    return 'HELP', None, None
+
+
+def status_reply(card):
+    return (
+        f"Tree: {card['tree_id']}\n"
+        f"Species: {card['species_name']}\n"
+        f"Health: {card['health_status']}\n"
+        f"Location: {card['location_name']}\n"
+        f"Adopted: {'Yes' if card['is_adopted'] else 'Available'}\n"
+        f"Last check: {card['last_health_check'] or 'N/A'}"
+    )
+
+
+def adoption_reply(card):
+    return (
+        f"Adopt {card['tree_id']}\n"
+        f"Species: {card['species_name']}\n"
+        f"Fee: KES 500/year\n"
+        f"To adopt:\n"
+        f"1. Visit nilocate.co.ke/tree/{card['id']}\n"
+        f"2. Pay via M-Pesa\n"
+        f"3. Get certificate\n"
+        f"Benefits: Monthly updates, carbon offset certificate, badges"
+    )
+
+
+USAGE_REPLIES = {
+    'REPORT_USAGE': "Usage: REPORT [TREE_ID] [TYPE] [DETAILS]. Example: REPORT NAIROBI-OAK-001 fire Smoke near the tree",
+    'STATUS_USAGE': "Usage: STATUS [TREE_ID]. Example: STATUS NAIROBI-OAK-001",
+    'ADOPT_USAGE': "Usage: ADOPT [TREE_ID] to get adoption info",
+}
+
+
+def process_batch(messages):
+    """
+    Handle one batch of InboundMessages
+    
+    Returns:
+        list: (phone_number, text) replies to send
+    """
+    parsed = [(message, *parse_command(message.text)) for message in messages]
+    
+    # One query for every tree named in the batch
+    cards = get_status_cards(tree_id for _, _, tree_id, _ in parsed if tree_id)
+    
+    # One query for every REPORT sender
+    report_phones = {
+        normalize_phone_number(message.phone_number)
+        for message, command, _, _ in parsed if command == 'REPORT'
+    }
+    report_phones.discard(None)
+    users_by_phone = dict(
+        User.objects.filter(phone_e164__in=report_phones).values_list('phone_e164', 'id')
+    ) if report_phones else {}
+    fallback_reporter_id = None
+    if report_phones - set(users_by_phone):
+        fallback_reporter_id = User.objects.filter(user_type='admin').values_list('id', flat=True).first()
+    
+    # REPORT locations come from the tree rows themselves
+    report_keys = {
+        Tree.normalize_tree_id(tree_id)
+        for _, command, tree_id, _ in parsed if command == 'REPORT' and tree_id
+    }
+    report_trees = {
+        tree.tree_key: tree
+        for tree in Tree.objects.filter(tree_key__in=report_keys).only(
+            'id', 'tree_key', 'location_name', 'latitude', 'longitude'
+        )
+    } if report_keys else {}
+    
+    replies = []
+    incidents = []
+    for message, command, tree_id, extra in parsed:
+        key = Tree.normalize_tree_id(tree_id) if tree_id else None
+        
+        if command == 'HELP':
+            replies.append((message.phone_number, HELP_TEXT))
+        elif command in USAGE_REPLIES:
+            replies.append((message.phone_number, USAGE_REPLIES[command]))
+        elif command == 'STATUS':
+            card = cards.get(key)
+            replies.append((message.phone_number, status_reply(card) if card else f"Tree {tree_id} not found. Visit nilocate.co.ke/map"))
+        elif command == 'ADOPT':
+            card = cards.get(key)
+            replies.append((message.phone_number, adoption_reply(card) if card else f"Tree {tree_id} not found."))
+        elif command == 'REPORT':
+            tree = report_trees.get(key)
+            if tree is None:
+                replies.append((
+                    message.phone_number,
+                    f"Tree {key} not found. Visit nilocate.co.ke/map to find valid tree IDs."
+                ))
+                continue
+            
+            reporter_id = users_by_phone.get(normalize_phone_number(message.phone_number), fallback_reporter_id)
+            if reporter_id is None:
+                replies.append((message.phone_number, "Report could not be recorded. Please try again later."))
+                continue
+            
+            incident_type, details = extra
+            incidents.append((message, key, IncidentReport(
+                reporter_id=reporter_id,
+                incident_type=incident_type,
+                title=f"SMS Report: {incident_type}",
+                description=details,
+                location_name=tree.location_name,
+                latitude=tree.latitude,
+                longitude=tree.longitude,
+                priority='urgent' if incident_type == 'fire' else 'medium'
+            )))
+    
+    if incidents:
+        IncidentReport.objects.bulk_create([incident for _, _, incident in incidents])
+        for message, key, incident in incidents:
+            replies.append((
+                message.phone_number,
+                f"Report received for tree {key}. Reference: INC-{incident.id}. "
+                f"Rangers will investigate. Thank you!"
+            ))
+    
+    return replies
+
+
+def _process_one_by_one(messages):
+    """
+    Retry a failed batch message by message, each in its own savepoint
+    
+    Returns:
+        tuple: (replies, {message id: error} for the messages that failed)
+    """
+    replies = []
+    failed = {}
+    for message in messages:
+        try:
+            with transaction.atomic():
+                replies.extend(process_batch([message]))
+        except Exception as e:
+            print(f"Inbound message {message.id} failed: {str(e)}")
+            failed[message.id] = str(e)
+    return replies, failed
+
+
+def drain_inbound_messages(batch_size=200, max_batches=50):
+    """
+    Process pending inbound messages batch by batch
+    
+    A message that cannot be processed is marked failed with its error, so
+    it never blocks the messages queued behind it.
+    
+    Returns:
+        int: Number of messages processed, including failed ones
+    """
+    from .tasks import send_sms_bulk
+    
+    processed = 0
+    for _ in range(max_batches):
+        with transaction.atomic():
+            messages = list(
+                InboundMessage.objects.select_for_update(skip_locked=True)
+                .filter(status='pending').order_by('id')[:batch_size]
+            )
+            if not messages:
+                break
+            
+            try:
+                with transaction.atomic():
+                    replies = process_batch(messages)
+                failed = {}
+            except Exception as e:
+                print(f"Inbound batch failed, retrying one message at a time: {str(e)}")
+                replies, failed = _process_one_by_one(messages)
+            
+            InboundMessage.objects.filter(id__in=[m.id for m in messages if m.id not in failed]).update(
+                status='processed', processed_at=timezone.now()
+            )
+            for message_id, error in failed.items():
+                InboundMessage.objects.filter(id=message_id).update(
+                    status='failed', error=error, processed_at=timezone.now()
+                )
+            if replies:
+                transaction.on_commit(lambda replies=replies: send_sms_bulk.delay(replies))
+        
+        processed += len(messages)
+    
+    return processed
@@ -0,0 +1,122 @@
+"""
+Single-flight locks for periodic Celery tasks
+Prevents overlapping runs when a job outlives its schedule interval or beat restarts.
+"""
+import functools
+import logging
+import threading
+import uuid
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.redis import RedisCache
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Compare-and-act scripts, so checking the token and acting on it is atomic
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class CacheLock:
+    """
+    Expiring lock stored in the shared cache
+    
+    The TTL bounds how long a crashed worker can hold the lock; a heartbeat
+    thread keeps extending it while the owner is still running.
+    
+    With Redis, release and heartbeat compare the token and act in one Lua
+    script. Other backends fall back to check-then-act; LocMemCache is
+    per-process, so it gives no cross-process guarantee at all and is only
+    meant for development and tests.
+    """
+    
+    def __init__(self, key, ttl):
+        self.key = key
+        self.ttl = ttl
+        self.token = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def acquire(self):
+        return cache.add(self.key, self.token, self.ttl)
+    
+    def is_owner(self):
+        return cache.get(self.key) == self.token
+    
+    def _run_script(self, script, *args):
+        """Run a compare-and-act script against Redis; None on other backends"""
+        backend = caches[DEFAULT_CACHE_ALIAS]
+        if not isinstance(backend, RedisCache):
+            return None
+        key = backend.make_and_validate_key(self.key)
+        client = backend._cache.get_client(key, write=True)
+        # Values are stored serialized, so compare against the serialized token
+        token = backend._cache._serializer.dumps(self.token)
+        return client.eval(script, 1, key, token, *args)
+    
+    def release(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self._run_script(RELEASE_SCRIPT) is None and self.is_owner():
+            cache.delete(self.key)
+    
+    def start_heartbeat(self, interval):
+        def beat():
+            while not self._stop.wait(interval):
+                extended = self._run_script(EXTEND_SCRIPT, self.ttl)
+                if extended is None:
+                    extended = self.is_owner() and cache.touch(self.key, self.ttl)
+                if not extended:
+                    logger.warning(f"Lost task lock {self.key}")
+                    return
+        
+        self._thread = threading.Thread(target=beat, name=f'heartbeat:{self.key}', daemon=True)
+        self._thread.start()
+
+
+def single_flight(ttl=600, heartbeat=None, key=None):
+    """
+    Decorator that skips a task run while another run of it holds the lock
+    
+    Apply below @shared_task. Skipped runs return None and are counted in
+    the `tasks.<name>.skipped` metric.
+    
+    Args:
+        ttl: Lock lifetime in seconds without a heartbeat
+        heartbeat: Seconds between TTL extensions (defaults to ttl / 3)
+        key: Cache key; defaults to the task's dotted path
+    """
+    def decorator(func):
+        lock_key = key or f'task-lock:{func.__module__}.{func.__name__}'
+        interval = heartbeat or max(1, ttl // 3)
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            lock = CacheLock(lock_key, ttl)
+            if not lock.acquire():
+                metrics.incr(f'tasks.{func.__name__}.skipped')
+                logger.warning(f"Skipping {func.__name__}: previous run still in progress")
+                return None
+            
+            metrics.incr(f'tasks.{func.__name__}.runs')
+            lock.start_heartbeat(interval)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                lock.release()
+        
+        return wrapper
+    return decorator
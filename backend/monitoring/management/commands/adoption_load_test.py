@@ -0,0 +1,352 @@
+import contextlib
+import io
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import defaultdict
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from monitoring.metrics import percentile
+from monitoring.stand_ins import FakeAfricasTalking, FakeDaraja
+from monitoring.tasks import initiate_adoption_payment, send_adoption_sms
+from .webhook_load_test import LOCAL_CACHES, QueryCounter, test_database
+
+STEPS = ['adopt', 'stk_push', 'callback', 'sms', 'status']
+
+# Attempts per step when the database reports lock contention (SQLite
+# fails a writer outright instead of queueing it)
+MAX_ATTEMPTS = 50
+
+
+@contextlib.contextmanager
+def _quiet(logger_name):
+    """Silence a logger (retried 500s would otherwise flood stderr)"""
+    logger = logging.getLogger(logger_name)
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+
+class QueuedTasks:
+    """
+    Collects the Celery tasks each client thread enqueues
+    
+    The benchmark client runs them itself, as the worker would, so every
+    step of the flow is timed on its own.
+    """
+    
+    def __init__(self):
+        self._local = threading.local()
+    
+    def enqueue(self, task):
+        def delay(*args, **kwargs):
+            self.pending().append((task, args, kwargs))
+        return delay
+    
+    def pending(self):
+        if not hasattr(self._local, 'tasks'):
+            self._local.tasks = []
+        return self._local.tasks
+    
+    def take(self, task):
+        taken = [entry for entry in self.pending() if entry[0] is task]
+        self._local.tasks = [entry for entry in self.pending() if entry[0] is not task]
+        return taken
+
+
+class Command(BaseCommand):
+    help = (
+        "Offline end-to-end benchmark of paid adoptions: adopt_tree, STK push, M-Pesa "
+        "callback, TreeAdoption creation and the confirmation SMS, driven by concurrent "
+        "clients against a throwaway test database and local fake Daraja and Africa's "
+        "Talking servers. Fails on lost counter updates or when throughput, latency or "
+        "queries per step regress."
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--adoptions', type=int, default=400, help="Adoption attempts to drive")
+        parser.add_argument('--clients', type=int, default=8, help="Concurrent client threads")
+        parser.add_argument('--adopters-per-tree', type=int, default=2,
+                            help="Users racing to adopt each tree")
+        parser.add_argument('--duplicate-rate', type=float, default=0.1,
+                            help="Share of callbacks Safaricom delivers twice")
+        parser.add_argument('--daraja-latency', type=float, default=0.0,
+                            help="Seconds the fake Daraja waits before answering")
+        parser.add_argument('--seed', type=int, default=1, help="Random seed for duplicate deliveries")
+        parser.add_argument('--min-throughput', type=float, default=10.0,
+                            help="Minimum completed adoptions per second")
+        parser.add_argument('--max-adopt-p95-ms', type=float, default=1000.0, help="adopt_tree p95 limit")
+        parser.add_argument('--max-callback-p95-ms', type=float, default=500.0, help="Callback p95 limit")
+        parser.add_argument('--max-adopt-queries', type=float, default=12.0,
+                            help="DB queries per adopt_tree request")
+        parser.add_argument('--max-callback-queries', type=float, default=30.0,
+                            help="DB queries per callback")
+    
+    def handle(self, *args, **options):
+        with test_database('adoption_load_test'), FakeDaraja(latency=options['daraja_latency']) as daraja, \
+                FakeAfricasTalking() as telco, override_settings(CACHES=LOCAL_CACHES), mock.patch.dict(os.environ, {
+                    'MPESA_BASE_URL': daraja.url,
+                    'MPESA_CONSUMER_KEY': 'loadtest',
+                    'MPESA_CONSUMER_SECRET': 'loadtest',
+                    'MPESA_PASSKEY': 'loadtest',
+                    'AFRICAS_TALKING_USERNAME': 'loadtest',
+                    'AFRICAS_TALKING_API_KEY': 'loadtest',
+                    'AFRICAS_TALKING_BASE_URL': telco.url,
+                }):
+            failures = self._run(daraja, telco, options)
+        
+        if failures:
+            raise CommandError("Adoption load test regressed:\n  " + "\n  ".join(failures))
+        self.stdout.write(self.style.SUCCESS("Adoption load test passed"))
+    
+    def _seed(self, options):
+        from trees.models import Tree, TreeSpecies
+        from users.models import User
+        
+        per_tree = max(options['adopters_per_tree'], 1)
+        tree_count = -(-options['adoptions'] // per_tree)
+        species = TreeSpecies.objects.create(
+            name='Mukau', scientific_name='Melia volkensii', description='', risk_level='endangered',
+            native_region='Eastern Kenya', characteristics='', conservation_importance='', threats=''
+        )
+        Tree.objects.bulk_create([
+            Tree(
+                species=species, tree_id=f'PAY-{i:05d}', tree_key=Tree.normalize_tree_id(f'PAY-{i:05d}'),
+                latitude=-1.2, longitude=36.8, location_name='Karura Forest'
+            )
+            for i in range(tree_count)
+        ])
+        User.objects.bulk_create([
+            User(username=f'adopter-{i}', phone_number=f'07{i:08d}', phone_e164=f'+2547{i:08d}')
+            for i in range(options['adoptions'])
+        ])
+        
+        trees = list(Tree.objects.order_by('id').values_list('id', flat=True))
+        users = list(User.objects.order_by('id'))
+        # Adopters of one tree sit next to each other, so clients race for it
+        return [(user, trees[i // per_tree]) for i, user in enumerate(users)]
+    
+    def _run(self, daraja, telco, options):
+        from trees.models import AdoptionRequest, Payment, Tree, TreeAdoption
+        from users.models import User
+        
+        work = queue.Queue()
+        for item in self._seed(options):
+            work.put(item)
+        
+        tasks = QueuedTasks()
+        results = {
+            'latencies': defaultdict(list),
+            'queries': defaultdict(int),
+            'end_to_end': [],
+            'accepted': 0,
+            'rejected': 0,
+            'duplicates': 0,
+            'retries': 0,
+            'errors': [],
+        }
+        lock = threading.Lock()
+        rng = random.Random(options['seed'])
+        duplicate_draws = [rng.random() < options['duplicate_rate'] for _ in range(options['adoptions'])]
+        
+        def client_loop():
+            client = APIClient(HTTP_HOST='localhost')
+            try:
+                while True:
+                    try:
+                        user, tree_id = work.get_nowait()
+                    except queue.Empty:
+                        return
+                    self._adopt(client, user, tree_id, tasks, results, lock, duplicate_draws[user.id % len(duplicate_draws)])
+            except Exception as e:
+                with lock:
+                    results['errors'].append(repr(e))
+            finally:
+                connection.close()
+        
+        with mock.patch.object(initiate_adoption_payment, 'delay', tasks.enqueue(initiate_adoption_payment)), \
+                mock.patch.object(send_adoption_sms, 'delay', tasks.enqueue(send_adoption_sms)), \
+                contextlib.redirect_stdout(io.StringIO()), _quiet('django.request'):
+            # Load URLconf and view modules before timing anything
+            warmup = APIClient(HTTP_HOST='localhost')
+            warmup.get('/api/trees/')
+            warmup.post('/api/mpesa/callback/', {}, format='json')
+            
+            threads = [threading.Thread(target=client_loop) for _ in range(options['clients'])]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        
+        adoptions = TreeAdoption.objects.count()
+        self.stdout.write(
+            f"flow   {adoptions:6d} adoptions {adoptions / elapsed:8.1f} adoptions/s "
+            f"clients={options['clients']} accepted={results['accepted']} rejected={results['rejected']} "
+            f"duplicate callbacks={results['duplicates']} retries={results['retries']}"
+        )
+        if results['end_to_end']:
+            e2e = results['end_to_end']
+            self.stdout.write(
+                f"e2e    {len(e2e):6d} flows p50={percentile(e2e, 50):7.2f}ms "
+                f"p95={percentile(e2e, 95):7.2f}ms p99={percentile(e2e, 99):7.2f}ms"
+            )
+        for step in STEPS:
+            latencies = results['latencies'][step]
+            if not latencies:
+                continue
+            self.stdout.write(
+                f"{step:<8} {len(latencies):6d} calls p50={percentile(latencies, 50):7.2f}ms "
+                f"p95={percentile(latencies, 95):7.2f}ms p99={percentile(latencies, 99):7.2f}ms "
+                f"queries/call={results['queries'][step] / len(latencies):5.2f}"
+            )
+        
+        failures = list(results['errors'])
+        
+        # Lost updates: denormalised counters must match the rows they count
+        drifted_trees = [
+            tree for tree in Tree.objects.filter(adoptions__isnull=False).distinct()
+            if tree.adoption_count != tree.adoptions.count() or not tree.is_adopted
+        ]
+        if drifted_trees:
+            failures.append(f"{len(drifted_trees)} trees with adoption_count out of step, e.g. {drifted_trees[0].tree_id}")
+        drifted_users = [
+            user for user in User.objects.filter(adoptions__isnull=False).distinct()
+            if user.trees_adopted_count != user.adoptions.count()
+        ]
+        if drifted_users:
+            failures.append(f"{len(drifted_users)} users with trees_adopted_count out of step")
+        
+        completed_payments = Payment.objects.filter(status='completed').count()
+        completed_requests = AdoptionRequest.objects.filter(status='completed').count()
+        unsettled = Payment.objects.filter(status__in=['initiating', 'pending']).count()
+        stk_pushes = daraja.count('/mpesa/stkpush/')
+        self.stdout.write(
+            f"check  payments completed={completed_payments} requests completed={completed_requests} "
+            f"stk pushes={stk_pushes} sms={telco.recipients_count} unsettled={unsettled}"
+        )
+        if completed_payments != adoptions or completed_requests != adoptions:
+            failures.append(
+                f"{adoptions} adoptions for {completed_payments} completed payments "
+                f"and {completed_requests} completed requests"
+            )
+        if stk_pushes != results['accepted']:
+            failures.append(f"{stk_pushes} STK pushes for {results['accepted']} accepted adoption requests")
+        if telco.recipients_count != adoptions:
+            failures.append(f"{telco.recipients_count} confirmation SMS for {adoptions} adoptions")
+        if unsettled:
+            failures.append(f"{unsettled} payments left unsettled")
+        
+        rate = adoptions / elapsed
+        checks = [
+            (rate >= options['min_throughput'],
+             f"throughput {rate:.1f} adoptions/s < {options['min_throughput']:.1f}"),
+        ]
+        for step, limit_key in (('adopt', 'max_adopt'), ('callback', 'max_callback')):
+            latencies = results['latencies'][step]
+            if not latencies:
+                continue
+            p95 = percentile(latencies, 95)
+            per_call = results['queries'][step] / len(latencies)
+            checks.append((p95 <= options[f'{limit_key}_p95_ms'],
+                           f"{step} p95 {p95:.2f}ms > {options[f'{limit_key}_p95_ms']:.2f}ms"))
+            checks.append((per_call <= options[f'{limit_key}_queries'],
+                           f"{step} queries/call {per_call:.2f} > {options[f'{limit_key}_queries']:.2f}"))
+        failures.extend(message for ok, message in checks if not ok)
+        return failures
+    
+    def _timed(self, step, call, results, lock):
+        """Run one step, retrying when SQLite reports lock contention"""
+        for attempt in range(MAX_ATTEMPTS):
+            with QueryCounter() as queries:
+                sent = time.perf_counter()
+                try:
+                    response = call()
+                except OperationalError:
+                    response = None
+                elapsed_ms = (time.perf_counter() - sent) * 1000
+            if response is not None and getattr(response, 'status_code', 200) < 500:
+                with lock:
+                    results['latencies'][step].append(elapsed_ms)
+                    results['queries'][step] += queries.count
+                return response
+            with lock:
+                results['retries'] += 1
+            # Jittered backoff, so colliding clients do not retry in lockstep
+            time.sleep(random.uniform(0, min(0.2, 0.005 * 2 ** attempt)))
+        raise CommandError(f"{step} still failing after {MAX_ATTEMPTS} attempts")
+    
+    def _run_tasks(self, step, task, tasks, results, lock):
+        for _, args, kwargs in tasks.take(task):
+            self._timed(step, lambda: task.apply(args=args, kwargs=kwargs, throw=True), results, lock)
+    
+    def _adopt(self, client, user, tree_id, tasks, results, lock, duplicate):
+        from trees.models import Payment
+        
+        client.force_authenticate(user)
+        started = time.perf_counter()
+        
+        response = self._timed('adopt', lambda: client.post(
+            f'/api/trees/{tree_id}/adopt_tree/',
+            {'phone_number': user.phone_number, 'amount': 500},
+            format='json'
+        ), results, lock)
+        if response.status_code == 400:
+            # Someone else's adoption of this tree completed first
+            with lock:
+                results['rejected'] += 1
+            return
+        if response.status_code != 202:
+            raise CommandError(f"adopt_tree returned {response.status_code}: {response.content[:200]!r}")
+        with lock:
+            results['accepted'] += 1
+        
+        payment_id = response.data['payment_id']
+        status_url = response.data['status_url']
+        self._run_tasks('stk_push', initiate_adoption_payment, tasks, results, lock)
+        
+        # Safaricom learns the CheckoutRequestID from its own response
+        checkout_request_id = Payment.objects.values_list(
+            'mpesa_checkout_request_id', flat=True
+        ).get(pk=payment_id)
+        callback = {
+            'Body': {
+                'stkCallback': {
+                    'MerchantRequestID': f'loadtest-{payment_id}',
+                    'CheckoutRequestID': checkout_request_id,
+                    'ResultCode': 0,
+                    'ResultDesc': 'The service request is processed successfully.',
+                    'CallbackMetadata': {
+                        'Item': [
+                            {'Name': 'Amount', 'Value': 500},
+                            {'Name': 'MpesaReceiptNumber', 'Value': f'LT{payment_id:08d}'},
+                            {'Name': 'PhoneNumber', 'Value': int(user.phone_e164.lstrip('+'))},
+                        ]
+                    },
+                }
+            }
+        }
+        for _ in range(2 if duplicate else 1):
+            self._timed('callback', lambda: client.post('/api/mpesa/callback/', callback, format='json'), results, lock)
+        if duplicate:
+            with lock:
+                results['duplicates'] += 1
+        self._run_tasks('sms', send_adoption_sms, tasks, results, lock)
+        
+        status = self._timed('status', lambda: client.get(status_url), results, lock)
+        if status.data['status'] != 'completed':
+            raise CommandError(f"payment {payment_id} ended {status.data['status']}")
+        with lock:
+            results['end_to_end'].append((time.perf_counter() - started) * 1000)
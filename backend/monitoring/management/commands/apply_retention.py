@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring.retention import POLICIES, apply_retention
+
+
+class Command(BaseCommand):
+    help = "Archive expired rows to compressed NDJSON and remove them in bounded chunks"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--policy', action='append', choices=sorted(POLICIES),
+                            help="Policy to apply (repeatable). Defaults to all policies")
+        parser.add_argument('--chunk-size', type=int, help="Rows per chunk")
+        parser.add_argument('--dry-run', action='store_true', help="Only count expired rows")
+    
+    def handle(self, *args, **options):
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive")
+        
+        results = apply_retention(
+            options['policy'],
+            chunk_size=options['chunk_size'],
+            dry_run=options['dry_run'],
+        )
+        
+        verb = "would be archived" if options['dry_run'] else "archived"
+        for result in results:
+            self.stdout.write(
+                f"{result['policy']}: {result['processed']} rows {verb} "
+                f"({len(result['archives'])} files)"
+            )
@@ -0,0 +1,28 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from monitoring.stats import backfill_daily_stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild DailyStats rows for a range of past days in bulk"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day to rebuild (YYYY-MM-DD). Defaults to 90 days ago")
+        parser.add_argument('--end', help="Last day to rebuild (YYYY-MM-DD). Defaults to yesterday")
+    
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        try:
+            start = date.fromisoformat(options['start']) if options['start'] else today - timedelta(days=90)
+            end = date.fromisoformat(options['end']) if options['end'] else today - timedelta(days=1)
+        except ValueError as e:
+            raise CommandError(f"Invalid date: {e}")
+        
+        if start > end:
+            raise CommandError("--start must not be after --end")
+        
+        written = backfill_daily_stats(start, end)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt daily stats for {written} days ({start} to {end})"))
@@ -0,0 +1,28 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from monitoring.revenue import backfill_revenue_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild revenue rollups (per day, species and forest) for a range of past days"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day to rebuild (YYYY-MM-DD). Defaults to 365 days ago")
+        parser.add_argument('--end', help="Last day to rebuild (YYYY-MM-DD). Defaults to yesterday")
+    
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        try:
+            start = date.fromisoformat(options['start']) if options['start'] else today - timedelta(days=365)
+            end = date.fromisoformat(options['end']) if options['end'] else today - timedelta(days=1)
+        except ValueError as e:
+            raise CommandError(f"Invalid date: {e}")
+        
+        if start > end:
+            raise CommandError("--start must not be after --end")
+        
+        written = backfill_revenue_rollups(start, end)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} revenue rollup rows ({start} to {end})"))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring.analysis import bulk_analyze_reports
+
+
+class Command(BaseCommand):
+    help = "Run AI analysis for report images that were never analysed, within the Gemini quota"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help="Reports to analyse in this run")
+        parser.add_argument('--workers', type=int, help="Gemini requests in flight")
+    
+    def handle(self, *args, **options):
+        for name in ('limit', 'workers'):
+            if options[name] is not None and options[name] < 1:
+                raise CommandError(f"--{name} must be positive")
+        
+        summary = bulk_analyze_reports(limit=options['limit'], workers=options['workers'])
+        
+        self.stdout.write(
+            f"Analyzed {summary['analyzed']} reports ({summary['cached']} from cache), "
+            f"{summary['failed']} failed"
+        )
+        if summary['rate_limited']:
+            self.stdout.write("Stopped at the Gemini quota; the next run resumes from the checkpoint")
+        elif summary['sweep_complete']:
+            self.stdout.write("Backlog sweep complete")
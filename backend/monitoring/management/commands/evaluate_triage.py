@@ -0,0 +1,142 @@
+"""
+Offline evaluation of the local image triage
+
+Measures how many photos the triage settles without Gemini and how often
+those local verdicts are wrong, so AI_TRIAGE_THRESHOLDS can be tuned before
+a change is deployed. Labels come from either
+  * a directory with one sub-directory per label (healthy/, unusable/ and
+    any other name, e.g. stressed/ or diseased/, for photos Gemini must see)
+  * the Gemini analyses already stored for reports (--from-db)
+"""
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from monitoring.metrics import percentile
+from monitoring.models import AIAnalysis
+from monitoring.services import ImageTriage
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def expected_decision(label):
+    """What a perfect triage would do with a photo carrying `label`"""
+    if label in ('healthy', 'unusable'):
+        return label
+    return 'ambiguous'
+
+
+class Command(BaseCommand):
+    help = "Report the accuracy and Gemini calls saved by the local image triage"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help="Labelled image directory (one sub-directory per label)")
+        parser.add_argument('--from-db', action='store_true', help="Label report images with their stored Gemini analysis")
+        parser.add_argument('--limit', type=int, default=2000, help="Images to evaluate with --from-db")
+        parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                            help="Override a threshold, e.g. --set min_sharpness=60")
+        parser.add_argument('--sweep', metavar='NAME=V1,V2,...',
+                            help="Evaluate each value of one threshold")
+        parser.add_argument('--cost-per-call', type=float, default=0.0,
+                            help="Gemini cost per image, to estimate the saving")
+    
+    def handle(self, *args, **options):
+        if bool(options['dir']) == options['from_db']:
+            raise CommandError("Pass exactly one of --dir or --from-db")
+        
+        overrides = dict(self._parse_threshold(value) for value in options['set'])
+        configs = [overrides]
+        if options['sweep']:
+            name, values = self._parse_threshold(options['sweep'], multiple=True)
+            configs = [{**overrides, name: value} for value in values]
+        
+        samples = self._load_dir(options['dir']) if options['dir'] else self._load_db(options['limit'])
+        if not samples:
+            raise CommandError("No labelled images found")
+        
+        # Features do not depend on thresholds, so each image is read once
+        triage = ImageTriage()
+        features = []
+        timings = []
+        for path, label in samples:
+            started = time.perf_counter()
+            try:
+                with Image.open(path) as image:
+                    features.append((triage.features(image), label))
+            except Exception as e:
+                self.stderr.write(f"Skipping {path}: {e}")
+                continue
+            timings.append((time.perf_counter() - started) * 1000)
+        
+        labels = sorted({label for _, label in features})
+        self.stdout.write(
+            f"{len(features)} images ({', '.join(f'{label}={sum(1 for _, l in features if l == label)}' for label in labels)}); "
+            f"triage p50={percentile(timings, 50):.1f}ms p95={percentile(timings, 95):.1f}ms per image"
+        )
+        for config in configs:
+            self._report(ImageTriage(config), features, config, options['cost_per_call'])
+    
+    def _report(self, triage, features, config, cost_per_call):
+        local = correct = missed_problems = wrongly_rejected = 0
+        for image_features, label in features:
+            decision, _ = triage.classify(image_features)
+            if decision == 'ambiguous':
+                continue
+            local += 1
+            if decision == expected_decision(label):
+                correct += 1
+            elif decision == 'healthy':
+                missed_problems += 1
+            elif decision == 'unusable':
+                wrongly_rejected += 1
+        
+        total = len(features)
+        line = f"{config or 'defaults'}: resolved locally {local}/{total} ({local / total:.1%})"
+        if local:
+            line += f", local accuracy {correct / local:.1%}"
+        line += f", unhealthy passed as healthy {missed_problems}, usable photos rejected {wrongly_rejected}"
+        if cost_per_call:
+            line += f", Gemini cost saved {local * cost_per_call:.2f} of {total * cost_per_call:.2f}"
+        self.stdout.write(line)
+    
+    def _parse_threshold(self, value, multiple=False):
+        name, _, raw = value.partition('=')
+        if name not in ImageTriage().thresholds or not raw:
+            raise CommandError(f"Unknown threshold or missing value: {value}")
+        try:
+            values = [float(v) for v in raw.split(',')]
+        except ValueError:
+            raise CommandError(f"Threshold values must be numbers: {value}")
+        return name, values if multiple else values[0]
+    
+    def _load_dir(self, root):
+        if not os.path.isdir(root):
+            raise CommandError(f"Not a directory: {root}")
+        samples = []
+        for label in sorted(os.listdir(root)):
+            folder = os.path.join(root, label)
+            if not os.path.isdir(folder):
+                continue
+            for name in sorted(os.listdir(folder)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    samples.append((os.path.join(folder, name), label))
+        return samples
+    
+    def _load_db(self, limit):
+        samples = []
+        analyses = (
+            AIAnalysis.objects.select_related('report')
+            .exclude(report__image='')
+            .exclude(source='triage')
+            .exclude(confidence_score=0)  # Gemini errors
+            .order_by('-analyzed_at')[:limit]
+        )
+        for analysis in analyses:
+            report = analysis.report
+            label = 'unusable' if analysis.health_assessment == 'unknown' else analysis.health_assessment
+            image = report.ai_image or report.image
+            if image and os.path.exists(image.path):
+                samples.append((image.path, label))
+        return samples
@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from monitoring.thumbnails import VARIANT_FIELDS, build_variants, save_variants
+
+
+class Command(BaseCommand):
+    help = "Generate responsive variants for images already in media storage"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=[label for label, _ in VARIANT_FIELDS], action='append',
+                            help="Only process this model (repeatable)")
+        parser.add_argument('--workers', type=int, default=4, help="Images processed in parallel")
+        parser.add_argument('--batch-size', type=int, default=200, help="Images per database transaction")
+        parser.add_argument('--force', action='store_true', help="Regenerate images that already have variants")
+    
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--workers and --batch-size must be positive")
+        
+        selected = options['model']
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for label, field_name in VARIANT_FIELDS:
+                if selected and label not in selected:
+                    continue
+                done, failed = self._process(executor, label, field_name, options)
+                self.stdout.write(f"{label}.{field_name}: {done} images processed, {failed} failed")
+    
+    def _process(self, executor, label, field_name, options):
+        queryset = apps.get_model(label).objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+        if not options['force']:
+            queryset = queryset.filter(**{f'{field_name}_variants': {}})
+        
+        done = failed = 0
+        last_pk = 0
+        while True:
+            rows = list(
+                queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', field_name)[:options['batch_size']]
+            )
+            if not rows:
+                return done, failed
+            last_pk = rows[-1][0]
+            
+            # Image work runs in the pool; database writes stay on this thread
+            results = executor.map(lambda row: self._build(row[1]), rows)
+            with transaction.atomic():
+                for (pk, name), variants in zip(rows, results):
+                    if variants is None:
+                        failed += 1
+                    elif save_variants(label, pk, field_name, name, variants):
+                        done += 1
+    
+    def _build(self, name):
+        try:
+            return build_variants(name)
+        except Exception as e:
+            self.stderr.write(f"Skipping {name}: {e}")
+            return None
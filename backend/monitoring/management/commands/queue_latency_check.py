@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring.metrics import percentile
+from nilocate_project.celery import batch_load_probe, latency_probe
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test: measure urgent-queue latency with and without a flood of batch "
+        "jobs. Requires the broker, result backend and the worker profiles running."
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--probes', type=int, default=50, help="Urgent probes per phase")
+        parser.add_argument('--batch-jobs', type=int, default=40, help="Batch jobs to flood with")
+        parser.add_argument('--batch-seconds', type=float, default=5.0, help="Duration of each batch job")
+        parser.add_argument('--tolerance-ms', type=float, default=250.0,
+                            help="Allowed p95 increase under batch load")
+        parser.add_argument('--timeout', type=float, default=60.0, help="Seconds to wait for probe results")
+    
+    def _measure(self, probes, timeout):
+        results = []
+        for _ in range(probes):
+            results.append(latency_probe.apply_async(args=[time.time()], queue='urgent'))
+            time.sleep(0.02)
+        return [result.get(timeout=timeout) * 1000 for result in results]
+    
+    def _report(self, label, latencies):
+        self.stdout.write(
+            f"{label:<14} p50={percentile(latencies, 50):7.1f}ms "
+            f"p95={percentile(latencies, 95):7.1f}ms "
+            f"p99={percentile(latencies, 99):7.1f}ms "
+            f"max={max(latencies):7.1f}ms"
+        )
+    
+    def handle(self, *args, **options):
+        baseline = self._measure(options['probes'], options['timeout'])
+        self._report("baseline", baseline)
+        
+        for _ in range(options['batch_jobs']):
+            batch_load_probe.apply_async(args=[options['batch_seconds']], queue='batch')
+        
+        loaded = self._measure(options['probes'], options['timeout'])
+        self._report("batch load", loaded)
+        
+        increase = percentile(loaded, 95) - percentile(baseline, 95)
+        if increase > options['tolerance_ms']:
+            raise CommandError(
+                f"Urgent p95 latency rose by {increase:.1f}ms under batch load "
+                f"(tolerance {options['tolerance_ms']:.0f}ms)"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Urgent p95 latency change: {increase:+.1f}ms"))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring.payments import reconcile_pending_payments
+
+
+class Command(BaseCommand):
+    help = "Query Daraja for stale pending M-Pesa payments and settle them in bulk"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-minutes', type=int, help="Minimum age of a pending payment")
+        parser.add_argument('--expire-hours', type=int, help="Fail payments still unresolved after this")
+        parser.add_argument('--limit', type=int, help="Payments to check in this run")
+        parser.add_argument('--workers', type=int, help="Daraja queries in flight")
+    
+    def handle(self, *args, **options):
+        for name in ('stale_minutes', 'expire_hours', 'limit', 'workers'):
+            if options[name] is not None and options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be positive")
+        
+        summary = reconcile_pending_payments(
+            stale_minutes=options['stale_minutes'],
+            expire_hours=options['expire_hours'],
+            limit=options['limit'],
+            workers=options['workers'],
+        )
+        
+        self.stdout.write(
+            f"Checked {summary['checked']} pending payments: "
+            f"{summary['completed']} completed, {summary['failed']} failed, "
+            f"{summary['cancelled']} cancelled, {summary['expired']} expired, "
+            f"{summary['still_pending']} still pending, {summary['errors']} query errors; "
+            f"{summary['unsent']} never-sent payments failed"
+        )
+        for checkout_request_id in summary['corrected']:
+            self.stdout.write(f"  corrected {checkout_request_id}")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring.retention import POLICIES, restore_archive
+
+
+class Command(BaseCommand):
+    help = "Restore rows from retention archive files (.jsonl.gz)"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Archive files to restore")
+        parser.add_argument('--policy', choices=sorted(POLICIES),
+                            help="Policy the files belong to. Defaults to the archive's directory name")
+    
+    def handle(self, *args, **options):
+        total = 0
+        for path in options['paths']:
+            try:
+                restored = restore_archive(path, options['policy'])
+            except (OSError, KeyError) as e:
+                raise CommandError(f"Could not restore {path}: {e}")
+            self.stdout.write(f"{path}: {restored} records restored")
+            total += restored
+        
+        self.stdout.write(self.style.SUCCESS(f"Restored {total} records"))
@@ -0,0 +1,287 @@
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from monitoring.metrics import percentile
+from monitoring.stand_ins import FakeAfricasTalking
+from nilocate_project.celery import app
+
+LOCAL_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'webhook-load-test',
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    }
+}
+
+USSD_FLOWS = {
+    'report': lambda tree_id: ['', '1', '1*2', f'1*2*{tree_id}', f'1*2*{tree_id}*Men cutting trees near the road'],
+    'status': lambda tree_id: ['', '2', f'2*{tree_id}'],
+    'adoptions': lambda tree_id: ['', '3'],
+    'help': lambda tree_id: ['', '4'],
+}
+
+
+@contextlib.contextmanager
+def test_database(name):
+    """
+    Run the block against a throwaway test database
+    
+    Any connection already open on the configured database is closed first,
+    and on SQLite the test database is a temporary file, so nothing is ever
+    created at the real DATABASES path.
+    """
+    setup_test_environment()
+    test_settings = connection.settings_dict['TEST']
+    test_name = test_settings.get('NAME')
+    tmp_dir = None
+    if connection.vendor == 'sqlite' and not test_name:
+        # Client threads need their own connections to one on-disk database
+        tmp_dir = tempfile.mkdtemp()
+        test_settings['NAME'] = os.path.join(tmp_dir, f'{name}.sqlite3')
+    old_name = connection.settings_dict['NAME']
+    connection.close()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = test_name
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        teardown_test_environment()
+
+
+class QueryCounter:
+    """Count queries on the default connection (no cap, unlike query logging)"""
+    
+    def __init__(self):
+        self.count = 0
+    
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+    
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+
+class Command(BaseCommand):
+    help = (
+        "Offline load test of the SMS and USSD webhooks. Runs against a throwaway test "
+        "database, a local cache and a local fake Africa's Talking endpoint, and fails "
+        "when throughput, latency or queries per message regress."
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help="Inbound SMS to replay")
+        parser.add_argument('--sessions', type=int, default=300, help="USSD sessions to replay")
+        parser.add_argument('--trees', type=int, default=200, help="Trees to seed")
+        parser.add_argument('--users', type=int, default=500, help="Registered users to seed")
+        parser.add_argument('--duplicate-rate', type=float, default=0.05,
+                            help="Share of deliveries the provider retries")
+        parser.add_argument('--seed', type=int, default=1, help="Random seed for the traffic mix")
+        parser.add_argument('--min-throughput', type=float, default=150.0,
+                            help="Minimum SMS webhook requests per second")
+        parser.add_argument('--max-sms-p95-ms', type=float, default=30.0, help="SMS webhook p95 limit")
+        parser.add_argument('--max-ussd-p95-ms', type=float, default=40.0, help="USSD hop p95 limit")
+        parser.add_argument('--max-sms-queries', type=float, default=6.0,
+                            help="DB queries per SMS webhook request")
+        parser.add_argument('--max-drain-queries', type=float, default=0.5,
+                            help="DB queries per message in the batched drain")
+        parser.add_argument('--max-ussd-queries', type=float, default=2.0, help="DB queries per USSD hop")
+    
+    def handle(self, *args, **options):
+        always_eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+        
+        try:
+            with test_database('webhook_load_test'), FakeAfricasTalking() as telco, \
+                    override_settings(CACHES=LOCAL_CACHES), mock.patch.dict(os.environ, {
+                        'AFRICAS_TALKING_USERNAME': 'loadtest',
+                        'AFRICAS_TALKING_API_KEY': 'loadtest',
+                        'AFRICAS_TALKING_BASE_URL': telco.url,
+                    }):
+                failures = self._run(telco, options)
+        finally:
+            app.conf.task_always_eager = always_eager
+        
+        if failures:
+            raise CommandError("Webhook load test regressed:\n  " + "\n  ".join(failures))
+        self.stdout.write(self.style.SUCCESS("Webhook load test passed"))
+    
+    def _seed(self, options):
+        from trees.models import Tree, TreeSpecies
+        from users.models import User
+        
+        species = TreeSpecies.objects.create(
+            name='Mukau', scientific_name='Melia volkensii', description='', risk_level='endangered',
+            native_region='Eastern Kenya', characteristics='', conservation_importance='', threats=''
+        )
+        tree_ids = [f'LOAD-{i:05d}' for i in range(options['trees'])]
+        Tree.objects.bulk_create([
+            Tree(
+                species=species, tree_id=tree_id, tree_key=Tree.normalize_tree_id(tree_id),
+                latitude=-1.2, longitude=36.8, location_name='Karura Forest'
+            )
+            for tree_id in tree_ids
+        ])
+        
+        phones = [f'+2547{i:08d}' for i in range(options['users'])]
+        User.objects.create(username='loadtest-admin', user_type='admin')
+        User.objects.bulk_create([
+            User(username=f'loadtest-{i}', phone_number=phone, phone_e164=phone)
+            for i, phone in enumerate(phones)
+        ])
+        return tree_ids, phones
+    
+    def _sms_traffic(self, rng, tree_ids, phones, options):
+        deliveries = []
+        for i in range(options['messages']):
+            if deliveries and rng.random() < options['duplicate_rate']:
+                deliveries.append(rng.choice(deliveries))
+                continue
+            
+            phone = rng.choice(phones) if rng.random() < 0.7 else f'+2541{rng.randrange(10 ** 8):08d}'
+            tree_id = rng.choice(tree_ids) if rng.random() < 0.9 else 'NO-SUCH-TREE'
+            text = rng.choices([
+                f'REPORT {tree_id} {rng.choice(["fire", "logging", "poaching", "damage"])} Seen near the gate',
+                f'STATUS {tree_id.lower()}',
+                f'ADOPT {tree_id}',
+                'HELP',
+            ], weights=[30, 45, 20, 5])[0]
+            deliveries.append({'id': f'ATXid_load_{i}', 'from': phone, 'text': text})
+        return deliveries
+    
+    def _ussd_traffic(self, rng, tree_ids, phones, options):
+        sessions = []
+        for i in range(options['sessions']):
+            flow = rng.choices(list(USSD_FLOWS), weights=[35, 40, 15, 10])[0]
+            sessions.append({
+                'sessionId': f'ATUid_load_{i}',
+                'phoneNumber': rng.choice(phones),
+                'hops': USSD_FLOWS[flow](rng.choice(tree_ids)),
+            })
+        
+        # Interleave hops of concurrent sessions, ten at a time
+        hops = []
+        for start in range(0, len(sessions), 10):
+            active = sessions[start:start + 10]
+            for position in range(max(len(s['hops']) for s in active)):
+                for session in active:
+                    if position < len(session['hops']):
+                        hop = {
+                            'sessionId': session['sessionId'],
+                            'phoneNumber': session['phoneNumber'],
+                            'text': session['hops'][position],
+                        }
+                        hops.append(hop)
+                        if rng.random() < options['duplicate_rate']:
+                            hops.append(hop)
+        return hops
+    
+    def _replay(self, client, path, payloads):
+        latencies = []
+        with QueryCounter() as queries:
+            started = time.perf_counter()
+            for payload in payloads:
+                sent = time.perf_counter()
+                response = client.post(path, payload)
+                latencies.append((time.perf_counter() - sent) * 1000)
+                if response.status_code != 200:
+                    raise CommandError(f"{path} returned {response.status_code}: {response.content[:200]!r}")
+            elapsed = time.perf_counter() - started
+        return latencies, elapsed, queries.count
+    
+    def _report(self, label, latencies, elapsed, queries):
+        count = len(latencies)
+        self.stdout.write(
+            f"{label:<6} {count:6d} req {count / elapsed:8.1f} req/s "
+            f"p50={percentile(latencies, 50):6.2f}ms p95={percentile(latencies, 95):6.2f}ms "
+            f"p99={percentile(latencies, 99):6.2f}ms queries/req={queries / count:5.2f}"
+        )
+    
+    def _run(self, telco, options):
+        from django.core.cache import cache
+        from monitoring.inbound import drain_inbound_messages
+        from monitoring.models import InboundMessage, IncidentReport
+        
+        rng = random.Random(options['seed'])
+        tree_ids, phones = self._seed(options)
+        sms_deliveries = self._sms_traffic(rng, tree_ids, phones, options)
+        ussd_hops = self._ussd_traffic(rng, tree_ids, phones, options)
+        client = Client()
+        failures = []
+        
+        # Load URLconf and view modules before timing anything
+        client.post('/api/sms/webhook/', {})
+        client.post('/api/ussd/webhook/', {})
+        
+        # In production the drain runs on a worker; hold it back so the SMS
+        # numbers measure the webhook alone, then drain as its own phase.
+        cache.set('inbound-drain-scheduled', 1, None)
+        sms_latencies, sms_elapsed, sms_queries = self._replay(client, '/api/sms/webhook/', sms_deliveries)
+        self._report("sms", sms_latencies, sms_elapsed, sms_queries)
+        
+        stored = InboundMessage.objects.count()
+        unique_deliveries = len({delivery['id'] for delivery in sms_deliveries})
+        if stored != unique_deliveries:
+            failures.append(f"{stored} inbound messages stored for {unique_deliveries} unique deliveries")
+        
+        with QueryCounter() as drain_queries, contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            drained = drain_inbound_messages()
+            drain_elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"drain  {drained:6d} msg {drained / drain_elapsed:8.1f} msg/s "
+            f"queries/msg={drain_queries.count / max(drained, 1):5.2f} "
+            f"outbound={len(telco.requests)} requests/{telco.recipients_count} recipients"
+        )
+        if telco.recipients_count < drained:
+            failures.append(f"only {telco.recipients_count} replies sent for {drained} messages")
+        
+        incidents_before = IncidentReport.objects.count()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ussd_latencies, ussd_elapsed, ussd_queries = self._replay(client, '/api/ussd/webhook/', ussd_hops)
+        self._report("ussd", ussd_latencies, ussd_elapsed, ussd_queries)
+        
+        submitted = sum(1 for hop in ussd_hops if hop['text'].count('*') == 3)
+        unique_submitted = len({hop['sessionId'] for hop in ussd_hops if hop['text'].count('*') == 3})
+        ussd_incidents = IncidentReport.objects.count() - incidents_before
+        self.stdout.write(f"ussd   {submitted} report hops, {unique_submitted} sessions, {ussd_incidents} incidents")
+        if ussd_incidents != unique_submitted:
+            failures.append(f"{ussd_incidents} USSD incidents for {unique_submitted} report sessions")
+        
+        sms_rate = len(sms_latencies) / sms_elapsed
+        checks = [
+            (sms_rate >= options['min_throughput'],
+             f"SMS throughput {sms_rate:.1f} req/s < {options['min_throughput']:.1f}"),
+            (percentile(sms_latencies, 95) <= options['max_sms_p95_ms'],
+             f"SMS p95 {percentile(sms_latencies, 95):.2f}ms > {options['max_sms_p95_ms']:.2f}ms"),
+            (percentile(ussd_latencies, 95) <= options['max_ussd_p95_ms'],
+             f"USSD p95 {percentile(ussd_latencies, 95):.2f}ms > {options['max_ussd_p95_ms']:.2f}ms"),
+            (sms_queries / len(sms_latencies) <= options['max_sms_queries'],
+             f"SMS queries/req {sms_queries / len(sms_latencies):.2f} > {options['max_sms_queries']:.2f}"),
+            (drain_queries.count / max(drained, 1) <= options['max_drain_queries'],
+             f"drain queries/msg {drain_queries.count / max(drained, 1):.2f} > {options['max_drain_queries']:.2f}"),
+            (ussd_queries / len(ussd_latencies) <= options['max_ussd_queries'],
+             f"USSD queries/hop {ussd_queries / len(ussd_latencies):.2f} > {options['max_ussd_queries']:.2f}"),
+        ]
+        failures.extend(message for ok, message in checks if not ok)
+        return failures
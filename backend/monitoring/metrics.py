@@ -0,0 +1,120 @@
+"""
+Lightweight operational counters kept in the shared cache
+Used for job health (skipped runs, cache hit rates, provider latency).
+"""
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.redis import RedisCache
+
+METRICS_INDEX_KEY = 'metrics:index'
+# Redis keeps the index as a native set, so concurrent SADDs never lose names
+METRICS_INDEX_SET_KEY = 'metrics:index:set'
+
+# Upper bounds (ms) of latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = [25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+def _key(name):
+    return f'metrics:{name}'
+
+
+def _redis_index():
+    """Return (client, key) for the Redis index set, or None on other backends"""
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    if not isinstance(backend, RedisCache):
+        return None
+    key = backend.make_and_validate_key(METRICS_INDEX_SET_KEY)
+    return backend._cache.get_client(key, write=True), key
+
+
+def _names():
+    redis_index = _redis_index()
+    if redis_index:
+        client, key = redis_index
+        return {name.decode() for name in client.smembers(key)}
+    return cache.get(METRICS_INDEX_KEY) or set()
+
+
+def _register(name):
+    """
+    Add a counter name to the index
+    
+    Called on every increment: on backends without sets the read-modify-write
+    below can lose a name to a concurrent writer, and the next increment of
+    that counter puts it back.
+    """
+    redis_index = _redis_index()
+    if redis_index:
+        client, key = redis_index
+        client.sadd(key, name)
+        return
+    names = cache.get(METRICS_INDEX_KEY) or set()
+    if name not in names:
+        names.add(name)
+        cache.set(METRICS_INDEX_KEY, names, None)
+
+
+def incr(name, amount=1):
+    """Increment a named counter, creating it on first use"""
+    key = _key(name)
+    if cache.add(key, amount, None):
+        value = amount
+    else:
+        try:
+            value = cache.incr(key, amount)
+        except ValueError:
+            # Counter expired or was evicted between add() and incr()
+            cache.set(key, amount, None)
+            value = amount
+    _register(name)
+    return value
+
+
+def get(name, default=0):
+    return cache.get(_key(name), default)
+
+
+def snapshot(prefix=''):
+    """Return all known counters, optionally limited to a name prefix"""
+    names = sorted(n for n in _names() if n.startswith(prefix))
+    values = cache.get_many([_key(n) for n in names])
+    return {n: values.get(_key(n), 0) for n in names}
+
+
+def hit_rates(counters):
+    """Derive `<name>.hit_rate` for every `<name>.hits` / `<name>.misses` pair in a snapshot"""
+    rates = {}
+    for counter, hits in counters.items():
+        if not counter.endswith('.hits'):
+            continue
+        name = counter[:-len('.hits')]
+        total = hits + counters.get(f'{name}.misses', 0)
+        if total:
+            rates[f'{name}.hit_rate'] = round(hits / total, 4)
+    return rates
+
+
+def observe(name, value_ms):
+    """Record one latency sample in a bucketed histogram"""
+    bucket = next((f'le_{bound}' for bound in LATENCY_BUCKETS_MS if value_ms <= bound), 'le_inf')
+    incr(f'{name}.{bucket}')
+    incr(f'{name}.count')
+    incr(f'{name}.sum_ms', int(round(value_ms)))
+
+
+def histogram(name):
+    """Return bucket counts, sample count and mean for a histogram"""
+    buckets = [f'le_{bound}' for bound in LATENCY_BUCKETS_MS] + ['le_inf']
+    values = cache.get_many([_key(f'{name}.{field}') for field in buckets + ['count', 'sum_ms']])
+    count = values.get(_key(f'{name}.count'), 0)
+    return {
+        'buckets': {bucket: values.get(_key(f'{name}.{bucket}'), 0) for bucket in buckets},
+        'count': count,
+        'mean_ms': values.get(_key(f'{name}.sum_ms'), 0) / count if count else None,
+    }
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
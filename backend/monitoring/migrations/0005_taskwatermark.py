@@ -0,0 +1,22 @@
+# Generated by Django 5.0.14 on 2026-10-19 00:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0004_add_notification_sent_to_alert'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('position', models.BigIntegerField(default=0, help_text='Highest primary key already processed')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.14 on 2026-10-19 00:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0005_taskwatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('total_trees', models.IntegerField(default=0)),
+                ('healthy_trees', models.IntegerField(default=0)),
+                ('stressed_trees', models.IntegerField(default=0)),
+                ('diseased_trees', models.IntegerField(default=0)),
+                ('critical_trees', models.IntegerField(default=0)),
+                ('deceased_trees', models.IntegerField(default=0)),
+                ('active_alerts', models.IntegerField(default=0)),
+                ('critical_alerts', models.IntegerField(default=0)),
+                ('reports_count', models.IntegerField(default=0, help_text='Tree reports submitted on this day')),
+                ('incidents_count', models.IntegerField(default=0, help_text='Incident reports submitted on this day')),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily Stats',
+                'ordering': ['-date'],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.14 on 2026-10-19 00:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0007_inboundmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('sms', 'SMS'), ('ussd', 'USSD'), ('mpesa', 'M-Pesa Callback')], max_length=10)),
+                ('key', models.CharField(max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='webhookreceipt',
+            constraint=models.UniqueConstraint(fields=('source', 'key'), name='unique_webhook_receipt'),
+        ),
+    ]
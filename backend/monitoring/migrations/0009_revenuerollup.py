@@ -0,0 +1,33 @@
+# Generated by Django 5.0.14 on 2026-10-19 00:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0008_webhookreceipt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('dimension', models.CharField(choices=[('day', 'Day Total'), ('species', 'Species'), ('forest', 'Forest')], max_length=10)),
+                ('key', models.CharField(blank=True, help_text='Species or forest name; empty for day totals', max_length=200)),
+                ('source', models.CharField(choices=[('adoption', 'Tree Adoptions'), ('campaign', 'Campaign Contributions')], max_length=10)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('transactions', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-date', 'dimension', 'key'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='revenuerollup',
+            constraint=models.UniqueConstraint(fields=('dimension', 'source', 'date', 'key'), name='unique_revenue_rollup'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.14 on 2026-10-19 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0010_analysisjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageAnalysisCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('phash', models.CharField(blank=True, max_length=16)),
+                ('phash_band0', models.CharField(blank=True, db_index=True, max_length=4)),
+                ('phash_band1', models.CharField(blank=True, db_index=True, max_length=4)),
+                ('phash_band2', models.CharField(blank=True, db_index=True, max_length=4)),
+                ('phash_band3', models.CharField(blank=True, db_index=True, max_length=4)),
+                ('result', models.JSONField(help_text='analyze_tree_image() result')),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Image analysis cache',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='treereport',
+            name='image_phash',
+            field=models.CharField(blank=True, help_text='Perceptual (difference) hash of the image', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='treereport',
+            name='image_sha256',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-256 of the uploaded image', max_length=64),
+        ),
+    ]
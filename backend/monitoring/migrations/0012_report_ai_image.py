@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-19 01:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0011_image_analysis_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='treereport',
+            name='ai_image',
+            field=models.ImageField(blank=True, help_text='Downscaled copy sent for AI analysis', null=True, upload_to='reports/ai/'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.0.14 on 2026-10-19 01:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0012_report_ai_image'),
+        ('trees', '0007_payment_initiating'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='treereport',
+            index=models.Index(condition=models.Q(('image__gt', '')), fields=['id'], name='report_with_image'),
+        ),
+    ]
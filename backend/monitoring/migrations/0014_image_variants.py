@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-19 01:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0013_report_with_image_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='treereport',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, help_text='Responsive copies of the image'),
+        ),
+    ]
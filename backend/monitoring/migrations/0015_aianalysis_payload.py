@@ -0,0 +1,75 @@
+import json
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_raw_analysis(apps, schema_editor):
+    AIAnalysis = apps.get_model('monitoring', 'AIAnalysis')
+    AIAnalysisPayload = apps.get_model('monitoring', 'AIAnalysisPayload')
+    batch = []
+    triage_ids = []
+    for analysis in AIAnalysis.objects.only('id', 'raw_analysis').iterator(chunk_size=500):
+        if analysis.raw_analysis.get('source') == 'triage':
+            triage_ids.append(analysis.id)
+        # Rows already stripped by the retention job have nothing to keep
+        if not analysis.raw_analysis:
+            continue
+        encoded = json.dumps(analysis.raw_analysis, separators=(',', ':')).encode('utf-8')
+        batch.append(AIAnalysisPayload(analysis_id=analysis.id, data=zlib.compress(encoded, 6), size=len(encoded)))
+        if len(batch) >= 500:
+            AIAnalysisPayload.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        AIAnalysisPayload.objects.bulk_create(batch)
+    
+    AIAnalysis.objects.filter(id__in=triage_ids).update(source='triage')
+    # Payloads age with their analysis for retention
+    AIAnalysisPayload.objects.update(updated_at=models.Subquery(
+        AIAnalysis.objects.filter(pk=models.OuterRef('analysis_id')).values('analyzed_at')[:1]
+    ))
+
+
+def restore_raw_analysis(apps, schema_editor):
+    AIAnalysis = apps.get_model('monitoring', 'AIAnalysis')
+    AIAnalysisPayload = apps.get_model('monitoring', 'AIAnalysisPayload')
+    for payload in AIAnalysisPayload.objects.iterator(chunk_size=500):
+        AIAnalysis.objects.filter(pk=payload.analysis_id).update(
+            raw_analysis=json.loads(zlib.decompress(bytes(payload.data)))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0014_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIAnalysisPayload',
+            fields=[
+                ('analysis', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payload', serialize=False, to='monitoring.aianalysis')),
+                ('data', models.BinaryField(help_text='zlib-compressed JSON')),
+                ('size', models.PositiveIntegerField(help_text='Uncompressed size in bytes')),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='aianalysis',
+            name='source',
+            field=models.CharField(choices=[('gemini', 'Gemini'), ('triage', 'Local Triage')], default='gemini', max_length=10),
+        ),
+        # Gives the column a default so unapplying can re-add it to existing rows
+        migrations.AlterField(
+            model_name='aianalysis',
+            name='raw_analysis',
+            field=models.JSONField(default=dict, help_text='Raw API response from Gemini'),
+        ),
+        migrations.RunPython(move_raw_analysis, restore_raw_analysis),
+        migrations.RemoveField(
+            model_name='aianalysis',
+            name='raw_analysis',
+        ),
+    ]
@@ -1,3 +1,6 @@
+import json
+import zlib
+
 from django.db import models
 from django.conf import settings
 from trees.models import Tree
@@ -29,6 +32,8 @@ class TreeReport(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
     image = models.ImageField(upload_to='reports/', blank=True, null=True)
+    ai_image = models.ImageField(upload_to='reports/ai/', blank=True, null=True, help_text="Downscaled copy sent for AI analysis")
+    image_variants = models.JSONField(default=dict, blank=True, help_text="Responsive copies of the image")
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
@@ -41,14 +46,47 @@ class TreeReport(models.Model):
     )
     verified_at = models.DateTimeField(null=True, blank=True)
     ranger_notes = models.TextField(blank=True, help_text="Notes from ranger verification")
+    image_sha256 = models.CharField(max_length=64, blank=True, db_index=True, help_text="SHA-256 of the uploaded image")
+    image_phash = models.CharField(max_length=16, blank=True, help_text="Perceptual (difference) hash of the image")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"{self.get_report_type_display()} - {self.tree.tree_id} by {self.reporter.username}"
     
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        image_written = update_fields is None or 'image' in update_fields
+        
+        new_image = image_written and bool(self.image) and not self.image._committed
+        if image_written:
+            if not self.image:
+                self.ai_image = None
+                self.image_sha256 = self.image_phash = ''
+                self.image_variants = {}
+            elif new_image:
+                # Preprocess and fingerprint new uploads before they reach storage
+                from .image_cache import fingerprint_image
+                from .images import ai_variant, preprocess_upload
+                self.image = preprocess_upload(self.image)
+                self.ai_image = ai_variant(self.image)
+                self.image_sha256, self.image_phash = fingerprint_image(self.image)
+                self.image_variants = {}
+            if update_fields is not None:
+                kwargs['update_fields'] = list(update_fields) + ['ai_image', 'image_sha256', 'image_phash', 'image_variants']
+        
+        super().save(*args, **kwargs)
+        
+        if new_image:
+            from .thumbnails import queue_variants
+            queue_variants(self, 'image')
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Backlog scans for reports awaiting AI analysis
+            models.Index(fields=['id'], condition=models.Q(image__gt=''), name='report_with_image'),
+        ]
 
 
 class AIAnalysis(models.Model):
@@ -62,22 +100,148 @@ class AIAnalysis(models.Model):
         ('unknown', 'Unknown'),
     ]
     
+    SOURCE_CHOICES = [
+        ('gemini', 'Gemini'),
+        ('triage', 'Local Triage'),
+    ]
+    
     report = models.OneToOneField(TreeReport, on_delete=models.CASCADE, related_name='ai_analysis')
     health_assessment = models.CharField(max_length=20, choices=HEALTH_ASSESSMENT_CHOICES)
     confidence_score = models.DecimalField(max_digits=5, decimal_places=2, help_text="Confidence percentage")
     detected_issues = models.JSONField(default=list, help_text="List of detected issues")
     recommendations = models.TextField(help_text="AI-generated recommendations")
-    raw_analysis = models.JSONField(help_text="Raw API response from Gemini")
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default='gemini')
     analyzed_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"AI Analysis for Report #{self.report.id} - {self.get_health_assessment_display()}"
     
+    @property
+    def raw_analysis(self):
+        """
+        Full analysis result including Gemini's raw response
+        
+        Kept compressed in AIAnalysisPayload and only loaded when read.
+        """
+        if not hasattr(self, '_raw_analysis'):
+            payload = AIAnalysisPayload.objects.filter(analysis_id=self.pk).first() if self.pk else None
+            self._raw_analysis = payload.load() if payload else {}
+        return self._raw_analysis
+    
+    @raw_analysis.setter
+    def raw_analysis(self, value):
+        self._raw_analysis = value
+        self._raw_analysis_changed = True
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if getattr(self, '_raw_analysis_changed', False):
+            AIAnalysisPayload.store(self.pk, self._raw_analysis)
+            self._raw_analysis_changed = False
+    
     class Meta:
         verbose_name_plural = "AI Analyses"
         ordering = ['-analyzed_at']
 
 
+class AIAnalysisPayload(models.Model):
+    """Compressed raw result of an AIAnalysis, kept off the analysis row"""
+    
+    analysis = models.OneToOneField(AIAnalysis, on_delete=models.CASCADE, primary_key=True, related_name='payload')
+    data = models.BinaryField(help_text="zlib-compressed JSON")
+    size = models.PositiveIntegerField(help_text="Uncompressed size in bytes")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    def __str__(self):
+        return f"Raw analysis for AI Analysis #{self.analysis_id} ({self.size} bytes)"
+    
+    @staticmethod
+    def compress(raw_analysis):
+        """Returns (compressed bytes, uncompressed size)"""
+        encoded = json.dumps(raw_analysis, separators=(',', ':')).encode('utf-8')
+        return zlib.compress(encoded, 6), len(encoded)
+    
+    def load(self):
+        return json.loads(zlib.decompress(bytes(self.data)))
+    
+    @classmethod
+    def store(cls, analysis_id, raw_analysis):
+        data, size = cls.compress(raw_analysis)
+        cls.objects.update_or_create(analysis_id=analysis_id, defaults={'data': data, 'size': size})
+
+
+class ImageAnalysisCache(models.Model):
+    """Gemini result for an image fingerprint, reused for identical or near-identical uploads"""
+    
+    sha256 = models.CharField(max_length=64, unique=True)
+    phash = models.CharField(max_length=16, blank=True)
+    # The perceptual hash split in four, so near matches are found through indexes
+    phash_band0 = models.CharField(max_length=4, blank=True, db_index=True)
+    phash_band1 = models.CharField(max_length=4, blank=True, db_index=True)
+    phash_band2 = models.CharField(max_length=4, blank=True, db_index=True)
+    phash_band3 = models.CharField(max_length=4, blank=True, db_index=True)
+    result = models.JSONField(help_text="analyze_tree_image() result")
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_hit_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.result.get('health_assessment')}, {self.hits} hits)"
+    
+    class Meta:
+        verbose_name_plural = "Image analysis cache"
+        ordering = ['-created_at']
+
+
+class AnalysisJob(models.Model):
+    """AI analysis of a report image, run in the background on the ai queue"""
+    
+    KIND_CHOICES = [
+        ('analyze', 'Report Analysis'),
+        ('analyze_ai', 'Ranger Dashboard Analysis'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    
+    ACTIVE_STATUSES = ['queued', 'running']
+    
+    report = models.ForeignKey(TreeReport, on_delete=models.CASCADE, related_name='analysis_jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='analyze')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='analysis_jobs'
+    )
+    analysis = models.ForeignKey(AIAnalysis, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    result = models.JSONField(null=True, blank=True, help_text="Response handed to the client once finished")
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Analysis job #{self.id} for Report #{self.report_id} - {self.status}"
+    
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # Repeated submissions for a report collapse into the job in flight
+            models.UniqueConstraint(
+                fields=['report'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='one_active_analysis_job'
+            ),
+        ]
+
+
 class Alert(models.Model):
     """System alerts for tree threats"""
     
@@ -158,7 +322,152 @@ class IncidentReport(models.Model):
     def __str__(self):
         return f"{self.get_incident_type_display()} - {self.location_name}"
     
+    def save(self, *args, **kwargs):
+        if self.image and not self.image._committed:
+            from .images import preprocess_upload
+            self.image = preprocess_upload(self.image)
+        super().save(*args, **kwargs)
+    
     class Meta:
         ordering = ['-created_at']
         verbose_name = "Incident Report"
         verbose_name_plural = "Incident Reports"
+
+
+class TaskWatermark(models.Model):
+    """Last processed position of an incremental background job"""
+    
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0, help_text="Highest primary key already processed")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+    
+    @classmethod
+    def get_position(cls, name):
+        watermark, _ = cls.objects.get_or_create(name=name)
+        return watermark.position
+    
+    @classmethod
+    def reset(cls, name):
+        """Start the job over from the beginning"""
+        from django.utils import timezone
+        
+        cls.objects.filter(name=name).update(position=0, updated_at=timezone.now())
+    
+    @classmethod
+    def advance(cls, name, position):
+        """Move the watermark forward; never moves it backwards"""
+        from django.utils import timezone
+        
+        cls.objects.get_or_create(name=name)
+        cls.objects.filter(name=name, position__lt=position).update(
+            position=position, updated_at=timezone.now()
+        )
+
+
+class DailyStats(models.Model):
+    """Precomputed per-day platform statistics for the ranger dashboard"""
+    
+    date = models.DateField(unique=True)
+    total_trees = models.IntegerField(default=0)
+    healthy_trees = models.IntegerField(default=0)
+    stressed_trees = models.IntegerField(default=0)
+    diseased_trees = models.IntegerField(default=0)
+    critical_trees = models.IntegerField(default=0)
+    deceased_trees = models.IntegerField(default=0)
+    active_alerts = models.IntegerField(default=0)
+    critical_alerts = models.IntegerField(default=0)
+    reports_count = models.IntegerField(default=0, help_text="Tree reports submitted on this day")
+    incidents_count = models.IntegerField(default=0, help_text="Incident reports submitted on this day")
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Daily stats for {self.date}"
+    
+    class Meta:
+        verbose_name_plural = "Daily Stats"
+        ordering = ['-date']
+
+
+class InboundMessage(models.Model):
+    """Raw inbound SMS, stored by the webhook and processed in batches"""
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+    
+    provider_message_id = models.CharField(max_length=100, blank=True)
+    phone_number = models.CharField(max_length=20)
+    text = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"SMS from {self.phone_number} ({self.status})"
+    
+    class Meta:
+        ordering = ['-received_at']
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+
+class WebhookReceipt(models.Model):
+    """Provider delivery that has already been handled, used to drop retries"""
+    
+    SOURCE_CHOICES = [
+        ('sms', 'SMS'),
+        ('ussd', 'USSD'),
+        ('mpesa', 'M-Pesa Callback'),
+    ]
+    
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    key = models.CharField(max_length=200)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    def __str__(self):
+        return f"{self.source}:{self.key}"
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'key'], name='unique_webhook_receipt'),
+        ]
+
+
+class RevenueRollup(models.Model):
+    """Precomputed revenue per day, in total or split by species or forest"""
+    
+    DIMENSION_CHOICES = [
+        ('day', 'Day Total'),
+        ('species', 'Species'),
+        ('forest', 'Forest'),
+    ]
+    
+    SOURCE_CHOICES = [
+        ('adoption', 'Tree Adoptions'),
+        ('campaign', 'Campaign Contributions'),
+    ]
+    
+    date = models.DateField()
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    key = models.CharField(max_length=200, blank=True, help_text="Species or forest name; empty for day totals")
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    transactions = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.date} {self.dimension}:{self.key} {self.source} KES {self.amount}"
+    
+    class Meta:
+        ordering = ['-date', 'dimension', 'key']
+        constraints = [
+            # Also serves date-range reads for one dimension and source
+            models.UniqueConstraint(fields=['dimension', 'source', 'date', 'key'], name='unique_revenue_rollup'),
+        ]
@@ -1,10 +1,28 @@
 # M-Pesa Payment Integration
-import requests
 import base64
+import hashlib
+import time
 from datetime import datetime
 from django.conf import settings
+from django.core.cache import cache
 import os
 
+from .http_client import get_client
+from .locks import CacheLock
+from . import metrics
+
+# Seconds before expires_in at which a cached token is no longer handed out
+TOKEN_EXPIRY_MARGIN = 60
+# Seconds a worker waits for another worker's refresh before fetching itself
+TOKEN_WAIT = 5
+
+# STK query ResultCode -> Payment status; any other code is a failure
+TRANSACTION_STATES = {
+    '0': 'completed',
+    '1032': 'cancelled',  # Request cancelled by the customer
+}
+
+
 class MpesaService:
     """
     M-Pesa STK Push Integration for Tree Adoption Payments
@@ -18,12 +36,72 @@ class MpesaService:
         self.callback_url = os.getenv('MPESA_CALLBACK_URL', 'https://yourdomain.com/api/mpesa/callback/')
         
         # Sandbox URLs (change to production when live)
-        self.base_url = 'https://sandbox.safaricom.co.ke'
+        self.base_url = os.getenv('MPESA_BASE_URL', 'https://sandbox.safaricom.co.ke').rstrip('/')
         self.access_token_url = f'{self.base_url}/oauth/v1/generate?grant_type=client_credentials'
         self.stk_push_url = f'{self.base_url}/mpesa/stkpush/v1/processrequest'
+        self.stk_query_url = f'{self.base_url}/mpesa/stkpushquery/v1/query'
+        
+        # Pooled, time-limited calls with a circuit breaker shared by the process
+        self.http = get_client('mpesa')
+        
+        # Tokens are per credential set, so keys never mix sandbox and live apps
+        credentials_id = hashlib.sha1(f"{self.base_url}:{self.consumer_key}".encode()).hexdigest()[:16]
+        self.token_cache_key = f'mpesa:token:{credentials_id}'
+        self.token_lock_key = f'mpesa:token-lock:{credentials_id}'
     
     def get_access_token(self):
-        """Get OAuth access token from M-Pesa API"""
+        """
+        Get an OAuth access token, shared by all workers through the cache
+        
+        Tokens are reused until shortly before they expire. Inside the
+        refresh-ahead window the cached token is still returned and a refresh
+        is queued, so request paths only wait when there is no usable token.
+        """
+        cached = cache.get(self.token_cache_key)
+        now = time.time()
+        
+        if cached and now < cached['expires_at']:
+            if now >= cached['refresh_at']:
+                self._schedule_refresh()
+            metrics.incr('mpesa.token.hits')
+            return cached['token']
+        
+        metrics.incr('mpesa.token.misses')
+        return self.refresh_access_token(wait=True)
+    
+    def refresh_access_token(self, wait=False):
+        """
+        Fetch a new token from Daraja and cache it
+        
+        Only one worker refreshes at a time. With wait=True, a worker that
+        loses the race waits briefly for the winner's token instead of
+        fetching its own.
+        """
+        lock = CacheLock(self.token_lock_key, ttl=30)
+        if not lock.acquire():
+            if not wait:
+                return None
+            deadline = time.time() + TOKEN_WAIT
+            while time.time() < deadline:
+                time.sleep(0.1)
+                cached = cache.get(self.token_cache_key)
+                if cached and time.time() < cached['expires_at']:
+                    return cached['token']
+            # The refreshing worker is stuck; fetch without the lock
+            return self._fetch_access_token()
+        
+        try:
+            return self._fetch_access_token()
+        finally:
+            lock.release()
+    
+    def _schedule_refresh(self):
+        # Queue at most one refresh per window; the task takes the lock itself
+        if cache.add(f'{self.token_lock_key}:scheduled', 1, 60):
+            from .tasks import refresh_mpesa_token
+            refresh_mpesa_token.delay()
+    
+    def _fetch_access_token(self):
         try:
             auth_string = f"{self.consumer_key}:{self.consumer_secret}"
             encoded_auth = base64.b64encode(auth_string.encode()).decode()
@@ -32,10 +110,24 @@ class MpesaService:
                 'Authorization': f'Basic {encoded_auth}'
             }
             
-            response = requests.get(self.access_token_url, headers=headers)
+            response = self.http.get(self.access_token_url, headers=headers)
             response.raise_for_status()
             
-            return response.json().get('access_token')
+            result = response.json()
+            token = result.get('access_token')
+            if not token:
+                return None
+            
+            expires_in = int(result.get('expires_in', 3599))
+            now = time.time()
+            expires_at = now + max(expires_in - TOKEN_EXPIRY_MARGIN, 0)
+            cache.set(self.token_cache_key, {
+                'token': token,
+                'expires_at': expires_at,
+                'refresh_at': max(expires_at - settings.MPESA_TOKEN_REFRESH_AHEAD, now),
+            }, max(int(expires_at - now), 1))
+            metrics.incr('mpesa.token.refreshes')
+            return token
         except Exception as e:
             print(f"Error getting access token: {e}")
             return None
@@ -90,7 +182,7 @@ class MpesaService:
         }
         
         try:
-            response = requests.post(self.stk_push_url, json=payload, headers=headers)
+            response = self.http.post(self.stk_push_url, json=payload, headers=headers)
             response.raise_for_status()
             
             result = response.json()
@@ -115,6 +207,66 @@ class MpesaService:
             }
     
     def query_transaction_status(self, checkout_request_id):
-        """Query the status of a transaction"""
-        # Implementation for checking transaction status
-        pass
+        """
+        Query the status of an STK push transaction
+        
+        Args:
+            checkout_request_id (str): CheckoutRequestID returned by the STK push
+        
+        Returns:
+            dict: state ('completed', 'failed', 'cancelled', 'pending' or
+            'error'), Daraja result code and description
+        """
+        access_token = self.get_access_token()
+        
+        if not access_token:
+            return {
+                'state': 'error',
+                'result_code': None,
+                'result_description': 'Failed to get access token'
+            }
+        
+        password, timestamp = self.generate_password()
+        
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        }
+        
+        payload = {
+            'BusinessShortCode': self.business_shortcode,
+            'Password': password,
+            'Timestamp': timestamp,
+            'CheckoutRequestID': checkout_request_id
+        }
+        
+        try:
+            # A status query has no side effects, so it is safe to retry. Daraja
+            # reports "still being processed" as a 500, which is not an outage.
+            response = self.http.post(
+                self.stk_query_url, json=payload, headers=headers,
+                idempotent=True, expected_statuses=(500,)
+            )
+            result = response.json()
+        except Exception as e:
+            return {
+                'state': 'error',
+                'result_code': None,
+                'result_description': f'Error querying transaction: {str(e)}'
+            }
+        
+        if 'ResultCode' not in result:
+            # Daraja answers with an error body while the customer has not responded yet
+            message = result.get('errorMessage', 'Unknown response')
+            return {
+                'state': 'pending' if 'being processed' in message.lower() else 'error',
+                'result_code': result.get('errorCode'),
+                'result_description': message
+            }
+        
+        result_code = str(result['ResultCode'])
+        return {
+            'state': TRANSACTION_STATES.get(result_code, 'failed'),
+            'result_code': result_code,
+            'result_description': result.get('ResultDesc', '')
+        }
@@ -0,0 +1,153 @@
+"""
+M-Pesa payment outcomes
+Shared by the Safaricom callback and the reconciliation job that settles
+payments whose callback never arrived.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from trees.adoption import complete_adoption_request
+from trees.models import AdoptionRequest, Payment
+from .idempotency import claim
+from .mpesa import MpesaService
+from .revenue import record_payments
+
+
+def reconcile_pending_payments(stale_minutes=None, expire_hours=None, limit=None, workers=None):
+    """
+    Settle pending payments whose callback never arrived
+    
+    Pending payments older than `stale_minutes` are queried on Daraja with
+    up to `workers` requests in flight, then updated in one transaction.
+    Payments Daraja still reports as pending after `expire_hours` are
+    marked failed. A query that errors (timeout, open circuit) proves
+    nothing, so the payment is left for the next run.
+    
+    Returns:
+        dict: summary counts and the CheckoutRequestIDs that were corrected
+    """
+    stale_minutes = stale_minutes or settings.MPESA_RECONCILE_AFTER_MINUTES
+    expire_hours = expire_hours or settings.MPESA_PAYMENT_EXPIRY_HOURS
+    limit = limit or settings.MPESA_RECONCILE_BATCH_SIZE
+    workers = workers or settings.MPESA_RECONCILE_CONCURRENCY
+    
+    now = timezone.now()
+    cutoff = now - timedelta(minutes=stale_minutes)
+    unsent = _fail_unsent_payments(cutoff)
+    
+    # Served by the (status, created_at) index
+    stale = list(
+        Payment.objects.filter(status='pending', created_at__lt=cutoff)
+        .order_by('created_at')
+        .values_list('id', 'mpesa_checkout_request_id', 'created_at')[:limit]
+    )
+    
+    summary = {
+        'checked': len(stale),
+        'completed': 0,
+        'failed': 0,
+        'cancelled': 0,
+        'expired': 0,
+        'still_pending': 0,
+        'errors': 0,
+        'unsent': unsent,
+        'corrected': [],
+    }
+    if not stale:
+        return summary
+    
+    mpesa = MpesaService()
+    # Warm the shared token once instead of racing for it in every thread
+    mpesa.get_access_token()
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+            lambda row: mpesa.query_transaction_status(row[1]), stale
+        ))
+    
+    expiry_cutoff = now - timedelta(hours=expire_hours)
+    outcomes = {}
+    for (payment_id, checkout_request_id, created_at), result in zip(stale, results):
+        state = result['state']
+        if state == 'error':
+            summary['errors'] += 1
+            continue
+        if state == 'pending':
+            if created_at >= expiry_cutoff:
+                summary['still_pending'] += 1
+                continue
+            state = 'expired'
+            result = dict(result, result_description='Payment expired without confirmation')
+        outcomes[payment_id] = (state, result)
+    
+    if outcomes:
+        _apply_outcomes(outcomes, summary)
+    return summary
+
+
+def _fail_unsent_payments(cutoff):
+    """Fail payments whose STK push task never ran (lost with its worker)"""
+    with transaction.atomic():
+        ids = list(
+            Payment.objects.select_for_update()
+            .filter(status='initiating', created_at__lt=cutoff)
+            .values_list('id', flat=True)
+        )
+        if not ids:
+            return 0
+        
+        Payment.objects.filter(id__in=ids).update(
+            status='failed', result_description='Payment request was never sent', updated_at=timezone.now()
+        )
+        AdoptionRequest.objects.filter(payment_id__in=ids, status='payment_pending').update(
+            status='payment_failed', updated_at=timezone.now()
+        )
+    return len(ids)
+
+
+def _apply_outcomes(outcomes, summary):
+    with transaction.atomic():
+        # Skip rows a callback settled while Daraja was being queried
+        payments = list(
+            Payment.objects.select_for_update()
+            .filter(id__in=outcomes.keys(), status='pending')
+        )
+        
+        updated = []
+        completed = []
+        failed_ids = []
+        for payment in payments:
+            state, result = outcomes[payment.id]
+            # A late callback for this payment will now be ignored
+            if not claim('mpesa', payment.mpesa_checkout_request_id):
+                continue
+            
+            payment.status = 'failed' if state == 'expired' else state
+            payment.result_description = result['result_description']
+            payment.updated_at = timezone.now()
+            if state == 'completed':
+                payment.transaction_date = timezone.now()
+                completed.append(payment)
+            else:
+                failed_ids.append(payment.id)
+            
+            updated.append(payment)
+            summary[state] += 1
+            summary['corrected'].append(payment.mpesa_checkout_request_id)
+        
+        Payment.objects.bulk_update(
+            updated, ['status', 'result_description', 'transaction_date', 'updated_at']
+        )
+        AdoptionRequest.objects.filter(
+            payment_id__in=failed_ids, status='payment_pending'
+        ).update(status='payment_failed', updated_at=timezone.now())
+        record_payments(completed)
+        
+        for adoption_request_id in AdoptionRequest.objects.filter(
+            payment__in=completed
+        ).values_list('id', flat=True):
+            complete_adoption_request(adoption_request_id)
@@ -0,0 +1,69 @@
+"""
+Provider request quotas shared by every worker
+Quotas live in the shared cache, so web requests, the ai queue and batch
+jobs all draw from the same per-minute allowance of an external API.
+"""
+import random
+import time
+
+from django.core.cache import cache
+
+from . import metrics
+
+
+class RateLimitExceeded(Exception):
+    """No quota became available within the allowed wait"""
+
+
+class SlidingWindowLimiter:
+    """
+    At most `capacity` calls in any `period` seconds
+    
+    Each call holds one of `capacity` slots in the shared cache for
+    `period` seconds. Taking a slot is a single atomic cache.add, so the
+    limit holds across processes and, unlike a per-minute counter, a burst
+    at the end of one minute cannot be repeated at the start of the next.
+    Callers can leave `reserve` slots untouched, which lets background
+    jobs yield to interactive requests.
+    """
+    
+    def __init__(self, name, capacity, period=60):
+        self.name = name
+        self.capacity = capacity
+        self.period = period
+    
+    def _slot_keys(self, reserve):
+        return [f'ratelimit:{self.name}:{slot}' for slot in range(self.capacity - reserve)]
+    
+    def try_acquire(self, reserve=0):
+        now = time.time()
+        for key in self._slot_keys(reserve):
+            # The slot stores when it frees up, for callers working out how long to wait
+            if cache.add(key, now + self.period, self.period):
+                return True
+        return False
+    
+    def seconds_until_free(self, reserve=0):
+        """Time until the first of the caller's usable slots expires"""
+        keys = self._slot_keys(reserve)
+        held = cache.get_many(keys)
+        if len(held) < len(keys):
+            return 0
+        return max(0, min(held.values()) - time.time())
+    
+    def acquire(self, timeout=None, reserve=0):
+        """
+        Take a slot, sleeping until one frees up when all are held
+        
+        Raises:
+            RateLimitExceeded: No slot within `timeout` seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.try_acquire(reserve):
+            metrics.incr(f'ratelimit.{self.name}.waits')
+            # Spread waiting workers over the moment a slot frees up
+            wait = self.seconds_until_free(reserve) + random.uniform(0, 1)
+            if deadline is not None and time.monotonic() + wait > deadline:
+                metrics.incr(f'ratelimit.{self.name}.rejected')
+                raise RateLimitExceeded(f"{self.name} quota exhausted")
+            time.sleep(wait)
@@ -47,10 +47,10 @@ Please take immediate action.
         # Send SMS to rangers for critical alerts
         if alert.severity in ['critical', 'high']:
             for ranger in rangers:
-                if ranger.phone_number:
+                if ranger.phone_e164:
                     try:
                         send_sms_alert.delay(
-                            ranger.phone_number,
+                            ranger.phone_e164,
                             f"🚨 {alert.severity.upper()} ALERT: {alert.title}. Tree {alert.tree.tree_id} at {alert.tree.location_name}. Check dashboard immediately."
                         )
                     except Exception as e:
@@ -81,32 +81,52 @@ Please take immediate action.
     def check_tree_health_trends():
         """
         Background task to check for declining tree health trends
-        Creates alerts if multiple trees show declining health
+        Creates alerts if multiple trees show declining health.
+        Only runs the trend query when new health events arrived since the last check.
         """
-        from trees.models import Tree
-        from django.db.models import Count
+        from trees.models import Tree, TreeHealthEvent
+        from monitoring.models import TaskWatermark
         from datetime import timedelta
         from django.utils import timezone
         
-        # Check for trees with declining health in the past 7 days
-        week_ago = timezone.now() - timedelta(days=7)
+        watermark = TaskWatermark.get_position('tree_health_trends')
+        latest_event = TreeHealthEvent.objects.filter(
+            id__gt=watermark,
+            to_status__in=Tree.POOR_HEALTH_STATUSES
+        ).select_related('tree').order_by('-id').first()
         
-        declining_trees = Tree.objects.filter(
-            health_status__in=['declining', 'diseased', 'dead'],
-            updated_at__gte=week_ago
-        ).count()
+        if latest_event is None:
+            return None
         
-        if declining_trees > 5:
-            # Create alert for concerning trend
-            alert = Alert.objects.create(
-                tree=Tree.objects.filter(health_status='declining').first(),
-                severity='high',
-                title=f"Health Trend Alert: {declining_trees} Trees Declining",
-                message=f"Multiple trees ({declining_trees}) showing declining health in the past week. Immediate investigation recommended.",
-                alert_type='health_trend'
-            )
-            
-            RealTimeAlertSystem.notify_rangers(alert)
+        TaskWatermark.advance('tree_health_trends', latest_event.id)
+        
+        # Count trees that moved into poor health in the past 7 days
+        now = timezone.now()
+        declining_trees = TreeHealthEvent.objects.filter(
+            to_status__in=Tree.POOR_HEALTH_STATUSES,
+            created_at__gte=now - timedelta(days=7)
+        ).values('tree').distinct().count()
+        
+        if declining_trees <= 5:
+            return None
+        
+        # Avoid repeating the trend alert while one is still open
+        if Alert.objects.filter(
+            title__startswith='Health Trend Alert',
+            is_resolved=False,
+            created_at__gte=now - timedelta(days=1)
+        ).exists():
+            return None
+        
+        alert = Alert.objects.create(
+            tree=latest_event.tree,
+            severity='high',
+            title=f"Health Trend Alert: {declining_trees} Trees Declining",
+            message=f"Multiple trees ({declining_trees}) showing declining health in the past week. Immediate investigation recommended."
+        )
+        
+        RealTimeAlertSystem.notify_rangers(alert)
+        return alert
     
     @staticmethod
     def create_wildfire_alert(latitude, longitude, confidence):
@@ -0,0 +1,187 @@
+"""
+Data retention with compressed archival
+Old rows are removed in bounded primary-key chunks; each chunk is first
+streamed to a gzip-compressed NDJSON file so it can be restored later.
+"""
+import gzip
+import json
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core import serializers
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import AIAnalysis, AIAnalysisPayload, Alert, AnalysisJob, IncidentReport, TreeReport
+
+
+class RetentionPolicy:
+    """
+    Describes which rows of a model are expired and how they are archived
+    
+    mode 'delete' archives whole rows (plus dependent rows) and deletes them;
+    `related` must list every model the delete cascades into.
+    mode 'strip' archives only `fields` and resets them in place.
+    """
+    
+    def __init__(self, name, model, days, expired, mode='delete', related=None, fields=None, cleared=None):
+        self.name = name
+        self.model = model
+        self.days = days
+        self.expired = expired
+        self.mode = mode
+        self.related = related or []
+        self.fields = fields
+        self.cleared = cleared or {}
+    
+    def queryset(self, now=None):
+        cutoff = (now or timezone.now()) - timedelta(days=self.days)
+        return self.model.objects.filter(self.expired(cutoff))
+
+
+POLICIES = {
+    'alerts': RetentionPolicy(
+        'alerts', Alert, days=90,
+        expired=lambda cutoff: Q(is_resolved=True, resolved_at__lt=cutoff),
+    ),
+    'tree_reports': RetentionPolicy(
+        'tree_reports', TreeReport, days=365,
+        expired=lambda cutoff: Q(status__in=['verified', 'rejected'], updated_at__lt=cutoff),
+        related=[
+            (AIAnalysis, 'report_id'),
+            (AIAnalysisPayload, 'analysis__report_id'),
+            (AnalysisJob, 'report_id'),
+            (Alert, 'report_id'),
+        ],
+    ),
+    'incident_reports': RetentionPolicy(
+        'incident_reports', IncidentReport, days=365,
+        expired=lambda cutoff: Q(status__in=['resolved', 'dismissed'], updated_at__lt=cutoff),
+    ),
+    'ai_raw_analysis': RetentionPolicy(
+        'ai_raw_analysis', AIAnalysisPayload, days=180,
+        expired=lambda cutoff: Q(updated_at__lt=cutoff),
+    ),
+}
+
+
+def archive_dir(policy_name):
+    path = Path(settings.ARCHIVE_ROOT) / policy_name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _write_archive(policy, ids):
+    """Stream the rows of one chunk to a compressed NDJSON file"""
+    stamp = timezone.now().strftime('%Y%m%d%H%M%S')
+    path = archive_dir(policy.name) / f"{policy.name}-{stamp}-{ids[0]}-{ids[-1]}.jsonl.gz"
+    tmp_path = path.with_suffix('.tmp')
+    
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as stream:
+        rows = policy.model.objects.filter(pk__in=ids).order_by('pk')
+        serializers.serialize('jsonl', rows.iterator(), stream=stream, fields=policy.fields)
+        for related_model, field_name in policy.related:
+            related_rows = related_model.objects.filter(**{f'{field_name}__in': ids}).order_by('pk')
+            serializers.serialize('jsonl', related_rows.iterator(), stream=stream)
+    
+    # Only expose complete archives under their final name
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def apply_policy(policy, chunk_size=None, dry_run=False):
+    """
+    Archive and remove expired rows for one policy, chunk by chunk
+    
+    Returns:
+        dict: rows processed and archive files written
+    """
+    chunk_size = chunk_size or settings.RETENTION_CHUNK_SIZE
+    queryset = policy.queryset()
+    processed = 0
+    archives = []
+    last_pk = 0
+    
+    while True:
+        ids = list(
+            queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        last_pk = ids[-1]
+        
+        if dry_run:
+            processed += len(ids)
+            continue
+        
+        with transaction.atomic():
+            # Re-check expiry under a row lock; a row that changed since the
+            # ids were read is neither archived nor removed
+            locked = list(
+                queryset.filter(pk__in=ids).select_for_update().order_by('pk').values_list('pk', flat=True)
+            )
+            if locked:
+                archives.append(str(_write_archive(policy, locked)))
+                expired = policy.model.objects.filter(pk__in=locked)
+                if policy.mode == 'strip':
+                    expired.update(**policy.cleared)
+                else:
+                    expired.delete()
+        processed += len(locked)
+    
+    return {'policy': policy.name, 'processed': processed, 'archives': archives}
+
+
+def apply_retention(policy_names=None, chunk_size=None, dry_run=False):
+    names = policy_names or list(POLICIES)
+    return [apply_policy(POLICIES[name], chunk_size=chunk_size, dry_run=dry_run) for name in names]
+
+
+def _restore_record(policy, record):
+    """Save one archived record; returns False if its row already exists"""
+    for deserialized in serializers.deserialize('jsonl', json.dumps(record)):
+        obj = deserialized.object
+        if policy.mode == 'strip':
+            values = {field: getattr(obj, field) for field in policy.fields}
+            type(obj).objects.filter(pk=obj.pk).update(**values)
+        elif type(obj).objects.filter(pk=obj.pk).exists():
+            return False
+        else:
+            deserialized.save()
+    return True
+
+
+def restore_archive(path, policy_name=None):
+    """
+    Load an archive file back into the database
+    
+    Rows keep their original primary keys and rows that already exist are
+    skipped, so restoring the same file twice is harmless. Returns the
+    number of records restored.
+    """
+    path = Path(path)
+    policy = POLICIES[policy_name or path.parent.name]
+    restored = 0
+    
+    with gzip.open(path, 'rt', encoding='utf-8') as stream, transaction.atomic():
+        for line in stream:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            # Archives written before raw_analysis moved to AIAnalysisPayload
+            raw_analysis = None
+            if record['model'] == 'monitoring.aianalysis':
+                raw_analysis = record['fields'].pop('raw_analysis', None)
+            
+            if record['fields'] and not _restore_record(policy, record):
+                continue
+            if raw_analysis:
+                AIAnalysisPayload.store(record['pk'], raw_analysis)
+            restored += 1
+    
+    return restored
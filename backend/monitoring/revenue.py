@@ -0,0 +1,133 @@
+"""
+Revenue rollups
+Completed adoption payments and campaign contributions are added to
+RevenueRollup rows (day total, per species, per forest) in the same
+transaction that completes them, so finance reports never aggregate the
+raw transaction tables. backfill_revenue_rollups() rebuilds a date range
+from scratch.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from campaigns.models import CampaignContribution
+from trees.models import Payment, Tree
+from .models import RevenueRollup
+from .stats import _day_bounds
+
+
+def _rollup_keys(day, source, species, forest):
+    keys = [(day, 'day', '', source)]
+    if species is not None:
+        keys.append((day, 'species', species, source))
+    if forest is not None:
+        keys.append((day, 'forest', forest, source))
+    return keys
+
+
+def _add(totals):
+    """Add {(date, dimension, key, source): [amount, transactions]} to the rollups"""
+    now = timezone.now()
+    for (day, dimension, key, source), (amount, count) in totals.items():
+        lookup = {'date': day, 'dimension': dimension, 'key': key, 'source': source}
+        increment = {
+            'amount': F('amount') + amount,
+            'transactions': F('transactions') + count,
+            'updated_at': now,
+        }
+        if RevenueRollup.objects.filter(**lookup).update(**increment):
+            continue
+        try:
+            with transaction.atomic():
+                RevenueRollup.objects.create(**lookup, amount=amount, transactions=count)
+        except IntegrityError:
+            # Another transaction created the row first
+            RevenueRollup.objects.filter(**lookup).update(**increment)
+
+
+def record_payments(payments):
+    """Add completed adoption payments to the rollups"""
+    if not payments:
+        return
+    
+    trees = {
+        tree_id: (species, forest)
+        for tree_id, species, forest in Tree.objects.filter(
+            id__in={payment.tree_id for payment in payments}
+        ).values_list('id', 'species__name', 'location_name')
+    }
+    totals = defaultdict(lambda: [Decimal('0'), 0])
+    for payment in payments:
+        day = timezone.localdate(payment.transaction_date or timezone.now())
+        species, forest = trees[payment.tree_id]
+        for key in _rollup_keys(day, 'adoption', species, forest):
+            totals[key][0] += payment.amount
+            totals[key][1] += 1
+    _add(totals)
+
+
+def record_payment(payment):
+    record_payments([payment])
+
+
+def record_contribution(contribution):
+    """Add a completed campaign contribution to the rollups"""
+    day = timezone.localdate(contribution.completed_at or timezone.now())
+    totals = {
+        key: [contribution.amount, 1]
+        for key in _rollup_keys(day, 'campaign', None, contribution.campaign.forest_name)
+    }
+    _add(totals)
+
+
+def backfill_revenue_rollups(start_date, end_date):
+    """
+    Rebuild RevenueRollup rows for [start_date, end_date] with grouped queries
+    
+    Rows in the range are replaced, so run it for closed days; payments
+    completing while it runs are only guaranteed to be counted once the
+    range is rebuilt again.
+    
+    Returns:
+        int: Number of rows written
+    """
+    start = _day_bounds(start_date)[0]
+    end = _day_bounds(end_date)[1]
+    totals = defaultdict(lambda: [Decimal('0'), 0])
+    
+    payments = (
+        Payment.objects.filter(status='completed')
+        .annotate(completed_on=Coalesce('transaction_date', 'updated_at'))
+        .filter(completed_on__gte=start, completed_on__lt=end)
+        .annotate(day=TruncDate('completed_on'))
+        .values('day', 'tree__species__name', 'tree__location_name')
+        .annotate(total=Sum('amount'), count=Count('id'))
+    )
+    for row in payments:
+        for key in _rollup_keys(row['day'], 'adoption', row['tree__species__name'], row['tree__location_name']):
+            totals[key][0] += row['total']
+            totals[key][1] += row['count']
+    
+    contributions = (
+        CampaignContribution.objects.filter(status='completed', completed_at__gte=start, completed_at__lt=end)
+        .annotate(day=TruncDate('completed_at'))
+        .values('day', 'campaign__forest_name')
+        .annotate(total=Sum('amount'), count=Count('id'))
+    )
+    for row in contributions:
+        for key in _rollup_keys(row['day'], 'campaign', None, row['campaign__forest_name']):
+            totals[key][0] += row['total']
+            totals[key][1] += row['count']
+    
+    rows = [
+        RevenueRollup(date=day, dimension=dimension, key=key, source=source, amount=amount, transactions=count)
+        for (day, dimension, key, source), (amount, count) in totals.items()
+    ]
+    with transaction.atomic():
+        RevenueRollup.objects.filter(date__gte=start_date, date__lte=end_date).delete()
+        RevenueRollup.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
@@ -2,12 +2,12 @@
 Satellite Data Integration Service
 Handles NASA FIRMS fire alerts and NDVI monitoring
 """
-import requests
 import os
 from datetime import datetime, timedelta
 from django.conf import settings
 from trees.models import Tree
 from .models import Alert
+from .http_client import get_client
 
 
 class SatelliteDataService:
@@ -45,10 +45,9 @@ class SatelliteDataService:
                 return self._get_mock_fire_data()
             
             headers = {'Authorization': f'Bearer {self.firms_api_key}'}
-            response = requests.get(
+            response = get_client('firms').get(
                 f"{self.firms_url}/{self.firms_api_key}",
-                params=params,
-                timeout=30
+                params=params
             )
             
             if response.status_code == 200:
@@ -211,7 +210,7 @@ class SatelliteDataService:
                 'units': 'metric'
             }
             
-            response = requests.get(url, params=params, timeout=10)
+            response = get_client('openweather').get(url, params=params)
             
             if response.status_code == 200:
                 data = response.json()
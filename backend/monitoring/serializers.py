@@ -1,7 +1,16 @@
 from rest_framework import serializers
-from .models import TreeReport, AIAnalysis, Alert, IncidentReport
+from .models import TreeReport, AIAnalysis, Alert, IncidentReport, DailyStats, RevenueRollup, AnalysisJob
 from trees.models import Tree
 from users.serializers import UserSerializer
+from .thumbnails import variant_urls
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Responsive copies of an image: `thumb` and `medium` URLs and a `srcset` value; null until generated"""
+    
+    def to_representation(self, value):
+        request = self.context.get('request')
+        return variant_urls(value, request.build_absolute_uri if request else None)
 
 
 class AIAnalysisSerializer(serializers.ModelSerializer):
@@ -13,6 +22,25 @@ class AIAnalysisSerializer(serializers.ModelSerializer):
                   'recommendations', 'analyzed_at']
 
 
+class AnalysisJobSerializer(serializers.ModelSerializer):
+    """Status of a background AI analysis job, polled by clients"""
+    
+    final = serializers.SerializerMethodField()
+    poll_after = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = AnalysisJob
+        fields = ['id', 'report', 'kind', 'status', 'result', 'error', 'analysis',
+                  'created_at', 'started_at', 'finished_at', 'final', 'poll_after']
+    
+    def get_final(self, obj):
+        return obj.status not in AnalysisJob.ACTIVE_STATUSES
+    
+    def get_poll_after(self, obj):
+        # Seconds the client should wait before asking again
+        return None if self.get_final(obj) else 2
+
+
 class TreeReportListSerializer(serializers.ModelSerializer):
     """Simplified serializer for report list"""
     
@@ -34,12 +62,13 @@ class TreeReportDetailSerializer(serializers.ModelSerializer):
     
     reporter = UserSerializer(read_only=True)
     ai_analysis = AIAnalysisSerializer(read_only=True)
+    image_variants = ImageVariantsField()
     tree_info = serializers.SerializerMethodField()
     
     class Meta:
         model = TreeReport
         fields = ['id', 'tree', 'tree_info', 'reporter', 'report_type', 'title', 
-                  'description', 'image', 'latitude', 'longitude', 'status',
+                  'description', 'image', 'image_variants', 'latitude', 'longitude', 'status',
                   'verified_by', 'verified_at', 'ranger_notes', 'ai_analysis',
                   'created_at', 'updated_at']
         read_only_fields = ['reporter', 'verified_by', 'verified_at', 'ai_analysis']
@@ -103,3 +132,21 @@ class IncidentReportCreateSerializer(serializers.ModelSerializer):
         fields = ['incident_type', 'title', 'description', 'location_name', 
                   'latitude', 'longitude', 'image']
 
+
+class DailyStatsSerializer(serializers.ModelSerializer):
+    """Serializer for precomputed daily statistics"""
+    
+    class Meta:
+        model = DailyStats
+        fields = ['date', 'total_trees', 'healthy_trees', 'stressed_trees',
+                  'diseased_trees', 'critical_trees', 'deceased_trees',
+                  'active_alerts', 'critical_alerts', 'reports_count',
+                  'incidents_count', 'computed_at']
+
+
+class RevenueRollupSerializer(serializers.ModelSerializer):
+    """Serializer for precomputed revenue rollups"""
+    
+    class Meta:
+        model = RevenueRollup
+        fields = ['date', 'dimension', 'key', 'source', 'amount', 'transactions']
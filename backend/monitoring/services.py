@@ -1,9 +1,127 @@
 import google.generativeai as genai
 from django.conf import settings
 import json
-from PIL import Image
+import numpy as np
+from PIL import Image, ImageOps
 import io
 
+from . import metrics
+from .images import resize_image
+from .rate_limit import RateLimitExceeded, SlidingWindowLimiter
+
+
+class ImageTriage:
+    """
+    Local pre-triage of tree photos ahead of Gemini
+    
+    Cheap colour, exposure and sharpness features computed on a 256px copy
+    settle the obvious cases on CPU in a few milliseconds: photos too dark,
+    blown out, blurred or without foliage are returned for a retake, and
+    clearly healthy canopy is reported healthy. Everything else is left for
+    Gemini. Thresholds come from AI_TRIAGE_THRESHOLDS.
+    """
+    
+    UNUSABLE_ADVICE = {
+        'too_dark': 'The photo is too dark to assess. Please retake it in daylight.',
+        'overexposed': 'The photo is overexposed. Please retake it without the sun directly behind the tree.',
+        'blurry': 'The photo is too blurred to assess. Please hold the phone steady and retake it.',
+        'no_foliage': 'No tree foliage is visible. Please photograph the crown and leaves of the tree.',
+    }
+    
+    def __init__(self, thresholds=None):
+        self.thresholds = {**settings.AI_TRIAGE_THRESHOLDS, **(thresholds or {})}
+    
+    def features(self, image):
+        """Colour, exposure and sharpness features of a PIL image"""
+        image.draft('RGB', (512, 512))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image.thumbnail((256, 256))
+        
+        rgb = np.asarray(image, dtype=np.float32)
+        luma = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        # Variance of the Laplacian: low when the image has no sharp edges
+        laplacian = (
+            4 * luma[1:-1, 1:-1] - luma[:-2, 1:-1] - luma[2:, 1:-1] - luma[1:-1, :-2] - luma[1:-1, 2:]
+        )
+        
+        hsv = np.asarray(image.convert('HSV'), dtype=np.float32)
+        hue = hsv[..., 0] * (360 / 255)
+        colourful = (hsv[..., 1] > 50) & (hsv[..., 2] > 40)
+        green = colourful & (hue >= 60) & (hue < 170)
+        # Yellowing and browning foliage (also bark and bare soil)
+        stressed = colourful & (hue >= 15) & (hue < 60)
+        vegetation = green.sum() + stressed.sum()
+        histogram, _ = np.histogram(hue[colourful], bins=12, range=(0, 360))
+        
+        return {
+            'brightness': float(luma.mean()),
+            'clipped_ratio': float(((luma < 10) | (luma > 245)).mean()),
+            'sharpness': float(laplacian.var()),
+            'green_ratio': float(green.mean()),
+            'vegetation_ratio': float(vegetation / luma.size),
+            'stress_ratio': float(stressed.sum() / vegetation) if vegetation else 0.0,
+            'hue_histogram': [round(float(v), 4) for v in histogram / max(1, colourful.sum())],
+        }
+    
+    def classify(self, features):
+        """
+        Returns:
+            tuple: (decision, reason) - decision is 'unusable', 'healthy' or
+            'ambiguous'
+        """
+        t = self.thresholds
+        if features['brightness'] < t['min_brightness']:
+            return 'unusable', 'too_dark'
+        if features['brightness'] > t['max_brightness'] or features['clipped_ratio'] > t['max_clipped_ratio']:
+            return 'unusable', 'overexposed'
+        if features['sharpness'] < t['min_sharpness']:
+            return 'unusable', 'blurry'
+        if features['vegetation_ratio'] < t['min_vegetation_ratio']:
+            return 'unusable', 'no_foliage'
+        if features['green_ratio'] >= t['healthy_min_green_ratio'] and features['stress_ratio'] <= t['healthy_max_stress_ratio']:
+            return 'healthy', 'green_canopy'
+        return 'ambiguous', None
+    
+    def triage(self, image_path):
+        """
+        Resolve a photo locally when the features are conclusive
+        
+        Returns:
+            dict in analyze_tree_image() form, or None when Gemini is needed
+        """
+        try:
+            with Image.open(image_path) as image:
+                features = self.features(image)
+        except Exception as e:
+            print(f"Triage could not read {image_path}: {str(e)}")
+            return None
+        
+        decision, reason = self.classify(features)
+        metrics.incr(f'ai_triage.{decision}')
+        if decision == 'ambiguous':
+            return None
+        
+        if decision == 'healthy':
+            result = {
+                'health_assessment': 'healthy',
+                'detected_issues': [],
+                'recommendations': 'Dense green canopy with no visible discoloration. Continue routine monitoring.',
+            }
+        else:
+            result = {
+                'health_assessment': 'unknown',
+                'detected_issues': [{
+                    'issue': 'Unusable photo',
+                    'severity': 'low',
+                    'description': reason.replace('_', ' ').capitalize()
+                }],
+                'recommendations': self.UNUSABLE_ADVICE[reason],
+            }
+        result['confidence_score'] = self.thresholds['confidence_score']
+        result['source'] = 'triage'
+        result['triage'] = {'decision': decision, 'reason': reason, 'features': features}
+        return result
+
 
 class GeminiAIService:
     """Service for analyzing tree health using Gemini AI"""
@@ -11,20 +129,32 @@ class GeminiAIService:
     def __init__(self):
         genai.configure(api_key=settings.GEMINI_API_KEY)
         self.model = genai.GenerativeModel('gemini-1.5-flash')
+        # Per-minute request quota shared with every other worker
+        self.quota = SlidingWindowLimiter('gemini', settings.GEMINI_REQUESTS_PER_MINUTE)
+        self.triage = ImageTriage()
     
-    def analyze_tree_image(self, image_path):
+    def analyze_tree_image(self, image_path, quota_reserve=0):
         """
         Analyze a tree image to detect health issues
         
         Args:
             image_path: Path to the tree image file
+            quota_reserve: Requests per minute to leave for other callers
             
         Returns:
             dict: Analysis results including health assessment, issues, and recommendations
+        
+        Raises:
+            RateLimitExceeded: The Gemini quota stayed exhausted for GEMINI_QUOTA_WAIT seconds
         """
+        if settings.AI_TRIAGE_ENABLED:
+            local_result = self.triage.triage(image_path)
+            if local_result is not None:
+                return local_result
+        
         try:
-            # Load the image
-            img = Image.open(image_path)
+            # Load the image; older uploads have no AI variant, so shrink them here
+            img = resize_image(Image.open(image_path), settings.AI_IMAGE_MAX_DIMENSION)
             
             # Prepare the prompt
             prompt = """
@@ -54,6 +184,7 @@ class GeminiAIService:
             """
             
             # Generate content
+            self.quota.acquire(timeout=settings.GEMINI_QUOTA_WAIT, reserve=quota_reserve)
             response = self.model.generate_content([prompt, img])
             
             # Parse the response
@@ -62,6 +193,8 @@ class GeminiAIService:
             
             return result
             
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             return {
                 'health_assessment': 'unknown',
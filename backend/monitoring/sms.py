@@ -0,0 +1,68 @@
+# Africa's Talking SMS Integration
+import os
+
+from .http_client import get_client
+
+
+class SmsService:
+    """
+    Outbound SMS through the Africa's Talking messaging REST API
+    """
+    
+    def __init__(self):
+        self.username = os.getenv('AFRICAS_TALKING_USERNAME', 'sandbox')
+        self.api_key = os.getenv('AFRICAS_TALKING_API_KEY', '')
+        self.sender_id = os.getenv('AFRICAS_TALKING_SENDER_ID', '')
+        
+        if self.username == 'sandbox':
+            default_base_url = 'https://api.sandbox.africastalking.com'
+        else:
+            default_base_url = 'https://api.africastalking.com'
+        # Overridable so load tests can point at a local stand-in
+        self.base_url = os.getenv('AFRICAS_TALKING_BASE_URL', default_base_url).rstrip('/')
+        self.messaging_url = f'{self.base_url}/version1/messaging'
+        self.http = get_client('africastalking')
+    
+    @property
+    def is_configured(self):
+        return bool(self.api_key)
+    
+    def send(self, message, recipients):
+        """
+        Send one text to one or more recipients in a single request
+        
+        Args:
+            message (str): SMS text
+            recipients (list): Phone numbers in international format
+        
+        Returns:
+            dict: success flag and per-recipient results
+        """
+        headers = {
+            'apiKey': self.api_key,
+            'Accept': 'application/json',
+        }
+        data = {
+            'username': self.username,
+            'to': ','.join(recipients),
+            'message': message,
+        }
+        if self.sender_id:
+            data['from'] = self.sender_id
+        
+        try:
+            response = self.http.post(self.messaging_url, data=data, headers=headers)
+            response.raise_for_status()
+            
+            result = response.json().get('SMSMessageData', {})
+            return {
+                'success': True,
+                'message': result.get('Message', ''),
+                'recipients': result.get('Recipients', []),
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'message': f'Error sending SMS: {str(e)}',
+                'recipients': [],
+            }
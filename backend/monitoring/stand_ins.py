@@ -0,0 +1,192 @@
+"""
+Local stand-ins for external providers
+Small HTTP servers that speak enough of a provider's API for load tests
+and benchmarks to run offline. Each runs in a background thread on a
+free localhost port and records what it received.
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class StandInServer:
+    """Threaded HTTP server bound to 127.0.0.1 on a free port"""
+    
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = []
+        self.connections = set()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+    
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+    
+    def handle(self, method, path, headers, body):
+        """Return (status, payload) for one request"""
+        raise NotImplementedError
+    
+    def record(self, entry):
+        with self._lock:
+            self.requests.append(entry)
+    
+    def start(self):
+        stand_in = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; without this, kept-alive
+            # connections stall on delayed ACKs
+            disable_nagle_algorithm = True
+            
+            def _dispatch(self, method):
+                with stand_in._lock:
+                    stand_in.connections.add(self.client_address)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                status, payload = stand_in.handle(method, self.path, self.headers, body)
+                data = json.dumps(payload).encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up (timeout) before the answer was ready
+                    self.close_connection = True
+            
+            def do_GET(self):
+                self._dispatch('GET')
+            
+            def do_POST(self):
+                self._dispatch('POST')
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class FakeAfricasTalking(StandInServer):
+    """Accepts POST /version1/messaging like the Africa's Talking SMS API"""
+    
+    def handle(self, method, path, headers, body):
+        if method != 'POST' or not path.startswith('/version1/messaging'):
+            return 404, {'error': 'Not found'}
+        if not headers.get('apiKey'):
+            return 401, {'error': 'The supplied authentication is invalid'}
+        
+        form = parse_qs(body.decode('utf-8'))
+        recipients = [number for number in form.get('to', [''])[0].split(',') if number]
+        message = form.get('message', [''])[0]
+        self.record({'to': recipients, 'message': message})
+        
+        return 201, {
+            'SMSMessageData': {
+                'Message': f'Sent to {len(recipients)}/{len(recipients)} Total Cost: KES 0',
+                'Recipients': [
+                    {
+                        'number': number,
+                        'status': 'Success',
+                        'statusCode': 101,
+                        'messageId': f'ATXid_{uuid.uuid4().hex}',
+                        'cost': 'KES 0.8000',
+                    }
+                    for number in recipients
+                ],
+            }
+        }
+    
+    @property
+    def recipients_count(self):
+        return sum(len(entry['to']) for entry in self.requests)
+
+
+class FakeDaraja(StandInServer):
+    """
+    Speaks the Daraja OAuth, STK push and STK query endpoints
+    
+    `outcomes` maps CheckoutRequestID to the ResultCode the query reports;
+    IDs without an outcome are still "being processed".
+    """
+    
+    def __init__(self, latency=0.0, outcomes=None, token_expires_in=3599):
+        super().__init__(latency)
+        self.outcomes = dict(outcomes or {})
+        self.token_expires_in = token_expires_in
+        self._counter = 0
+    
+    def count(self, path_prefix):
+        return sum(1 for entry in self.requests if entry['path'].startswith(path_prefix))
+    
+    def handle(self, method, path, headers, body):
+        self.record({'method': method, 'path': path})
+        
+        if path.startswith('/oauth/v1/generate'):
+            return 200, {'access_token': uuid.uuid4().hex, 'expires_in': str(self.token_expires_in)}
+        
+        if not headers.get('Authorization', '').startswith('Bearer '):
+            return 401, {'errorCode': '404.001.03', 'errorMessage': 'Invalid Access Token'}
+        payload = json.loads(body or b'{}')
+        
+        if path.startswith('/mpesa/stkpush/v1/processrequest'):
+            with self._lock:
+                self._counter += 1
+                checkout_request_id = f'ws_CO_fake_{self._counter}'
+            return 200, {
+                'MerchantRequestID': f'fake-{self._counter}',
+                'CheckoutRequestID': checkout_request_id,
+                'ResponseCode': '0',
+                'ResponseDescription': 'Success. Request accepted for processing',
+                'CustomerMessage': 'Success. Request accepted for processing',
+            }
+        
+        if path.startswith('/mpesa/stkpushquery/v1/query'):
+            checkout_request_id = payload.get('CheckoutRequestID')
+            result_code = self.outcomes.get(checkout_request_id)
+            if result_code is None:
+                return 500, {
+                    'requestId': uuid.uuid4().hex,
+                    'errorCode': '500.001.1001',
+                    'errorMessage': 'The transaction is being processed',
+                }
+            descriptions = {
+                '0': 'The service request is processed successfully.',
+                '1032': 'Request cancelled by user',
+                '1': 'The balance is insufficient for the transaction',
+            }
+            return 200, {
+                'ResponseCode': '0',
+                'ResponseDescription': 'The service request has been accepted successsfully',
+                'MerchantRequestID': 'fake',
+                'CheckoutRequestID': checkout_request_id,
+                'ResultCode': result_code,
+                'ResultDesc': descriptions.get(result_code, 'Transaction failed'),
+            }
+        
+        return 404, {'errorMessage': 'Not found'}
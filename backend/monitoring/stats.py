@@ -0,0 +1,179 @@
+"""
+Daily statistics aggregation
+Fills DailyStats rows with one conditional-aggregate query per table
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from trees.models import Tree, TreeHealthEvent
+from .models import Alert, DailyStats, IncidentReport, TreeReport
+
+STAT_FIELDS = [
+    'total_trees', 'healthy_trees', 'stressed_trees', 'diseased_trees',
+    'critical_trees', 'deceased_trees', 'active_alerts', 'critical_alerts',
+    'reports_count', 'incidents_count',
+]
+
+
+def _day_bounds(day):
+    """Return the aware [start, end) datetimes of a local calendar day"""
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(day, time.min), tz)
+    return start, start + timedelta(days=1)
+
+
+def compute_daily_stats(day=None):
+    """
+    Compute and store statistics for a single day
+    
+    Tree and alert figures are a snapshot taken when this runs, so the
+    task should run at the end of the day it records.
+    """
+    day = day or timezone.localdate()
+    start, end = _day_bounds(day)
+    
+    tree_stats = Tree.objects.aggregate(
+        total_trees=Count('id'),
+        healthy_trees=Count('id', filter=Q(health_status='healthy')),
+        stressed_trees=Count('id', filter=Q(health_status='stressed')),
+        diseased_trees=Count('id', filter=Q(health_status='diseased')),
+        critical_trees=Count('id', filter=Q(health_status='critical')),
+        deceased_trees=Count('id', filter=Q(health_status='deceased')),
+    )
+    alert_stats = Alert.objects.filter(is_resolved=False).aggregate(
+        active_alerts=Count('id'),
+        critical_alerts=Count('id', filter=Q(severity='critical')),
+    )
+    reports_count = TreeReport.objects.filter(created_at__gte=start, created_at__lt=end).count()
+    incidents_count = IncidentReport.objects.filter(created_at__gte=start, created_at__lt=end).count()
+    
+    stats, _ = DailyStats.objects.update_or_create(
+        date=day,
+        defaults={
+            **tree_stats,
+            **alert_stats,
+            'reports_count': reports_count,
+            'incidents_count': incidents_count,
+        }
+    )
+    return stats
+
+
+def _counts_by_day(queryset, field):
+    """Map local date -> row count, grouped in the database"""
+    rows = queryset.annotate(day=TruncDate(field)).values('day').annotate(count=Count('id'))
+    return {row['day']: row['count'] for row in rows}
+
+
+def backfill_daily_stats(start_date, end_date):
+    """
+    Rebuild DailyStats for every day in [start_date, end_date] in bulk
+    
+    Tree health per day is reconstructed by replaying TreeHealthEvents and
+    tree creations backwards from the current state; open alerts are
+    reconstructed from their created/resolved timestamps.
+    
+    Returns:
+        int: Number of rows written
+    """
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    if not days:
+        return 0
+    
+    # Daily activity counts, one grouped query per table
+    reports_by_day = _counts_by_day(TreeReport.objects.filter(
+        created_at__gte=_day_bounds(start_date)[0], created_at__lt=_day_bounds(end_date)[1]
+    ), 'created_at')
+    incidents_by_day = _counts_by_day(IncidentReport.objects.filter(
+        created_at__gte=_day_bounds(start_date)[0], created_at__lt=_day_bounds(end_date)[1]
+    ), 'created_at')
+    
+    # Tree health: walk back from the current state
+    current_status = dict(Tree.objects.values_list('id', 'health_status'))
+    creations = list(
+        Tree.objects.filter(created_at__gte=_day_bounds(start_date)[1])
+        .order_by('-created_at').values_list('created_at', 'id')
+    )
+    events = list(
+        TreeHealthEvent.objects.filter(created_at__gte=_day_bounds(start_date)[1])
+        .order_by('-created_at', '-id').values_list('created_at', 'tree_id', 'from_status')
+    )
+    
+    # Open alerts: +1 when created, -1 when resolved
+    alert_rows = Alert.objects.filter(created_at__lt=_day_bounds(end_date)[1]).values_list(
+        'created_at', 'resolved_at', 'is_resolved', 'severity'
+    )
+    opened = defaultdict(lambda: [0, 0])
+    closed = defaultdict(lambda: [0, 0])
+    for created_at, resolved_at, is_resolved, severity in alert_rows.iterator(chunk_size=2000):
+        is_critical = 1 if severity == 'critical' else 0
+        created_day = max(timezone.localdate(created_at), start_date)
+        opened[created_day][0] += 1
+        opened[created_day][1] += is_critical
+        if is_resolved and resolved_at:
+            resolved_day = timezone.localdate(resolved_at)
+            if resolved_day < start_date:
+                # Opened and closed before the range; never active inside it
+                opened[created_day][0] -= 1
+                opened[created_day][1] -= is_critical
+            else:
+                closed[resolved_day][0] += 1
+                closed[resolved_day][1] += is_critical
+    
+    health_snapshots = {}
+    status_of = dict(current_status)
+    creation_index = event_index = 0
+    for day in reversed(days):
+        day_end = _day_bounds(day)[1]
+        # Undo everything that happened after this day ended
+        while True:
+            next_creation = creations[creation_index][0] if creation_index < len(creations) else None
+            next_event = events[event_index][0] if event_index < len(events) else None
+            if next_event is not None and next_event >= day_end and (next_creation is None or next_event >= next_creation):
+                _, tree_id, from_status = events[event_index]
+                if tree_id in status_of:
+                    status_of[tree_id] = from_status
+                event_index += 1
+            elif next_creation is not None and next_creation >= day_end:
+                status_of.pop(creations[creation_index][1], None)
+                creation_index += 1
+            else:
+                break
+        
+        counts = defaultdict(int)
+        for health_status in status_of.values():
+            counts[health_status] += 1
+        health_snapshots[day] = (len(status_of), counts)
+    
+    rows = []
+    active = critical = 0
+    for day in days:
+        active += opened[day][0] - closed[day][0]
+        critical += opened[day][1] - closed[day][1]
+        total, counts = health_snapshots[day]
+        rows.append(DailyStats(
+            date=day,
+            total_trees=total,
+            healthy_trees=counts['healthy'],
+            stressed_trees=counts['stressed'],
+            diseased_trees=counts['diseased'],
+            critical_trees=counts['critical'],
+            deceased_trees=counts['deceased'],
+            active_alerts=active,
+            critical_alerts=critical,
+            reports_count=reports_by_day.get(day, 0),
+            incidents_count=incidents_by_day.get(day, 0),
+        ))
+    
+    DailyStats.objects.bulk_create(
+        rows,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['date'],
+        update_fields=STAT_FIELDS + ['computed_at'],
+    )
+    return len(rows)
@@ -7,9 +7,11 @@ from django.utils import timezone
 from datetime import timedelta
 from .satellite import SatelliteDataService
 from .models import Alert, Tree
+from .locks import single_flight
 
 
 @shared_task
+@single_flight(ttl=900)
 def check_fire_alerts():
     """
     Periodic task to check for fire alerts near trees
@@ -50,9 +52,9 @@ def notify_fire_alerts():
         ).distinct()
         
         for adopter in adopters:
-            if adopter.phone_number:
+            if adopter.phone_e164:
                 send_sms_alert.delay(
-                    adopter.phone_number,
+                    adopter.phone_e164,
                     f"URGENT: Fire detected near your adopted tree {alert.tree.tree_id}. "
                     f"{alert.message[:100]}. Check Nilocate app for details."
                 )
@@ -63,29 +65,49 @@ def send_sms_alert(phone_number, message):
     """
     Send SMS notification using Africa's Talking
     """
-    import os
+    from .sms import SmsService
     
-    # Africa's Talking credentials
-    username = os.environ.get('AFRICAS_TALKING_USERNAME', 'sandbox')
-    api_key = os.environ.get('AFRICAS_TALKING_API_KEY', '')
-    
-    if not api_key:
+    sms = SmsService()
+    if not sms.is_configured:
         print(f"SMS not configured. Would send to {phone_number}: {message}")
         return False
     
-    try:
-        import africastalking
-        
-        africastalking.initialize(username, api_key)
-        sms = africastalking.SMS
-        
-        response = sms.send(message, [phone_number])
-        print(f"SMS sent successfully: {response}")
-        return True
-        
-    except Exception as e:
-        print(f"Error sending SMS: {e}")
+    result = sms.send(message, [phone_number])
+    if not result['success']:
+        print(result['message'])
         return False
+    
+    print(f"SMS sent successfully: {result['message']}")
+    return True
+
+
+@shared_task
+def send_sms_bulk(messages):
+    """
+    Send many SMS replies with one API call per distinct text
+    messages: list of (phone_number, text) pairs
+    """
+    from .sms import SmsService
+    
+    by_text = {}
+    for phone_number, text in messages:
+        by_text.setdefault(text, []).append(phone_number)
+    
+    sms = SmsService()
+    if not sms.is_configured:
+        for text, recipients in by_text.items():
+            print(f"SMS not configured. Would send to {', '.join(recipients)}: {text}")
+        return 0
+    
+    sent = 0
+    for text, recipients in by_text.items():
+        result = sms.send(text, recipients)
+        if result['success']:
+            sent += len(recipients)
+        else:
+            print(f"{result['message']} ({len(recipients)} recipients)")
+    
+    return sent
 
 
 @shared_task
@@ -103,11 +125,43 @@ Tree Details:
 You're now protecting an endangered tree! We'll send you regular updates on your tree's health.
 
 Kenya Forest Conservation Initiative"""
-    
+
     return send_sms_alert(phone_number, message)
 
 
-@shared_task
+@shared_task(acks_late=True)
+def analyze_report_image(job_id):
+    """
+    Run a queued AI analysis job
+    Runs on the ai queue so multi-second Gemini calls never hold a web worker
+    """
+    from .analysis import run_analysis_job
+    
+    job = run_analysis_job(job_id)
+    if job is None:
+        return None
+    
+    print(f"Analysis job {job.id} for report {job.report_id}: {job.status}")
+    return job.status
+
+
+@shared_task(acks_late=True)
+def generate_image_variants(label, pk, field_name, name):
+    """Write the responsive variants of a newly uploaded image"""
+    from django.apps import apps
+    from .thumbnails import build_variants, save_variants
+    
+    if not apps.get_model(label).objects.filter(pk=pk, **{field_name: name}).exists():
+        # Deleted or replaced before the task ran; a new upload queues its own
+        return None
+    
+    variants = build_variants(name)
+    save_variants(label, pk, field_name, name, variants)
+    return variants
+
+
+@shared_task(acks_late=True)
+@single_flight(ttl=900)
 def update_tree_ndvi():
     """
     Update NDVI values for all trees
@@ -144,6 +198,107 @@ def update_tree_ndvi():
     return updated_count
 
 
+@shared_task(acks_late=True)
+def refresh_mpesa_token():
+    """
+    Refresh the shared Daraja OAuth token ahead of expiry
+    Queued by MpesaService when the cached token nears expiry, and by beat twice per refresh-ahead window
+    """
+    import time
+    from django.core.cache import cache
+    from .mpesa import MpesaService
+    
+    mpesa = MpesaService()
+    if not mpesa.consumer_key:
+        return False
+    
+    cached = cache.get(mpesa.token_cache_key)
+    if cached and time.time() < cached['refresh_at']:
+        return False
+    
+    return mpesa.refresh_access_token() is not None
+
+
+@shared_task(bind=True, max_retries=3)
+def initiate_adoption_payment(self, payment_id, transaction_desc):
+    """
+    Send the M-Pesa STK push for a payment created by an adoption request
+    Runs on the payments queue so web workers never wait on Daraja
+    """
+    from django.utils import timezone
+    from trees.models import AdoptionRequest, Payment
+    from .http_client import CircuitOpenError
+    from .mpesa import MpesaService
+    
+    payment = Payment.objects.select_related('tree').get(id=payment_id)
+    if payment.status != 'initiating':
+        return payment.status
+    
+    mpesa = MpesaService()
+    result = mpesa.initiate_stk_push(
+        phone_number=payment.phone_number,
+        amount=int(payment.amount),
+        account_reference=f"ADOPT-{payment.tree.tree_id}",
+        transaction_desc=transaction_desc
+    )
+    
+    if result['success']:
+        Payment.objects.filter(id=payment_id, status='initiating').update(
+            mpesa_checkout_request_id=result['checkout_request_id'],
+            status='pending',
+            updated_at=timezone.now()
+        )
+        return 'pending'
+    
+    if mpesa.http.breaker.state != 'closed' and self.request.retries < self.max_retries:
+        # Daraja is down; try again once the circuit may have closed
+        raise self.retry(exc=CircuitOpenError(result['message']), countdown=30)
+    
+    Payment.objects.filter(id=payment_id, status='initiating').update(
+        status='failed',
+        result_description=result['message'],
+        updated_at=timezone.now()
+    )
+    AdoptionRequest.objects.filter(payment_id=payment_id).update(
+        status='payment_failed', updated_at=timezone.now()
+    )
+    return 'failed'
+
+
+@shared_task(acks_late=True)
+@single_flight(ttl=900)
+def reconcile_pending_payments():
+    """
+    Settle pending M-Pesa payments whose callback never arrived
+    Run every 15 minutes
+    """
+    from .payments import reconcile_pending_payments as reconcile
+    
+    summary = reconcile()
+    print(
+        f"Payment reconciliation: {summary['checked']} checked, "
+        f"{len(summary['corrected'])} corrected, {summary['still_pending']} still pending"
+    )
+    return {key: value for key, value in summary.items() if key != 'corrected'}
+
+
+@shared_task(acks_late=True)
+@single_flight(ttl=1800)
+def bulk_analyze_reports():
+    """
+    Analyse report images nobody requested analysis for
+    Run every 30 minutes within the shared Gemini quota
+    """
+    from .analysis import bulk_analyze_reports as analyze_backlog
+    
+    summary = analyze_backlog()
+    print(
+        f"Bulk AI analysis: {summary['analyzed']} analyzed ({summary['cached']} from cache), "
+        f"{summary['failed']} failed{', stopped at the Gemini quota' if summary['rate_limited'] else ''}"
+    )
+    return summary
+
+
 @shared_task
 def send_adoption_certificate(adoption_id):
     """Generate and email adoption certificate"""
@@ -196,24 +351,25 @@ def process_sms_report(phone_number, message_text):
     Process SMS incident report
     Format: REPORT [TREE_ID] [TYPE] [DETAILS]
     """
-    from monitoring.models import IncidentReport, TreeReport
+    from monitoring.models import IncidentReport
     from users.models import User
+    from users.phone import resolve_user
     from trees.models import Tree
+    from .inbound import parse_command
     
     try:
         # Parse SMS
-        parts = message_text.strip().split(' ', 3)
+        command, tree_id, extra = parse_command(message_text)
         
-        if len(parts) < 4 or parts[0].upper() != 'REPORT':
+        if command != 'REPORT':
             return False
         
-        tree_id = parts[1].upper()
-        incident_type = parts[2].lower()
-        details = parts[3]
+        tree_id = Tree.normalize_tree_id(tree_id)
+        incident_type, details = extra
         
         # Find tree
         try:
-            tree = Tree.objects.get(tree_id__iexact=tree_id)
+            tree = Tree.objects.get(tree_key=tree_id)
         except Tree.DoesNotExist:
             send_sms_alert.delay(
                 phone_number,
@@ -222,22 +378,11 @@ def process_sms_report(phone_number, message_text):
             return False
         
         # Find user by phone
-        try:
-            user = User.objects.get(phone_number=phone_number)
-        except User.DoesNotExist:
+        user = resolve_user(phone_number)
+        if user is None:
             # Create anonymous report
             user = User.objects.filter(user_type='admin').first()
         
-        # Map incident types
-        incident_type_map = {
-            'fire': 'fire',
-            'logging': 'illegal_logging',
-            'poaching': 'poaching',
-            'damage': 'vandalism'
-        }
-        
-        incident_type = incident_type_map.get(incident_type, 'other')
-        
         # Create incident report
         incident = IncidentReport.objects.create(
             reporter=user,
@@ -258,29 +403,61 @@ def process_sms_report(phone_number, message_text):
         )
         
         return True
-        
+    
     except Exception as e:
         print(f"Error processing SMS report: {e}")
         return False
 
 
 @shared_task
+@single_flight(ttl=300)
+def process_inbound_messages():
+    """
+    Drain stored inbound SMS in batches
+    Scheduled by the SMS webhook after a burst, and every minute as a safety net
+    """
+    from django.conf import settings
+    from django.core.cache import cache
+    from .inbound import drain_inbound_messages
+    
+    # Let the webhook schedule the next drain for messages arriving from now on
+    cache.delete('inbound-drain-scheduled')
+    
+    processed = drain_inbound_messages(batch_size=settings.INBOUND_BATCH_SIZE)
+    if processed:
+        print(f"Processed {processed} inbound SMS")
+    return processed
+
+
+@shared_task(acks_late=True)
+@single_flight(ttl=900)
 def cleanup_old_alerts():
-    """Remove resolved alerts older than 90 days"""
-    from django.utils import timezone
-    from datetime import timedelta
+    """Archive and remove resolved alerts older than 90 days, in bounded chunks"""
+    from .retention import POLICIES, apply_policy
+    
+    result = apply_policy(POLICIES['alerts'])
+    
+    print(f"Cleaned up {result['processed']} old alerts into {len(result['archives'])} archives")
+    return result['processed']
+
+
+@shared_task(acks_late=True)
+@single_flight(ttl=900)
+def archive_old_records():
+    """Apply the report and AI analysis retention policies"""
+    from .idempotency import prune_receipts
+    from .retention import apply_retention
     
-    cutoff_date = timezone.now() - timedelta(days=90)
-    deleted_count = Alert.objects.filter(
-        is_resolved=True,
-        resolved_at__lt=cutoff_date
-    ).delete()[0]
+    results = apply_retention(['tree_reports', 'incident_reports', 'ai_raw_analysis'])
     
-    print(f"Cleaned up {deleted_count} old alerts")
-    return deleted_count
+    for result in results:
+        print(f"Retention {result['policy']}: {result['processed']} rows archived")
+    print(f"Pruned {prune_receipts()} old webhook receipts")
+    return {result['policy']: result['processed'] for result in results}
 
 
 @shared_task
+@single_flight(ttl=240, heartbeat=60)
 def check_critical_alerts():
     """
     Real-time alert monitoring - runs every 5 minutes
@@ -307,67 +484,108 @@ def check_critical_alerts():
     return recent_critical.count()
 
 
+# Ids are allocated before commit, so an event with a lower id can become
+# visible after a higher one; the watermark only moves past older events
+HEALTH_EVENT_SETTLE_LAG = timedelta(minutes=5)
+
+
 @shared_task
+@single_flight(ttl=600)
 def monitor_tree_health_changes():
     """
-    Monitor for sudden tree health status changes
-    Creates alerts when trees transition to worse health states
+    Monitor for tree health status changes
+    Creates alerts when trees transition to worse health states.
+    Only health events recorded since the previous run are read; events
+    younger than the settle lag are read again on the next run.
     """
-    from trees.models import Tree
-    from .realtime_alerts import create_alert_from_report
+    from trees.models import Tree, TreeHealthEvent
+    from .models import TaskWatermark
+    from .realtime_alerts import RealTimeAlertSystem
     
-    # Get trees that recently changed to poor health
-    recently_declining = Tree.objects.filter(
-        health_status__in=['declining', 'diseased', 'dead'],
-        updated_at__gte=timezone.now() - timedelta(hours=1)
-    )
+    now = timezone.now()
+    watermark = TaskWatermark.get_position('monitor_tree_health_changes')
+    events = list(TreeHealthEvent.objects.filter(
+        id__gt=watermark,
+        to_status__in=Tree.POOR_HEALTH_STATUSES
+    ).select_related('tree').order_by('id'))
+    
+    # Keep only the latest transition per tree
+    latest_events = {}
+    for event in events:
+        latest_events[event.tree_id] = event
+    
+    if not latest_events:
+        return 0
+    
+    # Trees that already have a recent open alert, or any alert raised since
+    # their event (re-read events must not alert twice)
+    day_ago = now - timedelta(days=1)
+    earliest = min([day_ago] + [event.created_at for event in latest_events.values()])
+    recent_alerts = Alert.objects.filter(
+        tree_id__in=latest_events.keys(),
+        created_at__gte=earliest
+    ).values_list('tree_id', 'created_at', 'is_resolved')
+    alerted_tree_ids = {
+        tree_id for tree_id, created_at, is_resolved in recent_alerts
+        if (not is_resolved and created_at >= day_ago) or created_at >= latest_events[tree_id].created_at
+    }
     
     alerts_created = 0
-    for tree in recently_declining:
-        # Check if alert already exists
-        existing_alert = Alert.objects.filter(
+    for tree_id, event in latest_events.items():
+        if tree_id in alerted_tree_ids:
+            continue
+        
+        tree = event.tree
+        alert = Alert.objects.create(
             tree=tree,
-            is_resolved=False,
-            created_at__gte=timezone.now() - timedelta(days=1)
-        ).exists()
+            severity='high' if event.to_status in ['diseased', 'critical'] else 'medium',
+            title=f"Tree Health Status Changed: {event.get_to_status_display()}",
+            message=f"Tree {tree.tree_id} at {tree.location_name} has changed from {event.from_status} to {event.to_status} status. Immediate ranger inspection recommended."
+        )
         
-        if not existing_alert:
-            alert = Alert.objects.create(
-                tree=tree,
-                severity='high' if tree.health_status == 'diseased' else 'medium',
-                title=f"Tree Health Status Changed: {tree.health_status.title()}",
-                message=f"Tree {tree.tree_id} at {tree.location_name} has changed to {tree.health_status} status. Immediate ranger inspection recommended."
-            )
-            
-            from .realtime_alerts import RealTimeAlertSystem
-            RealTimeAlertSystem.notify_rangers(alert)
-            alerts_created += 1
+        RealTimeAlertSystem.notify_rangers(alert)
+        alerts_created += 1
+    
+    settled = [event.id for event in events if event.created_at < now - HEALTH_EVENT_SETTLE_LAG]
+    if settled:
+        TaskWatermark.advance('monitor_tree_health_changes', max(settled))
     
     return alerts_created
 
 
-@shared_task
-def aggregate_daily_stats():
+@shared_task(acks_late=True)
+@single_flight(ttl=900)
+def aggregate_daily_stats(date=None):
     """
     Generate daily statistics for ranger dashboard
-    Runs once per day
+    Runs once per day at midnight and records the day that just ended
     """
-    from django.db.models import Count, Q
-    from trees.models import Tree
+    from datetime import date as date_cls
+    from .stats import compute_daily_stats
     
-    stats = {
-        'date': timezone.now().date(),
-        'total_trees': Tree.objects.count(),
-        'healthy_trees': Tree.objects.filter(health_status='healthy').count(),
-        'declining_trees': Tree.objects.filter(health_status='declining').count(),
-        'diseased_trees': Tree.objects.filter(health_status='diseased').count(),
-        'active_alerts': Alert.objects.filter(is_resolved=False).count(),
-        'critical_alerts': Alert.objects.filter(severity='critical', is_resolved=False).count(),
-        'reports_today': Tree.objects.filter(
-            reports__created_at__date=timezone.now().date()
-        ).count(),
-    }
+    if date:
+        day = date_cls.fromisoformat(date)
+    else:
+        day = timezone.localdate() - timedelta(days=1)
+    
+    stats = compute_daily_stats(day)
+    
+    print(f"Daily Stats stored for {stats.date}")
+    return stats.date.isoformat()
+
+
+@shared_task(acks_late=True)
+@single_flight(ttl=900)
+def rebuild_revenue_rollups(days=2):
+    """
+    Rebuild the revenue rollups of the last few closed days
+    Corrects any drift in the incrementally maintained rows
+    """
+    from .revenue import backfill_revenue_rollups
+    
+    end = timezone.localdate() - timedelta(days=1)
+    start = end - timedelta(days=days - 1)
+    written = backfill_revenue_rollups(start, end)
     
-    # Log stats or store in database
-    print(f"Daily Stats: {stats}")
-    return stats
+    print(f"Revenue rollups rebuilt for {start} to {end} ({written} rows)")
+    return written
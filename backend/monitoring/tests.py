@@ -1,3 +1,929 @@
-from django.test import TestCase
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy
+import requests
+from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image, ImageDraw, ImageFilter
+from rest_framework.test import APIClient
+
+from nilocate_project.celery import app
+from trees.adoption import settle_payment
+from trees.models import AdoptionRequest, Payment, Tree, TreeAdoption, TreeHealthEvent, TreeSpecies
+from users.models import User
+from . import metrics, retention
+from .analysis import bulk_analyze_reports, run_analysis_job, submit_analysis, unanalyzed_reports
+from .http_client import CircuitBreaker, CircuitOpenError, HttpClient, get_client
+from .idempotency import cached_response, claim, prune_receipts, remember_response
+from .inbound import drain_inbound_messages, parse_command
+from .locks import RELEASE_SCRIPT, CacheLock, single_flight
+from .models import (
+    AIAnalysis, AIAnalysisPayload, Alert, AnalysisJob, DailyStats, ImageAnalysisCache, InboundMessage,
+    RevenueRollup, TaskWatermark, TreeReport, WebhookReceipt
+)
+from .payments import reconcile_pending_payments
+from .revenue import backfill_revenue_rollups, record_payment, record_payments
+from .rate_limit import RateLimitExceeded, SlidingWindowLimiter
+from .services import GeminiAIService, ImageTriage
+from .stand_ins import FakeDaraja, StandInServer
+from .ussd import INCIDENT_MENU, MAIN_MENU
+from .tasks import (
+    analyze_report_image, initiate_adoption_payment, monitor_tree_health_changes, process_sms_report, send_adoption_sms
+)
+
+
+class ScriptedServer(StandInServer):
+    """Answers with queued (status, delay) pairs, then 200 once the script runs out"""
+    
+    def __init__(self, script=None):
+        super().__init__()
+        self.script = list(script or [])
+    
+    def handle(self, method, path, headers, body):
+        self.record((method, path))
+        status, delay = self.script.pop(0) if self.script else (200, 0)
+        if delay:
+            time.sleep(delay)
+        return status, {'status': status}
+
+
+class HttpClientTests(TestCase):
+    """Shared HTTP client against local stand-in servers"""
+    
+    def setUp(self):
+        cache.clear()
+    
+    def client_for(self, **kwargs):
+        options = {'connect_timeout': 1, 'read_timeout': 1, 'retries': 2, 'backoff': 0.01}
+        options.update(kwargs)
+        return HttpClient('test', **options)
+    
+    def test_reuses_pooled_connection(self):
+        with ScriptedServer() as server:
+            client = self.client_for()
+            for _ in range(3):
+                self.assertEqual(client.get(f'{server.url}/ping').status_code, 200)
+        
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(len(server.connections), 1)
+    
+    def test_read_timeout_is_enforced(self):
+        with ScriptedServer([(200, 1)]) as server:
+            client = self.client_for(read_timeout=0.1, retries=0)
+            started = time.monotonic()
+            with self.assertRaises(requests.Timeout):
+                client.get(f'{server.url}/slow')
+            elapsed = time.monotonic() - started
+        
+        self.assertLess(elapsed, 0.5)
+    
+    def test_retries_transient_errors_on_get(self):
+        with ScriptedServer([(503, 0), (502, 0)]) as server:
+            response = self.client_for().get(f'{server.url}/flaky')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(metrics.get('http.test.retries'), 2)
+    
+    def test_does_not_retry_post_after_it_was_sent(self):
+        with ScriptedServer([(503, 0)]) as server:
+            response = self.client_for().post(f'{server.url}/pay', json={})
+        
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(server.requests), 1)
+    
+    def test_retries_refused_connections_then_raises(self):
+        server = ScriptedServer().start()
+        url = f'{server.url}/gone'
+        server.stop()
+        
+        with self.assertRaises(requests.ConnectionError):
+            self.client_for().get(url)
+        self.assertEqual(metrics.get('http.test.retries'), 2)
+    
+    def test_circuit_opens_and_recovers(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=0.2)
+        with ScriptedServer([(500, 0), (500, 0)]) as server:
+            client = self.client_for(retries=0, breaker=breaker)
+            self.assertEqual(client.get(f'{server.url}/a').status_code, 500)
+            self.assertEqual(client.get(f'{server.url}/a').status_code, 500)
+            
+            # Open: fails fast without reaching the provider
+            with self.assertRaises(CircuitOpenError):
+                client.get(f'{server.url}/a')
+            self.assertEqual(len(server.requests), 2)
+            
+            # Half-open after the reset timeout: one successful trial closes it
+            time.sleep(0.25)
+            self.assertEqual(client.get(f'{server.url}/a').status_code, 200)
+            self.assertEqual(breaker.state, 'closed')
+    
+    def test_records_latency_histogram(self):
+        with ScriptedServer() as server:
+            client = self.client_for()
+            client.get(f'{server.url}/a')
+            client.get(f'{server.url}/b')
+        
+        histogram = metrics.histogram('http.test.latency_ms')
+        self.assertEqual(histogram['count'], 2)
+        self.assertEqual(sum(histogram['buckets'].values()), 2)
+
+
+class PaymentReconciliationTests(TestCase):
+    """Adoption payments and reconciliation of stale ones against a local Daraja stand-in"""
+    
+    def setUp(self):
+        cache.clear()
+        self.always_eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+        
+        self.user = User.objects.create(username='adopter', phone_number='0712345678')
+        species = TreeSpecies.objects.create(
+            name='Mukau', scientific_name='Melia volkensii', description='', risk_level='endangered',
+            native_region='', characteristics='', conservation_importance='', threats=''
+        )
+        self.tree = Tree.objects.create(
+            species=species, tree_id='KARURA-001', latitude=-1.2, longitude=36.8, location_name='Karura'
+        )
+    
+    def tearDown(self):
+        app.conf.task_always_eager = self.always_eager
+    
+    def make_payment(self, checkout_request_id, minutes_old):
+        payment = Payment.objects.create(
+            user=self.user, tree=self.tree, amount=500, phone_number='254712345678',
+            mpesa_checkout_request_id=checkout_request_id, status='pending'
+        )
+        AdoptionRequest.objects.create(
+            user=self.user, tree=self.tree, message='Adopting', phone_number='254712345678',
+            status='payment_pending', payment=payment
+        )
+        Payment.objects.filter(id=payment.id).update(created_at=timezone.now() - timedelta(minutes=minutes_old))
+        return payment
+    
+    def daraja_env(self, daraja):
+        return mock.patch.dict(os.environ, {
+            'MPESA_BASE_URL': daraja.url,
+            'MPESA_CONSUMER_KEY': 'key',
+            'MPESA_CONSUMER_SECRET': 'secret',
+        })
+    
+    def reconcile(self, daraja, **kwargs):
+        with self.daraja_env(daraja):
+            return reconcile_pending_payments(**kwargs)
+    
+    def test_payment_is_polled_from_initiating_to_completed(self):
+        adoption_request = AdoptionRequest.objects.create(
+            user=self.user, tree=self.tree, message='Adopting', phone_number='254712345678'
+        )
+        client = APIClient(HTTP_HOST='localhost')
+        client.force_authenticate(self.user)
+        
+        # The STK push is queued on commit, which this request leaves pending
+        response = client.post(f'/api/adoption-requests/{adoption_request.id}/initiate_payment/')
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        payment_id = response.json()['payment_id']
+        
+        polled = client.get(status_url).json()
+        self.assertEqual((polled['status'], polled['final'], polled['poll_after']), ('initiating', False, 3))
+        self.assertEqual(polled['adoption_request_status'], 'payment_pending')
+        
+        with FakeDaraja() as daraja, self.daraja_env(daraja):
+            self.assertEqual(initiate_adoption_payment(payment_id, 'Tree Adoption Fee'), 'pending')
+            # A redelivered task does not send a second push
+            self.assertEqual(initiate_adoption_payment(payment_id, 'Tree Adoption Fee'), 'pending')
+            self.assertEqual(daraja.count('/mpesa/stkpush/'), 1)
+        
+        polled = client.get(status_url).json()
+        self.assertEqual((polled['status'], polled['final'], polled['poll_after']), ('pending', False, 3))
+        checkout_request_id = Payment.objects.get(id=payment_id).mpesa_checkout_request_id
+        self.assertEqual(checkout_request_id, 'ws_CO_fake_1')
+        
+        callback = {'Body': {'stkCallback': {'ResultCode': 0, 'CheckoutRequestID': checkout_request_id}}}
+        with mock.patch.object(send_adoption_sms, 'delay'):
+            self.client.post(
+                '/api/mpesa/callback/', json.dumps(callback), content_type='application/json', HTTP_HOST='localhost'
+            )
+        
+        polled = client.get(status_url).json()
+        self.assertEqual((polled['status'], polled['final'], polled['poll_after']), ('completed', True, None))
+        self.assertEqual(polled['adoption_request_status'], 'completed')
+    
+    def test_settles_stale_payments_in_bulk(self):
+        paid = self.make_payment('ws_CO_paid', 30)
+        cancelled = self.make_payment('ws_CO_cancelled', 30)
+        broke = self.make_payment('ws_CO_broke', 30)
+        processing = self.make_payment('ws_CO_processing', 30)
+        recent = self.make_payment('ws_CO_recent', 1)
+        
+        outcomes = {'ws_CO_paid': '0', 'ws_CO_cancelled': '1032', 'ws_CO_broke': '1', 'ws_CO_recent': '0'}
+        with FakeDaraja(outcomes=outcomes) as daraja:
+            summary = self.reconcile(daraja, stale_minutes=10, workers=4)
+        
+        self.assertEqual(summary['checked'], 4)
+        self.assertEqual(summary['completed'], 1)
+        self.assertEqual(summary['cancelled'], 1)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(summary['still_pending'], 1)
+        self.assertCountEqual(summary['corrected'], ['ws_CO_paid', 'ws_CO_cancelled', 'ws_CO_broke'])
+        
+        # One token for the whole run, one query per stale payment
+        self.assertEqual(daraja.count('/oauth'), 1)
+        self.assertEqual(daraja.count('/mpesa/stkpushquery'), 4)
+        
+        statuses = dict(Payment.objects.values_list('mpesa_checkout_request_id', 'status'))
+        self.assertEqual(statuses['ws_CO_paid'], 'completed')
+        self.assertEqual(statuses['ws_CO_cancelled'], 'cancelled')
+        self.assertEqual(statuses['ws_CO_broke'], 'failed')
+        self.assertEqual(statuses['ws_CO_processing'], 'pending')
+        self.assertEqual(statuses['ws_CO_recent'], 'pending')
+        
+        self.assertEqual(AdoptionRequest.objects.get(payment=paid).status, 'completed')
+        self.assertTrue(TreeAdoption.objects.filter(user=self.user, tree=self.tree).exists())
+        self.assertEqual(AdoptionRequest.objects.get(payment=cancelled).status, 'payment_failed')
+        self.assertEqual(AdoptionRequest.objects.get(payment=broke).status, 'payment_failed')
+        self.assertEqual(AdoptionRequest.objects.get(payment=processing).status, 'payment_pending')
+    
+    def test_late_callback_after_reconciliation_is_ignored(self):
+        paid = self.make_payment('ws_CO_paid', 30)
+        with FakeDaraja(outcomes={'ws_CO_paid': '0'}) as daraja:
+            self.reconcile(daraja)
+        
+        callback = {'Body': {'stkCallback': {'ResultCode': 0, 'CheckoutRequestID': 'ws_CO_paid'}}}
+        response = self.client.post(
+            '/api/mpesa/callback/', json.dumps(callback), content_type='application/json', HTTP_HOST='localhost'
+        )
+        
+        self.assertEqual(response.json()['message'], 'Callback already processed')
+        self.assertEqual(TreeAdoption.objects.filter(user=self.user, tree=self.tree).count(), 1)
+        self.assertEqual(Payment.objects.get(id=paid.id).status, 'completed')
+    
+    def test_fails_payments_whose_push_was_never_sent(self):
+        payment = Payment.objects.create(
+            user=self.user, tree=self.tree, amount=500, phone_number='254712345678'
+        )
+        AdoptionRequest.objects.create(
+            user=self.user, tree=self.tree, message='Adopting', phone_number='254712345678',
+            status='payment_pending', payment=payment
+        )
+        Payment.objects.filter(id=payment.id).update(created_at=timezone.now() - timedelta(minutes=30))
+        
+        with FakeDaraja() as daraja:
+            summary = self.reconcile(daraja)
+        
+        self.assertEqual(summary['unsent'], 1)
+        self.assertEqual(Payment.objects.get(id=payment.id).status, 'failed')
+        self.assertEqual(AdoptionRequest.objects.get(payment=payment).status, 'payment_failed')
+        self.assertEqual(daraja.count('/mpesa/stkpushquery'), 0)
+    
+    def test_outage_does_not_expire_payments(self):
+        self.make_payment('ws_CO_paid_late', 60 * 30)
+        breaker = get_client('mpesa').breaker
+        for _ in range(breaker.threshold):
+            breaker.record_failure()
+        self.addCleanup(breaker.record_success)
+        
+        with FakeDaraja() as daraja:
+            summary = self.reconcile(daraja, expire_hours=24)
+        
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['expired'], 0)
+        self.assertEqual(daraja.count('/mpesa/stkpushquery'), 0)
+        self.assertEqual(Payment.objects.get(mpesa_checkout_request_id='ws_CO_paid_late').status, 'pending')
+        # The paid customer's late callback still goes through
+        self.assertIsNotNone(settle_payment('ws_CO_paid_late', succeeded=True, complete=False))
+    
+    def test_callback_without_checkout_request_id_settles_nothing(self):
+        unsent = Payment.objects.create(
+            user=self.user, tree=self.tree, amount=500, phone_number='254712345678'
+        )
+        
+        callback = {'Body': {'stkCallback': {'ResultCode': 0}}}
+        response = self.client.post(
+            '/api/mpesa/callback/', json.dumps(callback), content_type='application/json', HTTP_HOST='localhost'
+        )
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaises(Payment.DoesNotExist):
+            settle_payment(None, succeeded=True, receipt_number='FAKE', complete=False)
+        
+        unsent.refresh_from_db()
+        self.assertEqual(unsent.status, 'initiating')
+        self.assertIsNone(unsent.mpesa_receipt_number)
+    
+    def test_expires_payments_unresolved_for_too_long(self):
+        self.make_payment('ws_CO_lost', 60 * 30)
+        with FakeDaraja() as daraja:
+            summary = self.reconcile(daraja, expire_hours=24)
+        
+        self.assertEqual(summary['expired'], 1)
+        payment = Payment.objects.get(mpesa_checkout_request_id='ws_CO_lost')
+        self.assertEqual(payment.status, 'failed')
+        self.assertEqual(payment.result_description, 'Payment expired without confirmation')
+
+
+class AnalysisJobTests(TestCase):
+    """Background AI analysis jobs and the image fingerprint cache"""
+    
+    def setUp(self):
+        cache.clear()
+        self.always_eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        
+        self.user = User.objects.create(username='reporter')
+        species = TreeSpecies.objects.create(
+            name='Mukau', scientific_name='Melia volkensii', description='', risk_level='endangered',
+            native_region='', characteristics='', conservation_importance='', threats=''
+        )
+        self.tree = Tree.objects.create(
+            species=species, tree_id='KARURA-001', latitude=-1.2, longitude=36.8, location_name='Karura'
+        )
+        self.report = self.make_report(self.make_photo(1))
+        self.gemini = mock.patch.object(GeminiAIService, 'analyze_tree_image', return_value={
+            'health_assessment': 'declining', 'confidence_score': 82,
+            'detected_issues': 'Leaf chlorosis', 'recommendations': 'Check soil nitrogen',
+        })
+        self.analyze = self.gemini.start()
+    
+    def tearDown(self):
+        self.gemini.stop()
+        app.conf.task_always_eager = self.always_eager
+    
+    def make_photo(self, seed, size=(640, 480), quality=90):
+        """JPEG bytes of a synthetic photo; the same seed always draws the same scene"""
+        rng = random.Random(seed)
+        image = Image.new('RGB', (640, 480), (40, 90, 40))
+        draw = ImageDraw.Draw(image)
+        for _ in range(12):
+            x, y = rng.randrange(600), rng.randrange(440)
+            color = tuple(rng.randrange(256) for _ in range(3))
+            draw.ellipse([x, y, x + rng.randrange(40, 200), y + rng.randrange(40, 200)], fill=color)
+        output = io.BytesIO()
+        image.resize(size).save(output, 'JPEG', quality=quality)
+        return output.getvalue()
+    
+    def make_report(self, photo):
+        return TreeReport.objects.create(
+            tree=self.tree, reporter=self.user, report_type='disease', title='Yellow leaves',
+            description='', image=SimpleUploadedFile('leaves.jpg', photo, content_type='image/jpeg')
+        )
+    
+    def test_repeated_requests_share_the_job_in_flight(self):
+        with mock.patch.object(analyze_report_image, 'delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                first, created = submit_analysis(self.report, 'analyze', self.user)
+                second, created_again = submit_analysis(self.report, 'analyze_ai', self.user)
+        
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(first.id, second.id)
+        delay.assert_called_once_with(first.id)
+    
+    def test_job_stores_result_and_runs_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job, _ = submit_analysis(self.report, 'analyze', self.user)
+        
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.result['analysis']['health_assessment'], 'declining')
+        self.assertEqual(job.result['dashboard']['severity'], 'medium')
+        # A redelivered task leaves the finished job alone
+        self.assertIsNone(run_analysis_job(job.id))
+        self.assertEqual(self.analyze.call_count, 1)
+        
+        # Finished jobs no longer block a new analysis
+        with mock.patch.object(analyze_report_image, 'delay'):
+            _, created = submit_analysis(self.report, 'analyze_ai', self.user)
+        self.assertTrue(created)
+    
+    def test_reuploaded_photos_are_served_from_cache(self):
+        photo = self.make_photo(1)
+        resent = self.make_photo(1, size=(320, 240), quality=60)
+        reports = [self.report, self.make_report(photo), self.make_report(resent), self.make_report(self.make_photo(2))]
+        self.assertEqual(reports[0].image_sha256, reports[1].image_sha256)
+        self.assertNotEqual(reports[0].image_sha256, reports[2].image_sha256)
+        
+        for report in reports:
+            run_analysis_job(AnalysisJob.objects.create(report=report).id)
+        
+        # Only the original and the unrelated photo reach Gemini
+        self.assertEqual(self.analyze.call_count, 2)
+        self.assertEqual(AIAnalysis.objects.filter(report__in=reports).count(), 4)
+        self.assertEqual(AIAnalysis.objects.get(report=reports[2]).health_assessment, 'declining')
+        counters = metrics.snapshot('ai_cache.')
+        self.assertEqual(counters['ai_cache.exact_hits'], 1)
+        self.assertEqual(counters['ai_cache.near_hits'], 1)
+        self.assertEqual(metrics.hit_rates(counters)['ai_cache.hit_rate'], 0.5)
+    
+    def test_failed_analyses_are_not_cached(self):
+        self.analyze.return_value = {
+            'health_assessment': 'unknown', 'confidence_score': 0,
+            'detected_issues': [], 'recommendations': 'Error analyzing image: quota exceeded',
+        }
+        for report in [self.report, self.make_report(self.make_photo(1))]:
+            run_analysis_job(AnalysisJob.objects.create(report=report).id)
+        
+        self.assertEqual(self.analyze.call_count, 2)
+        self.assertFalse(ImageAnalysisCache.objects.exists())
+    
+    def test_raw_analysis_lives_in_a_lazily_loaded_payload(self):
+        run_analysis_job(AnalysisJob.objects.create(report=self.report).id)
+        self.assertEqual(AIAnalysisPayload.objects.get().load()['detected_issues'], 'Leaf chlorosis')
+        
+        analysis = AIAnalysis.objects.get(report=self.report)
+        with self.assertNumQueries(1):
+            self.assertEqual(analysis.raw_analysis['recommendations'], 'Check soil nitrogen')
+            self.assertEqual(analysis.raw_analysis['confidence_score'], 82)
+        
+        client = APIClient(HTTP_HOST='localhost')
+        with CaptureQueriesContext(connection) as queries:
+            reports = client.get('/api/reports/').json()
+            client.get(f'/api/reports/{self.report.id}/')
+        self.assertTrue(reports['results'][0]['has_ai_analysis'])
+        self.assertFalse([q for q in queries.captured_queries if 'aianalysispayload' in q['sql']])
+        
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get(f'/api/reports/{self.report.id}/raw_analysis/').status_code, 403)
+        self.user.user_type = 'ranger'
+        self.user.save()
+        raw = client.get(f'/api/reports/{self.report.id}/raw_analysis/').json()
+        self.assertEqual(raw['raw_analysis']['detected_issues'], 'Leaf chlorosis')
+    
+    def test_uploads_are_upright_downscaled_and_stripped(self):
+        # A portrait phone photo stored sideways with orientation and GPS in its EXIF
+        photo = Image.new('RGB', (4000, 3000), (40, 90, 40))
+        ImageDraw.Draw(photo).rectangle([0, 0, 400, 3000], fill=(200, 40, 40))
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotate 90 degrees clockwise to view
+        exif[0x8825] = {1: 'S', 2: (1.0, 17.0, 30.0)}
+        output = io.BytesIO()
+        photo.save(output, 'JPEG', quality=95, exif=exif)
+        
+        report = self.make_report(output.getvalue())
+        
+        with Image.open(report.image.path) as stored:
+            self.assertEqual(stored.size, (1536, 2048))
+            self.assertEqual(len(stored.getexif()), 0)
+            # The red strip down the left edge is now along the top
+            self.assertGreater(stored.getpixel((1000, 20))[0], 150)
+        with Image.open(report.ai_image.path) as ai_input:
+            self.assertEqual(max(ai_input.size), 1024)
+        self.assertLess(report.image.size, len(output.getvalue()))
+    
+    def test_bulk_analysis_clears_backlog_and_checkpoints(self):
+        reports = [self.report] + [self.make_report(self.make_photo(seed)) for seed in (2, 3, 2)]
+        TreeReport.objects.create(tree=self.tree, reporter=self.user, report_type='general', title='No photo', description='')
+        run_analysis_job(AnalysisJob.objects.create(report=reports[1]).id)
+        self.analyze.reset_mock()
+        
+        fresh = dict(self.analyze.return_value)
+        self.analyze.side_effect = [fresh, RateLimitExceeded('gemini quota exhausted')]
+        summary = bulk_analyze_reports(limit=10, workers=1)
+        
+        # Report 1 analysed, report 3 hit the quota; report 2 already had an analysis
+        self.assertTrue(summary['rate_limited'])
+        self.assertEqual(summary['analyzed'], 1)
+        self.assertEqual(TaskWatermark.get_position('bulk_analyze_reports'), reports[0].id)
+        
+        self.analyze.side_effect = None
+        summary = bulk_analyze_reports(limit=10, workers=2)
+        
+        # Report 4 repeats report 2's photo
+        self.assertEqual(summary['analyzed'], 2)
+        self.assertEqual(summary['cached'], 1)
+        self.assertTrue(summary['sweep_complete'])
+        self.assertEqual(self.analyze.call_count, 3)
+        self.assertEqual(AIAnalysis.objects.filter(report__in=reports).count(), 4)
+        self.assertEqual(AIAnalysisPayload.objects.filter(analysis__report__in=reports).count(), 4)
+        self.assertFalse(unanalyzed_reports().exists())
+        self.assertEqual(TaskWatermark.get_position('bulk_analyze_reports'), 0)
+
+
+class SlidingWindowLimiterTests(TestCase):
+    """Shared provider quota"""
+    
+    def setUp(self):
+        cache.clear()
+    
+    def test_reserve_is_left_for_other_callers(self):
+        limiter = SlidingWindowLimiter('test', capacity=3, period=3600)
+        
+        self.assertTrue(limiter.try_acquire(reserve=1))
+        self.assertTrue(limiter.try_acquire(reserve=1))
+        self.assertFalse(limiter.try_acquire(reserve=1))
+        self.assertTrue(limiter.try_acquire())
+        self.assertFalse(limiter.try_acquire())
+        with self.assertRaises(RateLimitExceeded):
+            limiter.acquire(timeout=0)
+    
+    def test_burst_cannot_repeat_across_a_minute_boundary(self):
+        limiter = SlidingWindowLimiter('test', capacity=3, period=60)
+        
+        # The cache expires slots on the same clock
+        with mock.patch('time.time', return_value=1_000_000 * 60 - 1):
+            self.assertEqual([limiter.try_acquire() for _ in range(4)], [True, True, True, False])
+        with mock.patch('time.time', return_value=1_000_000 * 60 + 1):
+            self.assertFalse(limiter.try_acquire())
+            self.assertAlmostEqual(limiter.seconds_until_free(), 58)
+        # A full period after the burst its slots are free again
+        with mock.patch('time.time', return_value=1_000_000 * 60 + 59):
+            self.assertEqual([limiter.try_acquire() for _ in range(4)], [True, True, True, False])
+
+
+class ImageTriageTests(TestCase):
+    """Local triage of photos ahead of Gemini"""
+    
+    def setUp(self):
+        cache.clear()
+        self.rng = numpy.random.default_rng(7)
+        self.triage = ImageTriage()
+    
+    def canopy(self, yellow_share=0.0, brightness=1.0, blur=0):
+        """Leafy canopy photo with `yellow_share` of its leaf patches yellowing"""
+        noise = numpy.kron(self.rng.random((60, 80)), numpy.ones((8, 8)))
+        green = numpy.stack([30 + 40 * noise, 90 + 110 * noise, 20 + 40 * noise], -1)
+        yellow = numpy.stack([170 + 60 * noise, 140 + 50 * noise, 30 + 20 * noise], -1)
+        mask = numpy.kron(self.rng.random((60, 80)) < yellow_share, numpy.ones((8, 8)))[..., None]
+        pixels = numpy.clip(numpy.where(mask, yellow, green) * brightness, 0, 255).astype(numpy.uint8)
+        image = Image.fromarray(pixels)
+        return image.filter(ImageFilter.GaussianBlur(blur)) if blur else image
+    
+    def classify(self, image):
+        return self.triage.classify(self.triage.features(image))
+    
+    def test_obvious_cases_are_settled_locally(self):
+        self.assertEqual(self.classify(self.canopy()), ('healthy', 'green_canopy'))
+        self.assertEqual(self.classify(self.canopy(brightness=0.1)), ('unusable', 'too_dark'))
+        self.assertEqual(self.classify(self.canopy(blur=10)), ('unusable', 'blurry'))
+        
+        sky = Image.new('RGB', (640, 480), (120, 170, 230))
+        ImageDraw.Draw(sky).line([0, 240, 640, 250], fill=(60, 60, 60), width=3)
+        self.assertEqual(self.classify(sky), ('unusable', 'no_foliage'))
+    
+    def test_discoloured_foliage_goes_to_gemini(self):
+        self.assertEqual(self.classify(self.canopy(yellow_share=0.3)), ('ambiguous', None))
+    
+    def test_unusable_photo_skips_gemini(self):
+        path = os.path.join(tempfile.mkdtemp(), 'dark.jpg')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        self.canopy(brightness=0.1).save(path)
+        
+        service = GeminiAIService()
+        with mock.patch.object(service.model, 'generate_content') as generate:
+            result = service.analyze_tree_image(path)
+        
+        generate.assert_not_called()
+        self.assertEqual(result['health_assessment'], 'unknown')
+        self.assertEqual(result['source'], 'triage')
+        self.assertIn('retake', result['recommendations'])
+        self.assertEqual(metrics.get('ai_triage.unusable'), 1)
+
+
+class RetentionTests(TestCase):
+    """Chunked archival and deletion of expired rows"""
+    
+    def setUp(self):
+        archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_root, True)
+        archives = override_settings(ARCHIVE_ROOT=archive_root)
+        archives.enable()
+        self.addCleanup(archives.disable)
+        
+        user = User.objects.create(username='reporter')
+        species = TreeSpecies.objects.create(
+            name='Mukau', scientific_name='Melia volkensii', description='', risk_level='endangered',
+            native_region='', characteristics='', conservation_importance='', threats=''
+        )
+        self.tree = Tree.objects.create(
+            species=species, tree_id='KARURA-001', latitude=-1.2, longitude=36.8, location_name='Karura'
+        )
+        self.reports = [
+            TreeReport.objects.create(
+                tree=self.tree, reporter=user, report_type='disease', title=f'Report {i}', description='', status='verified'
+            )
+            for i in range(2)
+        ]
+        for report in self.reports:
+            analysis = AIAnalysis(
+                report=report, health_assessment='declining', confidence_score=82, detected_issues=[],
+                recommendations='Check soil', raw_analysis={'raw_response': 'long text'}
+            )
+            analysis.save()
+            AnalysisJob.objects.create(report=report, status='succeeded', analysis=analysis)
+            Alert.objects.create(tree=self.tree, report=report, severity='medium', title='Declining', message='')
+        TreeReport.objects.update(updated_at=timezone.now() - timedelta(days=400))
+    
+    def test_reports_are_archived_with_everything_their_delete_cascades_into(self):
+        policy = retention.POLICIES['tree_reports']
+        select_for_update = QuerySet.select_for_update
+        
+        def reopen_before_lock(queryset, *args, **kwargs):
+            # A ranger reopens one report after the chunk's ids were read
+            TreeReport.objects.filter(pk=self.reports[1].pk).update(status='pending')
+            return select_for_update(queryset, *args, **kwargs)
+        
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=reopen_before_lock):
+            result = retention.apply_policy(policy)
+        
+        self.assertEqual(result['processed'], 1)
+        self.assertEqual(list(TreeReport.objects.values_list('id', flat=True)), [self.reports[1].id])
+        self.assertEqual(AnalysisJob.objects.count(), 1)
+        self.assertEqual(AIAnalysisPayload.objects.count(), 1)
+        
+        restored = retention.restore_archive(result['archives'][0])
+        
+        # Only the expired report's rows were archived; the reopened one is untouched
+        self.assertEqual(restored, 5)
+        self.assertEqual(TreeReport.objects.get(pk=self.reports[1].pk).status, 'pending')
+        self.assertEqual(TreeReport.objects.count(), 2)
+        self.assertEqual(AnalysisJob.objects.filter(report=self.reports[0]).count(), 1)
+        self.assertEqual(Alert.objects.filter(report=self.reports[0]).count(), 1)
+        analysis = AIAnalysis.objects.get(report=self.reports[0])
+        self.assertEqual(analysis.raw_analysis, {'raw_response': 'long text'})
+        self.assertEqual(AnalysisJob.objects.get(report=self.reports[0]).analysis, analysis)
+    
+    def test_restore_skips_rows_that_already_exist(self):
+        result = retention.apply_policy(retention.POLICIES['tree_reports'])
+        self.assertEqual(retention.restore_archive(result['archives'][0]), 10)
+        
+        TreeReport.objects.filter(pk=self.reports[0].pk).update(status='pending')
+        self.assertEqual(retention.restore_archive(result['archives'][0]), 0)
+        self.assertEqual(TreeReport.objects.get(pk=self.reports[0].pk).status, 'pending')
+        self.assertEqual(Alert.objects.count(), 2)
+
+
+class ReportingApiTests(TestCase):
+    """Precomputed statistics and revenue endpoints"""
+    
+    def setUp(self):
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(User.objects.create(username='admin', user_type='admin'))
+    
+    def test_daily_stats_rejects_invalid_dates(self):
+        DailyStats.objects.create(date='2026-03-01')
+        DailyStats.objects.create(date='2026-03-05')
+        
+        response = self.client.get('/api/daily-stats/', {'start': '2026-03-02', 'end': '2026-03-31'})
+        self.assertEqual([row['date'] for row in response.json()['results']], ['2026-03-05'])
+        for params in [{'start': '2026-13-45'}, {'end': 'yesterday'}]:
+            response = self.client.get('/api/daily-stats/', params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(list(params)[0], response.json())
+    
+    def test_incremental_revenue_matches_a_backfill(self):
+        user = User.objects.create(username='adopter')
+        trees = []
+        for name, forest in [('Mukau', 'Karura'), ('Meru Oak', 'Ngong')]:
+            species = TreeSpecies.objects.create(
+                name=name, scientific_name=name, description='', risk_level='endangered',
+                native_region='', characteristics='', conservation_importance='', threats=''
+            )
+            trees.append(Tree.objects.create(
+                species=species, tree_id=f'{forest.upper()}-001', latitude=-1.2, longitude=36.8, location_name=forest
+            ))
+        noon = timezone.make_aware(datetime(2026, 3, 1, 12))
+        payments = [
+            Payment.objects.create(
+                user=user, tree=tree, amount=amount, phone_number='254712345678',
+                status='completed', transaction_date=noon + timedelta(days=days)
+            )
+            for tree, amount, days in [(trees[0], 500, 0), (trees[1], 1000, 0), (trees[0], 250, 0), (trees[0], 750, 1)]
+        ]
+        
+        # Existing rows are incremented with F() expressions
+        record_payments(payments[:2])
+        for payment in payments[2:]:
+            record_payment(payment)
+        fields = ['date', 'dimension', 'key', 'source', 'amount', 'transactions']
+        incremental = sorted(RevenueRollup.objects.values_list(*fields))
+        
+        backfill_revenue_rollups(noon.date(), noon.date() + timedelta(days=1))
+        self.assertEqual(sorted(RevenueRollup.objects.values_list(*fields)), incremental)
+        
+        response = self.client.get('/api/revenue/', {'start': '2026-03-01', 'end': '2026-03-02', 'dimension': 'species'})
+        self.assertEqual(response.json()['total'], {'amount': '2500.00', 'transactions': 4})
+        self.assertEqual(response.json()['totals'][0], {'key': 'Mukau', 'amount': '1500.00', 'transactions': 3})
+        
+        for params in [{'start': '2026-02-30'}, {'end': '01/03/2026'}]:
+            response = self.client.get('/api/revenue/', params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(list(params)[0], response.json())
+
+
+class SingleFlightTests(TestCase):
+    """Cache locks that keep periodic tasks from overlapping"""
+    
+    def setUp(self):
+        cache.clear()
+    
+    def test_overlapping_run_is_skipped_and_counted(self):
+        calls = []
+        
+        @single_flight(ttl=60, key='task-lock:test')
+        def nightly_job():
+            calls.append('run')
+            # A second delivery arriving while the first is still running
+            calls.append(nightly_job())
+            return 'done'
+        
+        self.assertEqual(nightly_job(), 'done')
+        self.assertEqual(calls, ['run', None])
+        self.assertEqual(metrics.get('tasks.nightly_job.skipped'), 1)
+        self.assertEqual(metrics.get('tasks.nightly_job.runs'), 1)
+        # The lock is released once the run ends
+        self.assertIsNone(cache.get('task-lock:test'))
+        self.assertEqual(nightly_job(), 'done')
+    
+    def test_heartbeat_keeps_a_long_run_locked(self):
+        lock = CacheLock('task-lock:slow', ttl=1)
+        self.assertTrue(lock.acquire())
+        lock.start_heartbeat(0.2)
+        
+        time.sleep(1.5)
+        self.assertTrue(lock.is_owner())
+        self.assertFalse(CacheLock('task-lock:slow', ttl=1).acquire())
+        
+        lock.release()
+        self.assertTrue(CacheLock('task-lock:slow', ttl=1).acquire())
+    
+    def test_redis_release_compares_the_token_atomically(self):
+        backend = RedisCache('redis://localhost:6379/0', {})
+        client = mock.Mock()
+        client.eval.return_value = 1
+        lock = CacheLock('task-lock:redis', ttl=60)
+        
+        with mock.patch('monitoring.locks.caches', {'default': backend}), \
+                mock.patch.object(backend._cache, 'get_client', return_value=client):
+            lock.release()
+        
+        key = backend.make_and_validate_key('task-lock:redis')
+        token = backend._cache._serializer.dumps(lock.token)
+        client.eval.assert_called_once_with(RELEASE_SCRIPT, 1, key, token)
+
+
+
+class TreeHealthMonitorTests(TestCase):
+    """Incremental alerting on tree health events"""
+    
+    def setUp(self):
+        species = TreeSpecies.objects.create(
+            name='Mukau', scientific_name='Melia volkensii', description='', risk_level='endangered',
+            native_region='', characteristics='', conservation_importance='', threats=''
+        )
+        self.trees = [
+            Tree.objects.create(
+                species=species, tree_id=f'KARURA-00{i}', latitude=-1.2, longitude=36.8, location_name='Karura'
+            )
+            for i in range(2)
+        ]
+    
+    def test_late_committed_event_is_not_skipped(self):
+        late = TreeHealthEvent.objects.create(tree=self.trees[0], from_status='healthy', to_status='diseased')
+        newer = TreeHealthEvent.objects.create(tree=self.trees[1], from_status='healthy', to_status='critical')
+        # The lower id is not visible yet when the job runs
+        late_id = late.id
+        late.delete()
+        
+        self.assertEqual(monitor_tree_health_changes(), 1)
+        TreeHealthEvent.objects.create(id=late_id, tree=self.trees[0], from_status='healthy', to_status='diseased')
+        self.assertEqual(monitor_tree_health_changes(), 1)
+        
+        # Re-reading the same events inside the lag window does not alert again
+        Alert.objects.update(is_resolved=True)
+        self.assertEqual(monitor_tree_health_changes(), 0)
+        self.assertEqual(TaskWatermark.get_position('monitor_tree_health_changes'), 0)
+        
+        TreeHealthEvent.objects.update(created_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(monitor_tree_health_changes(), 0)
+        self.assertEqual(TaskWatermark.get_position('monitor_tree_health_changes'), newer.id)
+        self.assertEqual(Alert.objects.count(), 2)
+
+class MetricsTests(TestCase):
+    """Counters kept in the shared cache"""
+    
+    def setUp(self):
+        cache.clear()
+    
+    def test_counter_lost_from_the_index_is_registered_again(self):
+        metrics.incr('webhooks.sms.received')
+        metrics.incr('webhooks.ussd.received')
+        # A concurrent index write dropped one of the names
+        cache.set(metrics.METRICS_INDEX_KEY, {'webhooks.ussd.received'}, None)
+        
+        metrics.incr('webhooks.sms.received')
+        self.assertEqual(metrics.snapshot('webhooks.'), {'webhooks.sms.received': 2, 'webhooks.ussd.received': 1})
+
+
+class UssdSessionTests(TestCase):
+    """Cached USSD dialogue state across retried and out-of-order hops"""
+    
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient(HTTP_HOST='localhost')
+    
+    def hop(self, text):
+        response = self.client.post('/api/ussd/webhook/', {
+            'sessionId': 'ATUid_1', 'phoneNumber': '+254712345678', 'text': text
+        })
+        return response.content.decode()
+    
+    def test_replayed_and_out_of_order_hops_resume_from_cached_state(self):
+        self.assertEqual(self.hop(''), MAIN_MENU)
+        self.assertEqual(self.hop('1'), INCIDENT_MENU)
+        # A retried hop gets the same answer without advancing the menu
+        self.assertEqual(self.hop('1'), INCIDENT_MENU)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.hop('1*1'), "CON Enter Tree ID near incident:")
+        
+        # A hop that does not extend the cached path is replayed from the main menu
+        self.assertEqual(self.hop('1*2*karura-001'), "CON Describe the incident:")
+        
+        with mock.patch.object(process_sms_report, 'delay') as report:
+            final = self.hop('1*2*karura-001*Men cutting*trees')
+            self.assertEqual(self.hop('1*2*karura-001*Men cutting*trees'), final)
+        
+        self.assertTrue(final.startswith('END Report submitted.\nRef: KARURA-001-illegal_logging'))
+        report.assert_called_once_with('+254712345678', 'REPORT KARURA-001 illegal_logging Men cutting*trees')
+
+
+class WebhookIdempotencyTests(TestCase):
+    """Deduplication of provider webhook retries"""
+    
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient(HTTP_HOST='localhost')
+    
+    def test_retried_sms_is_stored_once(self):
+        delivery = {'from': '+254712345678', 'text': 'STATUS KARURA-001', 'id': 'ATXid_1'}
+        for _ in range(2):
+            response = self.client.post('/api/sms/webhook/', delivery)
+            self.assertEqual(response.json()['status'], 'success')
+        
+        self.assertEqual(InboundMessage.objects.count(), 1)
+        self.assertEqual(metrics.get('webhooks.sms.duplicates'), 1)
+        # Once the cache has forgotten the delivery, the receipt table still knows it
+        cache.clear()
+        self.assertFalse(claim('sms', 'ATXid_1'))
+        with self.assertRaises(ValueError):
+            claim('sms', '')
+    
+    def test_duplicate_delivery_gets_the_cached_response(self):
+        self.assertIsNone(cached_response('ussd', 'ATUid_1:1'))
+        remember_response('ussd', 'ATUid_1:1', INCIDENT_MENU)
+        self.assertEqual(cached_response('ussd', 'ATUid_1:1'), INCIDENT_MENU)
+        self.assertIsNone(cached_response('ussd', 'ATUid_1:2'))
+    
+    def test_pruning_removes_only_expired_receipts(self):
+        old = WebhookReceipt.objects.create(source='mpesa', key='ws_CO_old')
+        recent = WebhookReceipt.objects.create(source='mpesa', key='ws_CO_recent')
+        WebhookReceipt.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=31))
+        WebhookReceipt.objects.filter(pk=recent.pk).update(created_at=timezone.now() - timedelta(days=29))
+        
+        self.assertEqual(prune_receipts(days=30), 1)
+        self.assertEqual(list(WebhookReceipt.objects.values_list('key', flat=True)), ['ws_CO_recent'])
+
+
+class InboundDrainTests(TestCase):
+    """Batched draining of stored inbound SMS"""
+    
+    def test_one_bad_message_does_not_block_the_batch(self):
+        for text in ('HELP', 'BOOM', 'HELP'):
+            InboundMessage.objects.create(phone_number='+254712345678', text=text)
+        
+        def parse(text):
+            if text == 'BOOM':
+                raise ValueError('unparseable message')
+            return parse_command(text)
+        
+        with mock.patch('monitoring.inbound.parse_command', side_effect=parse), \
+                mock.patch('monitoring.tasks.send_sms_bulk.delay') as send:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(drain_inbound_messages(batch_size=10), 3)
+        
+        statuses = dict(InboundMessage.objects.values_list('text', 'status').distinct())
+        self.assertEqual(statuses, {'HELP': 'processed', 'BOOM': 'failed'})
+        self.assertEqual(InboundMessage.objects.get(text='BOOM').error, 'unparseable message')
+        self.assertEqual(len(send.call_args.args[0]), 2)
+        # Nothing is left pending, so the next drain moves on
+        InboundMessage.objects.create(phone_number='+254712345678', text='HELP')
+        with mock.patch('monitoring.tasks.send_sms_bulk.delay'):
+            self.assertEqual(drain_inbound_messages(batch_size=10), 1)
@@ -0,0 +1,88 @@
+"""
+Responsive image variants
+Tree, species, report and campaign images get smaller copies (IMAGE_VARIANTS)
+generated in the background after upload, so list and map views do not
+download full-size photos. Variant files are named after the hash of the
+source image; a name never changes content, so they can be cached forever
+and identical images share their variants.
+"""
+import hashlib
+import io
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image
+
+from .images import encode_image, resize_image
+
+# (model label, image field) pairs that carry a `<field>_variants` JSONField
+VARIANT_FIELDS = [
+    ('trees.TreeSpecies', 'image'),
+    ('trees.Tree', 'image'),
+    ('monitoring.TreeReport', 'image'),
+    ('campaigns.Campaign', 'cover_image'),
+]
+
+
+def build_variants(name):
+    """
+    Write the variants of the stored image `name`
+    
+    Returns:
+        dict: {variant: {'name': storage name, 'width': pixels}}
+    """
+    with default_storage.open(name, 'rb') as source_file:
+        data = source_file.read()
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    
+    variants = {}
+    for variant, max_dimension in settings.IMAGE_VARIANTS.items():
+        stem = f'variants/{digest[:2]}/{digest}_{max_dimension}'
+        existing = [name for name in (f'{stem}.jpg', f'{stem}.png') if default_storage.exists(name)]
+        if existing:
+            with default_storage.open(existing[0]) as variant_file, Image.open(variant_file) as image:
+                variants[variant] = {'name': existing[0], 'width': image.width}
+            continue
+        
+        with Image.open(io.BytesIO(data)) as source:
+            image = resize_image(source, max_dimension)
+        content, extension = encode_image(image, settings.IMAGE_QUALITY)
+        name = default_storage.save(f'{stem}{extension}', ContentFile(content))
+        variants[variant] = {'name': name, 'width': image.width}
+    return variants
+
+
+def queue_variants(instance, field_name):
+    """Generate variants for a newly saved upload once the transaction commits"""
+    from .tasks import generate_image_variants
+    
+    name = getattr(instance, field_name).name
+    label = instance._meta.label
+    transaction.on_commit(lambda: generate_image_variants.delay(label, instance.pk, field_name, name))
+
+
+def save_variants(label, pk, field_name, name, variants):
+    """Store variants unless the image was replaced meanwhile; returns whether it was stored"""
+    model = apps.get_model(label)
+    return bool(
+        model.objects.filter(pk=pk, **{field_name: name}).update(**{f'{field_name}_variants': variants})
+    )
+
+
+def variant_urls(variants, build_url=None):
+    """
+    URLs for stored variants, or None before they are generated
+    
+    Returns:
+        dict: one URL per variant plus a `srcset` attribute value
+    """
+    if not variants:
+        return None
+    build_url = build_url or (lambda url: url)
+    urls = {variant: build_url(default_storage.url(info['name'])) for variant, info in variants.items()}
+    ordered = sorted(variants, key=lambda variant: variants[variant]['width'])
+    urls['srcset'] = ', '.join(f"{urls[variant]} {variants[variant]['width']}w" for variant in ordered)
+    return urls
@@ -0,0 +1,204 @@
+"""
+USSD session state machine
+Menu position and caller context live in the shared cache keyed by the
+Africa's Talking sessionId, so each hop only processes the newest input
+instead of re-deriving the whole path from the cumulative `text`.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from trees.models import TreeAdoption
+from trees.status_cards import get_status_card
+from users.phone import resolve_user_id
+from .idempotency import claim
+from .tasks import process_sms_report
+
+MAIN_MENU = (
+    "CON Welcome to Nilocate\n"
+    "1. Report Incident\n"
+    "2. Check Tree Status\n"
+    "3. My Adoptions\n"
+    "4. Help"
+)
+
+INCIDENT_MENU = (
+    "CON Select Incident Type:\n"
+    "1. Forest Fire\n"
+    "2. Illegal Logging\n"
+    "3. Wildlife Poaching\n"
+    "4. Other"
+)
+
+HELP_TEXT = (
+    "END Nilocate - Tree Conservation\n"
+    "SMS: REPORT [ID] [TYPE] [DETAILS]\n"
+    "Web: nilocate.co.ke\n"
+    "Email: info@nilocate.co.ke"
+)
+
+INCIDENT_TYPES = {
+    '1': 'fire',
+    '2': 'illegal_logging',
+    '3': 'poaching',
+    '4': 'other'
+}
+
+
+class UssdSession:
+    """Cached state of one USSD dialogue"""
+    
+    def __init__(self, session_id, phone_number, data=None):
+        self.session_id = session_id
+        self.phone_number = phone_number
+        data = data or {}
+        self.state = data.get('state', 'main')
+        self.text = data.get('text', '')
+        self.values = data.get('values', {})
+        self.context = data.get('context')
+    
+    @staticmethod
+    def cache_key(session_id):
+        return f'ussd:session:{session_id}'
+    
+    @classmethod
+    def load(cls, session_id, phone_number):
+        data = cache.get(cls.cache_key(session_id)) if session_id else None
+        if data and data.get('phone_number') != phone_number:
+            data = None
+        return cls(session_id, phone_number, data)
+    
+    def save(self):
+        if not self.session_id:
+            return
+        cache.set(self.cache_key(self.session_id), {
+            'phone_number': self.phone_number,
+            'state': self.state,
+            'text': self.text,
+            'values': self.values,
+            'context': self.context,
+        }, settings.USSD_SESSION_TTL)
+    
+    def end(self):
+        if self.session_id:
+            cache.delete(self.cache_key(self.session_id))
+    
+    def load_context(self):
+        """Prefetch everything later hops may need about the caller"""
+        user_id = resolve_user_id(self.phone_number)
+        adoptions = []
+        if user_id:
+            adoptions = list(
+                TreeAdoption.objects.filter(user_id=user_id, is_active=True)
+                .values_list('tree__tree_id', 'tree__health_status')[:3]
+            )
+        self.context = {
+            'user_id': user_id,
+            'adoptions': adoptions,
+        }
+    
+    def respond(self, text):
+        """
+        Answer one hop of the dialogue
+        
+        Args:
+            text: Cumulative input sent by Africa's Talking (e.g. "1*2*TREE-01")
+            
+        Returns:
+            str: USSD response starting with CON or END
+        """
+        if text == '' or self.context is None:
+            # New dialogue (or the cached state expired): start from the top
+            self._reset()
+            if self.context is None:
+                self.load_context()
+            inputs = text.split('*') if text else []
+        else:
+            prefix = f"{self.text}*" if self.text else ''
+            if text.startswith(prefix):
+                inputs = text[len(prefix):].split('*')
+            else:
+                # Out of step with the cached position: replay from the main menu
+                self._reset()
+                inputs = text.split('*')
+        
+        response = MAIN_MENU
+        for position, value in enumerate(inputs):
+            if self.state == 'report_desc':
+                # Descriptions may themselves contain '*'
+                value = '*'.join(inputs[position:])
+                response = self._advance(value)
+                break
+            response = self._advance(value)
+            if response.startswith('END'):
+                break
+        
+        self.text = text
+        return response
+    
+    def _reset(self):
+        self.state = 'main'
+        self.values = {}
+        self.text = ''
+    
+    def _advance(self, value):
+        state = self.state
+        
+        if state == 'main':
+            if value == '1':
+                self.state = 'report_type'
+                return INCIDENT_MENU
+            if value == '2':
+                self.state = 'status_tree'
+                return "CON Enter Tree ID:\n(e.g., NAIROBI-OAK-001)"
+            if value == '3':
+                return self._adoptions_response()
+            if value == '4':
+                return HELP_TEXT
+            return "END Invalid option"
+        
+        if state == 'report_type':
+            self.values['incident_type'] = INCIDENT_TYPES.get(value, 'other')
+            self.state = 'report_tree'
+            return "CON Enter Tree ID near incident:"
+        
+        if state == 'report_tree':
+            self.values['tree_id'] = value.upper()
+            self.state = 'report_desc'
+            return "CON Describe the incident:"
+        
+        if state == 'report_desc':
+            incident_type = self.values['incident_type']
+            tree_id = self.values['tree_id']
+            # Once per session, even if the final hop is delivered twice
+            if not self.session_id or claim('ussd', self.session_id):
+                process_sms_report.delay(self.phone_number, f"REPORT {tree_id} {incident_type} {value}")
+            return f"END Report submitted.\nRef: {tree_id}-{incident_type}\nThank you!"
+        
+        if state == 'status_tree':
+            return self._status_response(value.upper())
+        
+        return "END Error processing request"
+    
+    def _adoptions_response(self):
+        if not self.context['user_id']:
+            return "END Register at nilocate.co.ke first"
+        
+        adoptions = self.context['adoptions']
+        if not adoptions:
+            return "END You have no active adoptions.\nVisit nilocate.co.ke to adopt"
+        
+        response = "END Your Adopted Trees:\n"
+        for tree_id, health_status in adoptions:
+            response += f"{tree_id} - {health_status}\n"
+        return response
+    
+    def _status_response(self, tree_id):
+        card = get_status_card(tree_id)
+        if card is None:
+            return "END Tree not found"
+        
+        response = f"END Tree: {card['tree_id']}\n"
+        response += f"Species: {card['species_name']}\n"
+        response += f"Health: {card['health_status']}\n"
+        response += f"Location: {card['location_name']}"
+        return response
@@ -1,19 +1,38 @@
 from rest_framework import viewsets, status, permissions, filters
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from django_filters.rest_framework import DjangoFilterBackend
 from django.utils import timezone
-from .models import TreeReport, AIAnalysis, Alert, IncidentReport
+from django.utils.dateparse import parse_date
+from .models import TreeReport, AIAnalysis, AnalysisJob, Alert, IncidentReport, DailyStats, RevenueRollup
 from trees.models import Tree, Badge
 from .serializers import (
     TreeReportListSerializer, TreeReportDetailSerializer, TreeReportCreateSerializer,
     AIAnalysisSerializer, AlertSerializer, IncidentReportSerializer, 
-    IncidentReportCreateSerializer
+    IncidentReportCreateSerializer, DailyStatsSerializer, RevenueRollupSerializer,
+    AnalysisJobSerializer
 )
-from .services import GeminiAIService
+from .analysis import submit_analysis
 from .blockchain_service import BlockchainService
 
 
+def _date_param(params, name):
+    """Optional YYYY-MM-DD query parameter; a malformed date is a 400"""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        # Well formed but not a real date, e.g. 2026-13-45
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: 'Enter a valid date as YYYY-MM-DD'})
+    return parsed
+
+
 class TreeReportViewSet(viewsets.ModelViewSet):
     """ViewSet for TreeReport operations"""
     
@@ -30,6 +49,19 @@ class TreeReportViewSet(viewsets.ModelViewSet):
             return TreeReportCreateSerializer
         return TreeReportDetailSerializer
     
+    def get_queryset(self):
+        if self.action in ['list', 'my_reports']:
+            return self._list_queryset()
+        # AIAnalysis rows carry no raw payload, so joining them is cheap
+        return self.queryset.select_related('ai_analysis')
+    
+    def _list_queryset(self):
+        """Only the columns the list serializer reads, with the analysis joined for has_ai_analysis"""
+        return TreeReport.objects.select_related('tree', 'reporter', 'ai_analysis').only(
+            'id', 'report_type', 'title', 'status', 'created_at',
+            'tree__id', 'tree__tree_id', 'reporter__id', 'reporter__username', 'ai_analysis__id'
+        )
+    
     def perform_create(self, serializer):
         report = serializer.save(reporter=self.request.user)
         
@@ -80,44 +112,8 @@ class TreeReportViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_200_OK
             )
         
-        try:
-            # Run AI analysis
-            ai_service = GeminiAIService()
-            analysis_result = ai_service.analyze_tree_image(report.image.path)
-            
-            # Create AIAnalysis record
-            ai_analysis = AIAnalysis.objects.create(
-                report=report,
-                health_assessment=analysis_result['health_assessment'],
-                confidence_score=analysis_result['confidence_score'],
-                detected_issues=analysis_result['detected_issues'],
-                recommendations=analysis_result['recommendations'],
-                raw_analysis=analysis_result
-            )
-            
-            # Update tree health if confidence is high
-            if analysis_result['confidence_score'] > 70:
-                report.tree.health_status = analysis_result['health_assessment']
-                report.tree.save()
-                
-                # Create alert if health is critical
-                if analysis_result['health_assessment'] in ['diseased', 'critical']:
-                    Alert.objects.create(
-                        tree=report.tree,
-                        report=report,
-                        severity='high' if analysis_result['health_assessment'] == 'critical' else 'medium',
-                        title=f"Tree Health Alert: {analysis_result['health_assessment'].title()}",
-                        message=f"AI detected {analysis_result['health_assessment']} condition. {analysis_result['recommendations']}"
-                    )
-            
-            serializer = AIAnalysisSerializer(ai_analysis)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-            
-        except Exception as e:
-            return Response(
-                {'error': f'AI analysis failed: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        job, created = submit_analysis(report, 'analyze', request.user)
+        return self._job_response(request, job, created)
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def analyze_ai(self, request, pk=None):
@@ -130,51 +126,17 @@ class TreeReportViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        try:
-            # Run AI analysis
-            ai_service = GeminiAIService()
-            analysis_result = ai_service.analyze_tree_image(report.image.path)
-            
-            # Create or update AIAnalysis record
-            ai_analysis, created = AIAnalysis.objects.update_or_create(
-                report=report,
-                defaults={
-                    'health_assessment': analysis_result['health_assessment'],
-                    'confidence_score': analysis_result['confidence_score'],
-                    'detected_issues': analysis_result['detected_issues'],
-                    'recommendations': analysis_result['recommendations'],
-                    'raw_analysis': analysis_result
-                }
-            )
-            
-            # Format response for frontend
-            response_data = {
-                'disease': analysis_result.get('detected_issues', 'No disease detected'),
-                'confidence': analysis_result['confidence_score'] / 100.0,
-                'recommendations': analysis_result['recommendations'],
-                'severity': 'high' if analysis_result['health_assessment'] in ['diseased', 'critical'] else 
-                           'medium' if analysis_result['health_assessment'] == 'declining' else 'low',
-                'health_status': analysis_result['health_assessment'],
-                'analysis_id': ai_analysis.id
-            }
-            
-            # Create alert if health is critical
-            if analysis_result['health_assessment'] in ['diseased', 'critical']:
-                Alert.objects.create(
-                    tree=report.tree,
-                    report=report,
-                    severity='critical' if analysis_result['health_assessment'] == 'critical' else 'high',
-                    title=f"AI Detected Tree Health Issue",
-                    message=f"AI analysis detected {analysis_result['health_assessment']} condition in {report.tree.tree_id}. {analysis_result['recommendations']}"
-                )
-            
-            return Response(response_data, status=status.HTTP_200_OK)
-            
-        except Exception as e:
-            return Response(
-                {'error': f'AI analysis failed: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        job, created = submit_analysis(report, 'analyze_ai', request.user)
+        return self._job_response(request, job, created)
+    
+    def _job_response(self, request, job, created):
+        """Analysis runs on the ai queue; clients poll the job for the result"""
+        return Response({
+            'job_id': job.id,
+            'status': job.status,
+            'created': created,
+            'status_url': reverse('analysis-job-detail', args=[job.id], request=request)
+        }, status=status.HTTP_202_ACCEPTED)
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def verify(self, request, pk=None):
@@ -196,14 +158,52 @@ class TreeReportViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(report)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def raw_analysis(self, request, pk=None):
+        """Full stored AI result, loaded from its compressed payload (rangers only)"""
+        if request.user.user_type not in ['ranger', 'admin']:
+            return Response(
+                {'error': 'Only rangers can view raw AI analysis'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        report = self.get_object()
+        if not hasattr(report, 'ai_analysis'):
+            return Response(
+                {'error': 'No AI analysis for this report'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        return Response({
+            'analysis_id': report.ai_analysis.id,
+            'source': report.ai_analysis.source,
+            'raw_analysis': report.ai_analysis.raw_analysis
+        })
+    
     @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def my_reports(self, request):
         """Get current user's reports"""
-        reports = self.queryset.filter(reporter=request.user)
+        reports = self.get_queryset().filter(reporter=request.user)
         serializer = TreeReportListSerializer(reports, many=True)
         return Response(serializer.data)
 
 
+class AnalysisJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Status and result of background AI analysis jobs"""
+    
+    queryset = AnalysisJob.objects.all()
+    serializer_class = AnalysisJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        """Users can only see jobs they submitted or that analyze their reports"""
+        from django.db.models import Q
+        
+        if self.request.user.user_type in ['ranger', 'admin']:
+            return self.queryset
+        return self.queryset.filter(Q(requested_by=self.request.user) | Q(report__reporter=self.request.user))
+
+
 class AlertViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for Alert operations"""
     
@@ -233,6 +233,28 @@ class AlertViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
+class DailyStatsViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Precomputed daily statistics
+    Filter a range of days with ?start=YYYY-MM-DD&end=YYYY-MM-DD
+    """
+    
+    queryset = DailyStats.objects.all()
+    serializer_class = DailyStatsSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    lookup_field = 'date'
+    
+    def get_queryset(self):
+        queryset = self.queryset
+        start = _date_param(self.request.query_params, 'start')
+        end = _date_param(self.request.query_params, 'end')
+        if start:
+            queryset = queryset.filter(date__gte=start)
+        if end:
+            queryset = queryset.filter(date__lte=end)
+        return queryset
+
+
 class IncidentReportViewSet(viewsets.ModelViewSet):
     """ViewSet for IncidentReport operations"""
     
@@ -436,12 +458,81 @@ class IncidentReportViewSet(viewsets.ModelViewSet):
         })
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def operational_metrics(request):
+    """Operational counters (skipped task runs, cache hit rates, provider latency)"""
+    from . import metrics
+    
+    if request.user.user_type != 'admin':
+        return Response(
+            {'error': 'Only admins can view operational metrics'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    counters = metrics.snapshot(request.query_params.get('prefix', ''))
+    counters.update(metrics.hit_rates(counters))
+    return Response(counters)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def revenue_report(request):
+    """
+    Revenue for a date range, served from the precomputed rollups
+    Query params: start/end (YYYY-MM-DD, default the last 30 days),
+    dimension (day, species or forest) and source (adoption or campaign)
+    """
+    from datetime import timedelta
+    from django.db.models import Sum
+    
+    if request.user.user_type != 'admin':
+        return Response(
+            {'error': 'Only admins can view revenue reports'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    params = request.query_params
+    end = _date_param(params, 'end') or timezone.localdate()
+    start = _date_param(params, 'start') or end - timedelta(days=29)
+    dimension = params.get('dimension', 'day')
+    source = params.get('source')
+    if dimension not in dict(RevenueRollup.DIMENSION_CHOICES):
+        return Response({'error': f'Unknown dimension: {dimension}'}, status=status.HTTP_400_BAD_REQUEST)
+    if source and source not in dict(RevenueRollup.SOURCE_CHOICES):
+        return Response({'error': f'Unknown source: {source}'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    rollups = RevenueRollup.objects.filter(date__gte=start, date__lte=end)
+    if source:
+        rollups = rollups.filter(source=source)
+    rows = rollups.filter(dimension=dimension)
+    
+    by_key = rows.values('key').annotate(amount=Sum('amount'), transactions=Sum('transactions')).order_by('-amount')
+    total = rollups.filter(dimension='day').aggregate(amount=Sum('amount'), transactions=Sum('transactions'))
+    
+    return Response({
+        'start': start,
+        'end': end,
+        'dimension': dimension,
+        'source': source,
+        'total': {
+            'amount': f"{total['amount'] or 0:.2f}",
+            'transactions': total['transactions'] or 0,
+        },
+        'totals': [
+            {'key': row['key'], 'amount': f"{row['amount']:.2f}", 'transactions': row['transactions']}
+            for row in by_key
+        ],
+        'rows': RevenueRollupSerializer(rows, many=True).data,
+    })
+
+
 # M-Pesa Payment Callback
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from django.views.decorators.csrf import csrf_exempt
-from trees.models import Payment, AdoptionRequest, TreeAdoption
-from .tasks import send_adoption_sms
+from trees.adoption import settle_payment
+from trees.models import Payment
 import json
 
 
@@ -465,80 +556,25 @@ def mpesa_callback(request):
         if not checkout_request_id:
             return Response({'message': 'Invalid callback data'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Find the payment record
+        # Extract transaction details
+        mpesa_receipt = None
+        for item in callback_data.get('CallbackMetadata', {}).get('Item', []):
+            if item.get('Name') == 'MpesaReceiptNumber':
+                mpesa_receipt = item.get('Value')
+        
+        # Update the payment and auto-approve the adoption request on success
         try:
-            payment = Payment.objects.get(mpesa_checkout_request_id=checkout_request_id)
+            payment = settle_payment(
+                checkout_request_id,
+                succeeded=result_code == 0,
+                receipt_number=mpesa_receipt,
+                result_description='Payment successful' if result_code == 0 else callback_data.get('ResultDesc', 'Payment failed')
+            )
         except Payment.DoesNotExist:
             return Response({'message': 'Payment not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        # Check if payment was successful
-        if result_code == 0:
-            # Payment successful
-            callback_metadata = callback_data.get('CallbackMetadata', {}).get('Item', [])
-            
-            # Extract transaction details
-            mpesa_receipt = None
-            for item in callback_metadata:
-                if item.get('Name') == 'MpesaReceiptNumber':
-                    mpesa_receipt = item.get('Value')
-            
-            # Update payment status
-            payment.status = 'completed'
-            payment.mpesa_receipt_number = mpesa_receipt
-            payment.completed_at = timezone.now()
-            payment.save()
-            
-            # Auto-approve the adoption request
-            try:
-                adoption_request = AdoptionRequest.objects.get(payment=payment)
-                
-                # Create actual TreeAdoption
-                tree_adoption = TreeAdoption.objects.create(
-                    user=adoption_request.user,
-                    tree=adoption_request.tree,
-                    notes=adoption_request.message
-                )
-                
-                # Update tree
-                adoption_request.tree.is_adopted = True
-                adoption_request.tree.adoption_count += 1
-                adoption_request.tree.save()
-                
-                # Update user stats
-                adoption_request.user.trees_adopted_count += 1
-                adoption_request.user.save()
-                
-                # Update adoption request status
-                adoption_request.status = 'completed'
-                adoption_request.reviewed_at = timezone.now()
-                adoption_request.save()
-                
-                # Send SMS confirmation via Africa's Talking
-                send_adoption_sms.delay(
-                    adoption_request.phone_number,
-                    adoption_request.user.username,
-                    tree_adoption.tree.tree_id,
-                    tree_adoption.tree.species.name,
-                    tree_adoption.certificate_number
-                )
-                
-                print(f"✅ Adoption completed! SMS sent to {adoption_request.phone_number}")
-                
-            except AdoptionRequest.DoesNotExist:
-                print(f"No adoption request found for payment {payment.id}")
-            
-        else:
-            # Payment failed
-            payment.status = 'failed'
-            payment.save()
-            
-            # Update adoption request
-            try:
-                adoption_request = AdoptionRequest.objects.get(payment=payment)
-                adoption_request.status = 'payment_failed'
-                adoption_request.save()
-            except AdoptionRequest.DoesNotExist:
-                pass
+        if payment is None:
+            return Response({'message': 'Callback already processed'})
         
         return Response({'message': 'Callback processed successfully'})
         
@@ -4,8 +4,11 @@ Handles background tasks for satellite monitoring, SMS notifications, and data p
 """
 
 import os
+import time
 from celery import Celery
 from celery.schedules import crontab
+from django.conf import settings
+from kombu import Exchange, Queue
 
 # Set default Django settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nilocate_project.settings')
@@ -19,6 +22,45 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Auto-discover tasks from all registered Django apps
 app.autodiscover_tasks()
 
+# Queues by latency class. Each queue gets its own worker profile
+# (see run_worker.sh) so batch jobs can never delay urgent notifications.
+TASK_QUEUES = [
+    'urgent',    # SMS alerts and confirmations
+    'payments',  # M-Pesa work
+    'ai',        # Gemini image analysis
+    'batch',     # Periodic bulk jobs
+    'default',
+]
+app.conf.task_queues = [Queue(name, Exchange(name), routing_key=name) for name in TASK_QUEUES]
+app.conf.task_default_queue = 'default'
+app.conf.task_routes = {
+    'monitoring.tasks.send_sms_alert': {'queue': 'urgent'},
+    'monitoring.tasks.send_adoption_sms': {'queue': 'urgent'},
+    'monitoring.tasks.notify_fire_alerts': {'queue': 'urgent'},
+    'monitoring.tasks.process_sms_report': {'queue': 'urgent'},
+    'monitoring.tasks.process_inbound_messages': {'queue': 'urgent'},
+    'monitoring.tasks.send_sms_bulk': {'queue': 'urgent'},
+    'monitoring.tasks.check_critical_alerts': {'queue': 'urgent'},
+    'monitoring.tasks.refresh_mpesa_token': {'queue': 'payments'},
+    'monitoring.tasks.initiate_adoption_payment': {'queue': 'payments'},
+    'monitoring.tasks.reconcile_pending_payments': {'queue': 'payments'},
+    'monitoring.tasks.analyze_report_image': {'queue': 'ai'},
+    'monitoring.tasks.check_fire_alerts': {'queue': 'batch'},
+    'monitoring.tasks.update_tree_ndvi': {'queue': 'batch'},
+    'monitoring.tasks.cleanup_old_alerts': {'queue': 'batch'},
+    'monitoring.tasks.archive_old_records': {'queue': 'batch'},
+    'monitoring.tasks.monitor_tree_health_changes': {'queue': 'batch'},
+    'monitoring.tasks.aggregate_daily_stats': {'queue': 'batch'},
+    'monitoring.tasks.rebuild_revenue_rollups': {'queue': 'batch'},
+    'monitoring.tasks.bulk_analyze_reports': {'queue': 'batch'},
+}
+
+# Workers only reserve what they are about to run; long batch tasks must not
+# sit on prefetched urgent messages. Profiles override this per queue.
+# Messages are acked on receipt; only tasks that are safe to run twice set
+# acks_late, so SMS sends and STK pushes are never redelivered after a crash.
+app.conf.worker_prefetch_multiplier = 1
+
 # Configure periodic tasks schedule
 app.conf.beat_schedule = {
     'check-fire-alerts-every-6-hours': {
@@ -42,6 +84,13 @@ app.conf.beat_schedule = {
             'expires': 3600,
         }
     },
+    'archive-old-records-weekly': {
+        'task': 'monitoring.tasks.archive_old_records',
+        'schedule': crontab(minute=30, hour=3, day_of_week=0),  # Sunday at 3:30 AM
+        'options': {
+            'expires': 3600,
+        }
+    },
     'check-critical-alerts': {
         'task': 'monitoring.tasks.check_critical_alerts',
         'schedule': crontab(minute='*/5'),  # Every 5 minutes
@@ -56,6 +105,28 @@ app.conf.beat_schedule = {
             'expires': 3600,  # Task expires after 1 hour
         }
     },
+    'refresh-mpesa-token': {
+        'task': 'monitoring.tasks.refresh_mpesa_token',
+        # Keeps the shared Daraja token warm: at least two runs per refresh-ahead window
+        'schedule': settings.MPESA_TOKEN_REFRESH_AHEAD / 2,
+        'options': {
+            'expires': settings.MPESA_TOKEN_REFRESH_AHEAD / 2,
+        }
+    },
+    'reconcile-pending-payments': {
+        'task': 'monitoring.tasks.reconcile_pending_payments',
+        'schedule': crontab(minute='*/15'),  # Every 15 minutes
+        'options': {
+            'expires': 900,
+        }
+    },
+    'process-inbound-messages': {
+        'task': 'monitoring.tasks.process_inbound_messages',
+        'schedule': crontab(),  # Every minute, in case a scheduled drain was lost
+        'options': {
+            'expires': 60,
+        }
+    },
     'aggregate-daily-stats': {
         'task': 'monitoring.tasks.aggregate_daily_stats',
         'schedule': crontab(minute=0, hour=0),  # Daily at midnight
@@ -63,6 +134,20 @@ app.conf.beat_schedule = {
             'expires': 7200,  # Task expires after 2 hours
         }
     },
+    'rebuild-revenue-rollups': {
+        'task': 'monitoring.tasks.rebuild_revenue_rollups',
+        'schedule': crontab(minute=15, hour=0),  # Daily at 12:15 AM
+        'options': {
+            'expires': 7200,
+        }
+    },
+    'bulk-analyze-reports': {
+        'task': 'monitoring.tasks.bulk_analyze_reports',
+        'schedule': crontab(minute='*/30'),  # Every 30 minutes, paced by the Gemini quota
+        'options': {
+            'expires': 1800,
+        }
+    },
 }
 
 # Configure timezone
@@ -72,3 +157,16 @@ app.conf.timezone = 'Africa/Nairobi'
 def debug_task(self):
     """Debug task for testing Celery setup."""
     print(f'Request: {self.request!r}')
+
+
+@app.task
+def latency_probe(sent_at):
+    """Return seconds between enqueue and execution (queue latency check)."""
+    return time.time() - sent_at
+
+
+@app.task
+def batch_load_probe(seconds):
+    """Occupy a worker slot for a while to simulate a long batch job."""
+    time.sleep(seconds)
+    return seconds
@@ -126,6 +126,25 @@ else:
     }
 
 
+# Cache
+# Redis is shared by web and worker processes (task locks, metrics, tokens);
+# the local-memory fallback is only suitable for single-process development.
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -167,6 +186,10 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Compressed NDJSON archives written by the retention jobs
+ARCHIVE_ROOT = Path(os.getenv('ARCHIVE_ROOT', BASE_DIR / 'archives'))
+RETENTION_CHUNK_SIZE = int(os.getenv('RETENTION_CHUNK_SIZE', '500'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -229,6 +252,42 @@ if not DEBUG:
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY', '')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
 
+# Uploaded images are re-encoded to at most this many pixels on the longest side
+IMAGE_MAX_DIMENSION = int(os.getenv('IMAGE_MAX_DIMENSION', '2048'))
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '82'))  # JPEG quality
+# Longest side of the responsive copies served to list and map views
+IMAGE_VARIANTS = {
+    'thumb': 320,
+    'medium': 800,
+}
+
+# AI image analysis
+AI_IMAGE_MAX_DIMENSION = int(os.getenv('AI_IMAGE_MAX_DIMENSION', '1024'))  # Size of the copy sent to Gemini
+AI_IMAGE_QUALITY = int(os.getenv('AI_IMAGE_QUALITY', '85'))
+AI_ANALYSIS_JOB_TIMEOUT = int(os.getenv('AI_ANALYSIS_JOB_TIMEOUT', '600'))  # Seconds before a running job counts as lost
+# Local triage settles unusable and clearly healthy photos without Gemini.
+# Tune with `manage.py evaluate_triage`; confidence_score stays at 70 so a
+# triage verdict never overrides a tree's health status on its own.
+AI_TRIAGE_ENABLED = os.getenv('AI_TRIAGE_ENABLED', 'True') == 'True'
+AI_TRIAGE_THRESHOLDS = {
+    'min_brightness': 35,             # Mean luma (0-255)
+    'max_brightness': 225,
+    'max_clipped_ratio': 0.4,         # Share of pixels crushed to black or blown to white
+    'min_sharpness': 40,              # Variance of the Laplacian on a 256px copy
+    'min_vegetation_ratio': 0.1,      # Share of foliage-coloured pixels
+    'healthy_min_green_ratio': 0.5,
+    'healthy_max_stress_ratio': 0.05,  # Yellow/brown share of the foliage
+    'confidence_score': 70,
+}
+GEMINI_REQUESTS_PER_MINUTE = int(os.getenv('GEMINI_REQUESTS_PER_MINUTE', '15'))  # Shared by all workers
+GEMINI_QUOTA_WAIT = int(os.getenv('GEMINI_QUOTA_WAIT', '120'))  # Seconds to wait for quota before giving up
+AI_BULK_ANALYSIS_LIMIT = int(os.getenv('AI_BULK_ANALYSIS_LIMIT', '300'))  # Reports per backlog run
+AI_BULK_ANALYSIS_CONCURRENCY = int(os.getenv('AI_BULK_ANALYSIS_CONCURRENCY', '4'))  # Gemini calls in flight
+AI_BULK_ANALYSIS_RESERVE = int(os.getenv('AI_BULK_ANALYSIS_RESERVE', '3'))  # Requests per minute kept for interactive analysis
+# Differing perceptual-hash bits still treated as the same photo (0 = exact copies only);
+# up to 3 every near duplicate is found, larger values may miss some
+AI_ANALYSIS_CACHE_MAX_DISTANCE = int(os.getenv('AI_ANALYSIS_CACHE_MAX_DISTANCE', '3'))
+
 # Celery Configuration
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
@@ -244,11 +303,23 @@ OPENWEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY', '')
 AFRICAS_TALKING_USERNAME = os.getenv('AFRICAS_TALKING_USERNAME', 'sandbox')
 AFRICAS_TALKING_API_KEY = os.getenv('AFRICAS_TALKING_API_KEY', '')
 AFRICAS_TALKING_SENDER_ID = os.getenv('AFRICAS_TALKING_SENDER_ID', 'NILOCATE')
+USSD_SESSION_TTL = int(os.getenv('USSD_SESSION_TTL', '180'))  # Seconds; telco sessions last ~3 minutes
+TREE_CARD_CACHE_SIZE = int(os.getenv('TREE_CARD_CACHE_SIZE', '1024'))  # Per-process status card LRU
+TREE_CARD_CACHE_TTL = int(os.getenv('TREE_CARD_CACHE_TTL', '60'))  # Seconds
+INBOUND_BATCH_SIZE = int(os.getenv('INBOUND_BATCH_SIZE', '200'))  # Inbound SMS handled per transaction
+INBOUND_DRAIN_DELAY = int(os.getenv('INBOUND_DRAIN_DELAY', '1'))  # Seconds to collect a burst before draining
+WEBHOOK_DEDUPE_TTL = int(os.getenv('WEBHOOK_DEDUPE_TTL', '86400'))  # Seconds a delivery key stays in the cache
+WEBHOOK_RECEIPT_DAYS = int(os.getenv('WEBHOOK_RECEIPT_DAYS', '30'))  # Days delivery keys are kept in the database
 
 # M-Pesa Configuration
 MPESA_CONSUMER_KEY = os.getenv('MPESA_CONSUMER_KEY', '')
 MPESA_CONSUMER_SECRET = os.getenv('MPESA_CONSUMER_SECRET', '')
 MPESA_SHORTCODE = os.getenv('MPESA_SHORTCODE', '')
+MPESA_RECONCILE_AFTER_MINUTES = int(os.getenv('MPESA_RECONCILE_AFTER_MINUTES', '10'))  # Pending this long without a callback
+MPESA_PAYMENT_EXPIRY_HOURS = int(os.getenv('MPESA_PAYMENT_EXPIRY_HOURS', '24'))  # Unresolved payments are failed after this
+MPESA_RECONCILE_BATCH_SIZE = int(os.getenv('MPESA_RECONCILE_BATCH_SIZE', '500'))  # Payments per reconciliation run
+MPESA_RECONCILE_CONCURRENCY = int(os.getenv('MPESA_RECONCILE_CONCURRENCY', '8'))  # Daraja queries in flight
+MPESA_TOKEN_REFRESH_AHEAD = int(os.getenv('MPESA_TOKEN_REFRESH_AHEAD', '300'))  # Seconds before token expiry to refresh
 
 # Blockchain Configuration (Anonymous Reporting)
 BLOCKCHAIN_RPC_URL = os.getenv('BLOCKCHAIN_RPC_URL', 'http://127.0.0.1:8545')
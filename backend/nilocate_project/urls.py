@@ -13,7 +13,7 @@ from rest_framework import permissions
 
 from users.views import UserViewSet
 from trees.views import TreeSpeciesViewSet, TreeViewSet, TreeAdoptionViewSet, AdoptionRequestViewSet, PaymentViewSet
-from monitoring.views import TreeReportViewSet, AlertViewSet, IncidentReportViewSet, mpesa_callback
+from monitoring.views import TreeReportViewSet, AnalysisJobViewSet, AlertViewSet, IncidentReportViewSet, DailyStatsViewSet, mpesa_callback, operational_metrics, revenue_report
 from monitoring.sms_handlers import sms_webhook, ussd_webhook
 
 # API Router
@@ -25,8 +25,10 @@ router.register(r'adoptions', TreeAdoptionViewSet)
 router.register(r'adoption-requests', AdoptionRequestViewSet)
 router.register(r'payments', PaymentViewSet)
 router.register(r'reports', TreeReportViewSet)
+router.register(r'analysis-jobs', AnalysisJobViewSet, basename='analysis-job')
 router.register(r'incidents', IncidentReportViewSet)
 router.register(r'alerts', AlertViewSet)
+router.register(r'daily-stats', DailyStatsViewSet)
 
 # Swagger/OpenAPI documentation
 schema_view = get_schema_view(
@@ -59,6 +61,12 @@ urlpatterns = [
     # M-Pesa callback (public endpoint for Safaricom)
     path('api/mpesa/callback/', mpesa_callback, name='mpesa_callback'),
     
+    # Operational metrics (admins)
+    path('api/metrics/', operational_metrics, name='operational_metrics'),
+    
+    # Revenue from precomputed rollups (admins)
+    path('api/revenue/', revenue_report, name='revenue_report'),
+    
     # API documentation
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
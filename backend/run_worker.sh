@@ -0,0 +1,59 @@
+#!/usr/bin/env bash
+# Start a Celery worker for one queue profile.
+#
+# Usage: ./run_worker.sh <urgent|payments|ai|batch|default|all>
+#
+# Concurrency can be overridden per profile, e.g. URGENT_CONCURRENCY=8.
+set -o errexit
+
+PROFILE=${1:-default}
+
+case "$PROFILE" in
+    urgent)
+        # Short SMS tasks: many slots, never prefetch past the next message
+        QUEUES=urgent
+        CONCURRENCY=${URGENT_CONCURRENCY:-8}
+        PREFETCH=1
+        ;;
+    payments)
+        # Daraja round trips: I/O bound, keep latency low
+        QUEUES=payments
+        CONCURRENCY=${PAYMENTS_CONCURRENCY:-4}
+        PREFETCH=1
+        ;;
+    ai)
+        # Multi-second Gemini calls, bounded by provider quota
+        QUEUES=ai
+        CONCURRENCY=${AI_CONCURRENCY:-2}
+        PREFETCH=1
+        ;;
+    batch)
+        # Long periodic jobs: few slots so they cannot starve the database
+        QUEUES=batch
+        CONCURRENCY=${BATCH_CONCURRENCY:-2}
+        PREFETCH=1
+        ;;
+    default)
+        QUEUES=default
+        CONCURRENCY=${DEFAULT_CONCURRENCY:-2}
+        PREFETCH=4
+        ;;
+    all)
+        # Single-process development setup consuming every queue
+        QUEUES=urgent,payments,ai,batch,default
+        CONCURRENCY=${ALL_CONCURRENCY:-4}
+        PREFETCH=1
+        ;;
+    *)
+        echo "Unknown worker profile: $PROFILE" >&2
+        echo "Usage: $0 <urgent|payments|ai|batch|default|all>" >&2
+        exit 1
+        ;;
+esac
+
+exec celery -A nilocate_project worker \
+    --loglevel="${CELERY_LOG_LEVEL:-info}" \
+    --queues="$QUEUES" \
+    --concurrency="$CONCURRENCY" \
+    --prefetch-multiplier="$PREFETCH" \
+    --hostname="$PROFILE@%h"
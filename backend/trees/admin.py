@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import TreeSpecies, Tree, TreeAdoption, Badge, Payment, AdoptionRequest
+from .models import TreeSpecies, Tree, TreeHealthEvent, TreeAdoption, Badge, Payment, AdoptionRequest
 
 
 @admin.register(TreeSpecies)
@@ -18,6 +18,14 @@ class TreeAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at', 'updated_at']
 
 
+@admin.register(TreeHealthEvent)
+class TreeHealthEventAdmin(admin.ModelAdmin):
+    list_display = ['tree', 'from_status', 'to_status', 'source', 'created_at']
+    list_filter = ['to_status', 'source', 'created_at']
+    search_fields = ['tree__tree_id']
+    readonly_fields = ['created_at']
+
+
 @admin.register(TreeAdoption)
 class TreeAdoptionAdmin(admin.ModelAdmin):
     list_display = ['user', 'tree', 'certificate_number', 'adoption_date', 'is_active']
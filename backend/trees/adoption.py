@@ -0,0 +1,167 @@
+"""
+Adoption completion
+The one place a TreeAdoption is created and the tree/user counters move.
+Used by direct adoption, ranger approval, both M-Pesa callbacks and payment
+reconciliation; every entry point is safe to repeat for the same request
+or payment, so concurrent callback retries settle exactly once.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import AdoptionRequest, Badge, Payment, TreeAdoption
+
+ADOPTION_BADGES = {
+    1: ('first_adoption', 'Adopted your first tree!'),
+    5: ('five_adoptions', 'Adopted 5 trees!'),
+    10: ('ten_adoptions', 'Adopted 10 trees!'),
+}
+
+
+def adopt(user, tree, notes=''):
+    """
+    Record `user` as an adopter of `tree`
+    
+    Returns:
+        tuple: (TreeAdoption, created) - created is False when the user
+        already holds an active adoption of the tree
+    """
+    with transaction.atomic():
+        # (user, tree) is unique, so concurrent calls converge on one row
+        adoption, created = TreeAdoption.objects.get_or_create(
+            user=user, tree=tree, defaults={'notes': notes}
+        )
+        if not created:
+            adoption = TreeAdoption.objects.select_for_update().get(pk=adoption.pk)
+            if adoption.is_active:
+                return adoption, False
+            adoption.is_active = True
+            adoption.save(update_fields=['is_active'])
+        
+        tree.is_adopted = True
+        tree.adoption_count = F('adoption_count') + 1
+        tree.save(update_fields=['is_adopted', 'adoption_count', 'updated_at'])
+        tree.refresh_from_db(fields=['adoption_count'])
+        
+        user.trees_adopted_count = F('trees_adopted_count') + 1
+        user.save(update_fields=['trees_adopted_count'])
+        user.refresh_from_db(fields=['trees_adopted_count'])
+        
+        _award_badges(user)
+    return adoption, True
+
+
+def complete_adoption_request(adoption_request_id, reviewed_by=None, ranger_notes=None):
+    """
+    Turn an adoption request into a TreeAdoption and queue the SMS certificate
+    
+    Returns:
+        tuple: (TreeAdoption, created) - created is False when the request
+        had already been completed
+    """
+    from monitoring.tasks import send_adoption_sms
+    
+    with transaction.atomic():
+        adoption_request = (
+            AdoptionRequest.objects.select_for_update(of=('self',))
+            .select_related('user', 'tree__species')
+            .get(pk=adoption_request_id)
+        )
+        if adoption_request.status == 'completed':
+            adoption = TreeAdoption.objects.get(user=adoption_request.user, tree=adoption_request.tree)
+            return adoption, False
+        
+        adoption, created = adopt(adoption_request.user, adoption_request.tree, adoption_request.message)
+        
+        adoption_request.status = 'completed'
+        adoption_request.reviewed_at = timezone.now()
+        fields = ['status', 'reviewed_at', 'updated_at']
+        if reviewed_by is not None:
+            adoption_request.reviewed_by = reviewed_by
+            fields.append('reviewed_by')
+        if ranger_notes is not None:
+            adoption_request.ranger_notes = ranger_notes
+            fields.append('ranger_notes')
+        adoption_request.save(update_fields=fields)
+        
+        if created:
+            tree = adoption_request.tree
+            sms_args = (
+                adoption_request.phone_number,
+                adoption_request.user.username,
+                tree.tree_id,
+                tree.species.name,
+                adoption.certificate_number,
+            )
+            transaction.on_commit(lambda: send_adoption_sms.delay(*sms_args))
+    return adoption, created
+
+
+def settle_payment(checkout_request_id, succeeded, receipt_number=None, result_description='', complete=True):
+    """
+    Apply an M-Pesa result to the payment with `checkout_request_id`
+    
+    Args:
+        succeeded: Whether Daraja reported ResultCode 0
+        complete: Complete the paid adoption straight away; otherwise the
+            request goes back to 'pending' for a ranger to approve
+    
+    Returns:
+        Payment or None when the result had already been applied
+    
+    Raises:
+        Payment.DoesNotExist: No pending payment with that CheckoutRequestID
+    """
+    from monitoring.idempotency import claim
+    from monitoring.revenue import record_payment
+    
+    # Payments whose STK push was never sent have no CheckoutRequestID yet
+    if not checkout_request_id:
+        raise Payment.DoesNotExist('Callback has no CheckoutRequestID')
+    
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().get(mpesa_checkout_request_id=checkout_request_id)
+        # Safaricom retries callbacks it did not see acknowledged
+        if not claim('mpesa', checkout_request_id) or payment.status != 'pending':
+            return None
+        
+        if succeeded:
+            payment.status = 'completed'
+            payment.mpesa_receipt_number = receipt_number
+            payment.transaction_date = timezone.now()
+        else:
+            payment.status = 'failed'
+        payment.result_description = result_description
+        payment.save(update_fields=[
+            'status', 'mpesa_receipt_number', 'transaction_date', 'result_description', 'updated_at'
+        ])
+        if succeeded:
+            record_payment(payment)
+        
+        adoption_request_id = (
+            AdoptionRequest.objects.filter(payment=payment).values_list('id', flat=True).first()
+        )
+        if adoption_request_id is None:
+            print(f"No adoption request found for payment {payment.id}")
+        elif not succeeded:
+            AdoptionRequest.objects.filter(pk=adoption_request_id).update(
+                status='payment_failed', updated_at=timezone.now()
+            )
+        elif complete:
+            complete_adoption_request(adoption_request_id)
+        else:
+            AdoptionRequest.objects.filter(pk=adoption_request_id).update(
+                status='pending', updated_at=timezone.now()
+            )
+    return payment
+
+
+def _award_badges(user):
+    badge = ADOPTION_BADGES.get(user.trees_adopted_count)
+    if badge:
+        badge_type, description = badge
+        Badge.objects.get_or_create(
+            user=user,
+            badge_type=badge_type,
+            defaults={'description': description}
+        )
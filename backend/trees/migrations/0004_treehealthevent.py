@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-19 00:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0003_payment_adoptionrequest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TreeHealthEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('healthy', 'Healthy'), ('stressed', 'Stressed'), ('diseased', 'Diseased'), ('critical', 'Critical'), ('deceased', 'Deceased')], max_length=20)),
+                ('to_status', models.CharField(choices=[('healthy', 'Healthy'), ('stressed', 'Stressed'), ('diseased', 'Diseased'), ('critical', 'Critical'), ('deceased', 'Deceased')], max_length=20)),
+                ('source', models.CharField(choices=[('manual', 'Manual Update'), ('ai_analysis', 'AI Analysis'), ('satellite', 'Satellite Monitoring')], default='manual', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('tree', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='health_events', to='trees.tree')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['to_status', 'created_at'], name='trees_treeh_to_stat_108283_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations, models
+
+
+def populate_tree_keys(apps, schema_editor):
+    Tree = apps.get_model('trees', 'Tree')
+    
+    # tree_key is unique; IDs differing only in case or spacing must be renamed first
+    owners = {}
+    collisions = []
+    for pk, tree_id in Tree.objects.order_by('id').values_list('id', 'tree_id').iterator(chunk_size=1000):
+        key = (tree_id or '').strip().upper()
+        if key in owners:
+            collisions.append(f"{tree_id!r} (id {pk}) collides with {owners[key][1]!r} (id {owners[key][0]})")
+        else:
+            owners[key] = (pk, tree_id)
+    if collisions:
+        raise RuntimeError(
+            'Tree IDs differ only in case or whitespace; rename them before migrating:\n  '
+            + '\n  '.join(collisions)
+        )
+    
+    batch = []
+    for tree in Tree.objects.only('id', 'tree_id').iterator(chunk_size=1000):
+        tree.tree_key = (tree.tree_id or '').strip().upper()
+        batch.append(tree)
+        if len(batch) >= 1000:
+            Tree.objects.bulk_update(batch, ['tree_key'])
+            batch = []
+    if batch:
+        Tree.objects.bulk_update(batch, ['tree_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0004_treehealthevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tree',
+            name='tree_key',
+            field=models.CharField(editable=False, help_text='Normalized tree_id used for case-insensitive lookups', max_length=50, null=True),
+        ),
+        migrations.RunPython(populate_tree_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tree',
+            name='tree_key',
+            field=models.CharField(editable=False, help_text='Normalized tree_id used for case-insensitive lookups', max_length=50, unique=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.14 on 2026-10-19 00:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0005_tree_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'created_at'], name='trees_payme_status_007a6e_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-19 01:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0007_payment_initiating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tree',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, help_text='Responsive copies of the image'),
+        ),
+        migrations.AddField(
+            model_name='treespecies',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, help_text='Responsive copies of the image'),
+        ),
+    ]
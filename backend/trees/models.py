@@ -20,12 +20,23 @@ class TreeSpecies(models.Model):
     conservation_importance = models.TextField(help_text="Why this species matters")
     threats = models.TextField(help_text="Main threats to this species")
     image = models.ImageField(upload_to='species/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, help_text="Responsive copies of the image")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"{self.name} ({self.scientific_name})"
     
+    def save(self, *args, **kwargs):
+        new_image = bool(self.image) and not self.image._committed
+        if new_image or not self.image:
+            self.image_variants = {}
+        super().save(*args, **kwargs)
+        
+        if new_image:
+            from monitoring.thumbnails import queue_variants
+            queue_variants(self, 'image')
+    
     class Meta:
         verbose_name_plural = "Tree Species"
         ordering = ['name']
@@ -42,8 +53,13 @@ class Tree(models.Model):
         ('deceased', 'Deceased'),
     ]
     
+    # Statuses that warrant ranger attention when a tree moves into them
+    POOR_HEALTH_STATUSES = ['diseased', 'critical', 'deceased']
+    
     species = models.ForeignKey(TreeSpecies, on_delete=models.CASCADE, related_name='trees')
     tree_id = models.CharField(max_length=50, unique=True, help_text="Unique identifier for the tree")
+    tree_key = models.CharField(max_length=50, unique=True, editable=False,
+                                help_text="Normalized tree_id used for case-insensitive lookups")
     latitude = models.DecimalField(max_digits=9, decimal_places=6)
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
     location_name = models.CharField(max_length=200, help_text="Forest or area name")
@@ -56,6 +72,7 @@ class Tree(models.Model):
     adoption_count = models.IntegerField(default=0)
     last_health_check = models.DateTimeField(null=True, blank=True)
     image = models.ImageField(upload_to='trees/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, help_text="Responsive copies of the image")
     added_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='added_trees')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -63,8 +80,83 @@ class Tree(models.Model):
     def __str__(self):
         return f"{self.tree_id} - {self.species.name}"
     
+    @staticmethod
+    def normalize_tree_id(tree_id):
+        """Canonical form of a tree ID as typed by users (SMS, USSD, API)"""
+        return (tree_id or '').strip().upper()
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored health status so save() can detect real transitions
+        instance._loaded_health_status = instance.__dict__.get('health_status')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        previous_status = getattr(self, '_loaded_health_status', None)
+        update_fields = kwargs.get('update_fields')
+        health_written = update_fields is None or 'health_status' in update_fields
+        
+        self.tree_key = self.normalize_tree_id(self.tree_id)
+        if update_fields is not None and 'tree_id' in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['tree_key']
+        
+        new_image = bool(self.image) and not self.image._committed
+        if new_image:
+            from monitoring.images import preprocess_upload
+            self.image = preprocess_upload(self.image)
+        if new_image or not self.image:
+            # Variants of the previous image no longer apply
+            self.image_variants = {}
+        if update_fields is not None and 'image' in update_fields:
+            kwargs['update_fields'] = list(kwargs['update_fields']) + ['image_variants']
+        
+        super().save(*args, **kwargs)
+        
+        if new_image:
+            from monitoring.thumbnails import queue_variants
+            queue_variants(self, 'image')
+        
+        from .status_cards import invalidate_status_card
+        invalidate_status_card(self.tree_key)
+        
+        if health_written and previous_status and previous_status != self.health_status:
+            TreeHealthEvent.objects.create(
+                tree=self,
+                from_status=previous_status,
+                to_status=self.health_status,
+                source=getattr(self, 'health_change_source', 'manual'),
+            )
+        if health_written:
+            self._loaded_health_status = self.health_status
+    
+    class Meta:
+        ordering = ['-created_at']
+
+
+class TreeHealthEvent(models.Model):
+    """Health status transition of a tree, recorded when the change is saved"""
+    
+    SOURCE_CHOICES = [
+        ('manual', 'Manual Update'),
+        ('ai_analysis', 'AI Analysis'),
+        ('satellite', 'Satellite Monitoring'),
+    ]
+    
+    tree = models.ForeignKey(Tree, on_delete=models.CASCADE, related_name='health_events')
+    from_status = models.CharField(max_length=20, choices=Tree.HEALTH_STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=Tree.HEALTH_STATUS_CHOICES)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='manual')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    def __str__(self):
+        return f"{self.tree.tree_id}: {self.from_status} -> {self.to_status}"
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['to_status', 'created_at']),
+        ]
 
 
 class TreeAdoption(models.Model):
@@ -122,6 +214,7 @@ class Payment(models.Model):
     """M-Pesa payment transactions"""
     
     STATUS_CHOICES = [
+        ('initiating', 'Initiating'),
         ('pending', 'Pending'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
@@ -132,10 +225,11 @@ class Payment(models.Model):
     tree = models.ForeignKey(Tree, on_delete=models.CASCADE, related_name='payments')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     phone_number = models.CharField(max_length=15, help_text="M-Pesa phone number")
-    mpesa_checkout_request_id = models.CharField(max_length=100, unique=True)
+    # Set once the STK push has been accepted by Daraja
+    mpesa_checkout_request_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
     mpesa_receipt_number = models.CharField(max_length=100, blank=True, null=True)
     transaction_date = models.DateTimeField(null=True, blank=True)
-    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='initiating')
     result_description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -145,6 +239,9 @@ class Payment(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
 
 
 class AdoptionRequest(models.Model):
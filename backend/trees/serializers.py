@@ -1,4 +1,6 @@
 from rest_framework import serializers
+from monitoring.serializers import ImageVariantsField
+from users.phone import mpesa_phone_number
 from .models import TreeSpecies, Tree, TreeAdoption, Badge, Payment, AdoptionRequest
 
 
@@ -6,12 +8,13 @@ class TreeSpeciesSerializer(serializers.ModelSerializer):
     """Serializer for TreeSpecies model"""
     
     tree_count = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField()
     
     class Meta:
         model = TreeSpecies
         fields = ['id', 'name', 'scientific_name', 'description', 'risk_level',
                   'native_region', 'characteristics', 'conservation_importance',
-                  'threats', 'image', 'tree_count', 'created_at']
+                  'threats', 'image', 'image_variants', 'tree_count', 'created_at']
     
     def get_tree_count(self, obj):
         return obj.trees.count()
@@ -22,12 +25,13 @@ class TreeListSerializer(serializers.ModelSerializer):
     
     species_name = serializers.CharField(source='species.name', read_only=True)
     species_risk_level = serializers.CharField(source='species.risk_level', read_only=True)
+    image_variants = ImageVariantsField()
     
     class Meta:
         model = Tree
         fields = ['id', 'tree_id', 'species_name', 'species_risk_level', 'latitude', 
                   'longitude', 'location_name', 'health_status', 'is_adopted', 
-                  'adoption_count', 'image']
+                  'adoption_count', 'image', 'image_variants']
 
 
 class TreeDetailSerializer(serializers.ModelSerializer):
@@ -41,14 +45,24 @@ class TreeDetailSerializer(serializers.ModelSerializer):
     )
     recent_reports = serializers.SerializerMethodField()
     adopters = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField()
     
     class Meta:
         model = Tree
         fields = ['id', 'tree_id', 'species', 'species_id', 'latitude', 'longitude',
                   'location_name', 'health_status', 'estimated_age', 'height', 'diameter',
-                  'notes', 'is_adopted', 'adoption_count', 'last_health_check', 'image',
+                  'notes', 'is_adopted', 'adoption_count', 'last_health_check', 'image', 'image_variants',
                   'recent_reports', 'adopters', 'created_at', 'updated_at']
     
+    def validate_tree_id(self, value):
+        # Lookups ignore case and spacing, so IDs must be unique in that form
+        existing = Tree.objects.filter(tree_key=Tree.normalize_tree_id(value))
+        if self.instance is not None:
+            existing = existing.exclude(pk=self.instance.pk)
+        if existing.exists():
+            raise serializers.ValidationError("A tree with this ID already exists")
+        return value
+    
     def get_recent_reports(self, obj):
         from monitoring.serializers import TreeReportListSerializer
         return TreeReportListSerializer(obj.reports.all()[:5], many=True).data
@@ -125,6 +139,12 @@ class AdoptionRequestSerializer(serializers.ModelSerializer):
                   'phone_number', 'status', 'payment_details', 'ranger_notes', 
                   'reviewed_at', 'created_at']
         read_only_fields = ['status', 'ranger_notes', 'reviewed_at']
+    
+    def validate_phone_number(self, value):
+        phone_number = mpesa_phone_number(value)
+        if not phone_number:
+            raise serializers.ValidationError("Enter a valid phone number")
+        return phone_number
 
 
 class AdoptionRequestDetailSerializer(serializers.ModelSerializer):
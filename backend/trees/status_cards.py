@@ -0,0 +1,121 @@
+"""
+Tree status cards for SMS/USSD replies
+Repeated STATUS queries for the same tree are served from a small
+in-process LRU. Entries expire after TREE_CARD_CACHE_TTL seconds, which
+bounds staleness across worker processes; saves in this process evict
+the entry immediately.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import Tree
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a fixed TTL"""
+    
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_cards = TTLCache(settings.TREE_CARD_CACHE_SIZE, settings.TREE_CARD_CACHE_TTL)
+
+
+CARD_FIELDS = [
+    'id', 'tree_id', 'tree_key', 'species__name', 'health_status', 'location_name',
+    'is_adopted', 'last_health_check'
+]
+
+
+def _build_card(row):
+    return {
+        'id': row['id'],
+        'tree_id': row['tree_id'],
+        'species_name': row['species__name'],
+        'health_status': row['health_status'],
+        'location_name': row['location_name'],
+        'is_adopted': row['is_adopted'],
+        'last_health_check': row['last_health_check'].strftime('%Y-%m-%d') if row['last_health_check'] else None,
+    }
+
+
+def get_status_card(tree_id):
+    """
+    Return the status card for a tree, or None if no such tree exists
+    
+    Args:
+        tree_id: Tree ID in any letter case
+    """
+    key = Tree.normalize_tree_id(tree_id)
+    card = _cards.get(key)
+    if card is not None:
+        return card
+    
+    row = Tree.objects.filter(tree_key=key).values(*CARD_FIELDS).first()
+    if row is None:
+        return None
+    
+    card = _build_card(row)
+    _cards.set(key, card)
+    return card
+
+
+def get_status_cards(tree_ids):
+    """
+    Return {normalized tree ID: card} for many trees with at most one query
+    
+    Unknown IDs are left out of the result.
+    """
+    keys = {Tree.normalize_tree_id(tree_id) for tree_id in tree_ids}
+    cards = {}
+    missing = []
+    for key in keys:
+        card = _cards.get(key)
+        if card is None:
+            missing.append(key)
+        else:
+            cards[key] = card
+    
+    if missing:
+        for row in Tree.objects.filter(tree_key__in=missing).values(*CARD_FIELDS):
+            card = _build_card(row)
+            _cards.set(row['tree_key'], card)
+            cards[row['tree_key']] = card
+    return cards
+
+
+def invalidate_status_card(tree_key):
+    _cards.delete(tree_key)
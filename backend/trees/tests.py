@@ -1,3 +1,252 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from nilocate_project.celery import app
+
+from monitoring.tasks import send_adoption_sms
+from users.models import User
+from .adoption import adopt, settle_payment
+from .models import AdoptionRequest, Badge, Payment, Tree, TreeAdoption, TreeHealthEvent, TreeSpecies
+
+
+class ConcurrentAdoptionTests(TransactionTestCase):
+    """Adoption completion under simultaneous callbacks and retries"""
+    
+    def setUp(self):
+        cache.clear()
+        self.species = TreeSpecies.objects.create(
+            name='Mukau', scientific_name='Melia volkensii', description='', risk_level='endangered',
+            native_region='', characteristics='', conservation_importance='', threats=''
+        )
+        self.tree = self.make_tree('KARURA-001')
+    
+    def make_tree(self, tree_id):
+        return Tree.objects.create(
+            species=self.species, tree_id=tree_id, latitude=-1.2, longitude=36.8, location_name='Karura'
+        )
+    
+    def make_paid_request(self, user, checkout_request_id):
+        payment = Payment.objects.create(
+            user=user, tree=self.tree, amount=500, phone_number='254712345678',
+            mpesa_checkout_request_id=checkout_request_id, status='pending'
+        )
+        return AdoptionRequest.objects.create(
+            user=user, tree=self.tree, message='Adopting', phone_number='254712345678',
+            status='payment_pending', payment=payment
+        )
+    
+    def run_concurrently(self, calls):
+        """Start every call at once in its own thread and return their results"""
+        barrier = threading.Barrier(len(calls))
+        results = [None] * len(calls)
+        errors = []
+        
+        def worker(index, call):
+            try:
+                barrier.wait()
+                for attempt in range(100):
+                    try:
+                        results[index] = call()
+                        return
+                    except OperationalError:
+                        # SQLite reports lock contention instead of waiting; retry like Safaricom would
+                        time.sleep(0.01)
+                errors.append(f'call {index} never got the lock')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=worker, args=(i, call)) for i, call in enumerate(calls)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+    
+    def test_retried_callbacks_complete_adoption_once(self):
+        user = User.objects.create(username='adopter', phone_number='0712345678')
+        adoption_request = self.make_paid_request(user, 'ws_CO_retried')
+        
+        with mock.patch.object(send_adoption_sms, 'delay') as sms:
+            results = self.run_concurrently([
+                lambda: settle_payment('ws_CO_retried', succeeded=True, receipt_number='QKX1')
+                for _ in range(8)
+            ])
+        
+        self.assertEqual(len([r for r in results if r is not None]), 1)
+        self.assertEqual(sms.call_count, 1)
+        self.assertEqual(TreeAdoption.objects.filter(user=user, tree=self.tree).count(), 1)
+        self.tree.refresh_from_db()
+        user.refresh_from_db()
+        adoption_request.refresh_from_db()
+        self.assertEqual(self.tree.adoption_count, 1)
+        self.assertEqual(user.trees_adopted_count, 1)
+        self.assertEqual(adoption_request.status, 'completed')
+        self.assertEqual(adoption_request.payment.status, 'completed')
+    
+    def test_simultaneous_adopters_keep_tree_count_exact(self):
+        users = [User.objects.create(username=f'adopter{i}') for i in range(6)]
+        for i, user in enumerate(users):
+            self.make_paid_request(user, f'ws_CO_{i}')
+        
+        with mock.patch.object(send_adoption_sms, 'delay') as sms:
+            # Every callback delivered twice
+            self.run_concurrently([
+                lambda i=i: settle_payment(f'ws_CO_{i}', succeeded=True) for i in list(range(6)) * 2
+            ])
+        
+        self.tree.refresh_from_db()
+        self.assertTrue(self.tree.is_adopted)
+        self.assertEqual(self.tree.adoption_count, 6)
+        self.assertEqual(sms.call_count, 6)
+        self.assertEqual(
+            sorted(User.objects.values_list('trees_adopted_count', flat=True)), [1] * 6
+        )
+    
+    def test_one_user_adopting_many_trees_keeps_user_count_exact(self):
+        user = User.objects.create(username='planter')
+        trees = [self.tree] + [self.make_tree(f'KARURA-00{i}') for i in range(2, 7)]
+        
+        results = self.run_concurrently([
+            lambda tree=tree: adopt(User.objects.get(pk=user.pk), Tree.objects.get(pk=tree.pk))
+            for tree in trees * 2
+        ])
+        
+        self.assertEqual(len([created for _, created in results if created]), 6)
+        user.refresh_from_db()
+        self.assertEqual(user.trees_adopted_count, 6)
+        self.assertEqual(
+            sorted(Badge.objects.filter(user=user).values_list('badge_type', flat=True)),
+            ['first_adoption', 'five_adoptions']
+        )
+
+
+class ImageVariantTests(TestCase):
+    """Responsive image variants for list and map views"""
+    
+    def setUp(self):
+        self.always_eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.client = APIClient(HTTP_HOST='localhost')
+    
+    def tearDown(self):
+        app.conf.task_always_eager = self.always_eager
+    
+    def photo(self, size=(1600, 1200), color=(40, 120, 40)):
+        output = io.BytesIO()
+        Image.new('RGB', size, color).save(output, 'JPEG')
+        return output.getvalue()
+    
+    def make_species(self, **kwargs):
+        return TreeSpecies.objects.create(
+            name='Mukau', scientific_name='Melia volkensii', description='', risk_level='endangered',
+            native_region='', characteristics='', conservation_importance='', threats='', **kwargs
+        )
+    
+    def test_uploads_get_content_hashed_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            species = self.make_species(image=SimpleUploadedFile('mukau.jpg', self.photo()))
+            Tree.objects.create(
+                species=species, tree_id='KARURA-001', latitude=-1.2, longitude=36.8, location_name='Karura',
+                image=SimpleUploadedFile('tree.jpg', self.photo())
+            )
+        
+        species.refresh_from_db()
+        self.assertEqual(species.image_variants['thumb']['width'], 320)
+        self.assertEqual(species.image_variants['medium']['width'], 800)
+        self.assertTrue(default_storage.exists(species.image_variants['thumb']['name']))
+        
+        trees = self.client.get('/api/trees/').json()
+        tree = (trees['results'] if isinstance(trees, dict) else trees)[0]
+        thumb = tree['image_variants']['thumb']
+        self.assertTrue(thumb.startswith('http://localhost/media/variants/'))
+        self.assertEqual(tree['image_variants']['srcset'], f"{thumb} 320w, {tree['image_variants']['medium']} 800w")
+        
+        row = self.client.get('/api/trees/map_data/').json()[0]
+        self.assertEqual(row['image_variants']['thumb'], thumb)
+        self.assertTrue(row['species__image_variants']['thumb'].endswith(species.image_variants['thumb']['name']))
+    
+    def test_backfill_processes_existing_media(self):
+        name = default_storage.save('species/old.jpg', ContentFile(self.photo(size=(600, 400))))
+        species = self.make_species(image=name)
+        self.assertEqual(species.image_variants, {})
+        
+        call_command('generate_image_variants', model=['trees.TreeSpecies'], workers=2, stdout=io.StringIO())
+        
+        species.refresh_from_db()
+        # Images are never upscaled
+        self.assertEqual(species.image_variants['thumb']['width'], 320)
+        self.assertEqual(species.image_variants['medium']['width'], 600)
+
+
+class TreeTests(TestCase):
+    """Tree IDs and health history"""
+    
+    def setUp(self):
+        cache.clear()
+        self.species = TreeSpecies.objects.create(
+            name='Mukau', scientific_name='Melia volkensii', description='', risk_level='endangered',
+            native_region='', characteristics='', conservation_importance='', threats=''
+        )
+        self.tree = Tree.objects.create(
+            species=self.species, tree_id='KARURA-001', latitude=-1.2, longitude=36.8, location_name='Karura'
+        )
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(User.objects.create(username='ranger', user_type='ranger'))
+    
+    def test_tree_ids_differing_only_in_case_are_rejected(self):
+        payload = {
+            'tree_id': ' karura-001', 'species_id': self.species.id, 'latitude': '-1.2', 'longitude': '36.8',
+            'location_name': 'Karura',
+        }
+        response = self.client.post('/api/trees/', payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tree_id', response.json())
+        
+        payload['tree_id'] = 'KARURA-002'
+        self.assertEqual(self.client.post('/api/trees/', payload).status_code, 201)
+        # Saving a tree under its own ID in another case is fine
+        response = self.client.patch(f'/api/trees/{self.tree.id}/', {'tree_id': 'Karura-001'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Tree.objects.get(tree_key='KARURA-001').tree_id, 'Karura-001')
+    
+    def test_health_changes_are_recorded_once(self):
+        tree = Tree.objects.get(pk=self.tree.pk)
+        tree.notes = 'Checked'
+        tree.save()
+        self.assertFalse(TreeHealthEvent.objects.exists())
+        
+        tree.health_status = 'stressed'
+        tree.health_change_source = 'ai_analysis'
+        tree.save()
+        tree.save()
+        # A health change not among the saved fields is not recorded either
+        tree.health_status = 'diseased'
+        tree.save(update_fields=['notes'])
+        
+        event = TreeHealthEvent.objects.get()
+        self.assertEqual((event.from_status, event.to_status, event.source), ('healthy', 'stressed', 'ai_analysis'))
+        
+        Tree.objects.get(pk=tree.pk).save()
+        self.assertEqual(TreeHealthEvent.objects.count(), 1)
@@ -1,8 +1,13 @@
 from rest_framework import viewsets, status, permissions, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import TreeSpecies, Tree, TreeAdoption, Badge, Payment, AdoptionRequest
+from django.db import transaction
+from monitoring.thumbnails import variant_urls
+from users.phone import mpesa_phone_number
+from .adoption import adopt, complete_adoption_request, settle_payment
+from .models import TreeSpecies, Tree, TreeAdoption, Payment, AdoptionRequest
 from .serializers import (
     TreeSpeciesSerializer, TreeListSerializer, TreeDetailSerializer,
     TreeAdoptionSerializer, TreeAdoptionListSerializer, BadgeSerializer,
@@ -42,12 +47,17 @@ class TreeViewSet(viewsets.ModelViewSet):
     def map_data(self, request):
         """Get all trees optimized for map display"""
         trees = self.filter_queryset(self.get_queryset())
-        data = trees.values(
+        data = list(trees.values(
             'id', 'tree_id', 'latitude', 'longitude', 'location_name',
             'health_status', 'is_adopted', 'estimated_age', 'height', 'diameter',
             'species__name', 'species__scientific_name', 'species__risk_level',
-            'species__threats', 'adoption_count', 'image', 'species__image', 'species_id'
-        )
+            'species__threats', 'adoption_count', 'image', 'species__image', 'species_id',
+            'image_variants', 'species__image_variants'
+        ))
+        # Map popups only need thumbnails
+        for row in data:
+            row['image_variants'] = variant_urls(row['image_variants'], request.build_absolute_uri)
+            row['species__image_variants'] = variant_urls(row['species__image_variants'], request.build_absolute_uri)
         return Response(data)
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
@@ -72,112 +82,49 @@ class TreeViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Format phone number (remove + and spaces)
-        phone_number = phone_number.replace('+', '').replace(' ', '')
-        if not phone_number.startswith('254'):
-            phone_number = '254' + phone_number.lstrip('0')
-        
-        # Create adoption request
-        adoption_request = AdoptionRequest.objects.create(
-            user=request.user,
-            tree=tree,
-            message=message,
-            phone_number=phone_number,
-            status='pending'
-        )
-        
-        # Initiate M-Pesa payment
-        from monitoring.mpesa import MpesaService
-        mpesa = MpesaService()
-        
-        result = mpesa.initiate_stk_push(
-            phone_number=phone_number,
-            amount=amount,
-            account_reference=f"ADOPT-{tree.tree_id}",
-            transaction_desc=f"Tree Adoption: {tree.species.name}"
-        )
+        # Daraja format: 2547XXXXXXXX
+        phone_number = mpesa_phone_number(phone_number)
+        if not phone_number:
+            return Response(
+                {'error': 'Enter a valid phone number'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        if result['success']:
-            # Create payment record
-            payment = Payment.objects.create(
+        with transaction.atomic():
+            # Create adoption request
+            adoption_request = AdoptionRequest.objects.create(
                 user=request.user,
                 tree=tree,
-                amount=amount,
+                message=message,
                 phone_number=phone_number,
-                mpesa_checkout_request_id=result['checkout_request_id'],
                 status='pending'
             )
-            
-            # Link payment to adoption request
-            adoption_request.payment = payment
-            adoption_request.status = 'payment_pending'
-            adoption_request.save()
-            
-            return Response({
-                'success': True,
-                'message': 'Payment initiated. Please enter your M-Pesa PIN on your phone',
-                'checkout_request_id': result['checkout_request_id'],
-                'payment_id': payment.id,
-                'adoption_request_id': adoption_request.id
-            })
-        else:
-            adoption_request.delete()
-            return Response({
-                'success': False,
-                'error': result.get('error', 'Payment initiation failed')
-            }, status=status.HTTP_400_BAD_REQUEST)
+            payment = queue_adoption_payment(
+                adoption_request, amount, f"Tree Adoption: {tree.species.name}"
+            )
+        
+        return Response({
+            'success': True,
+            'message': 'Payment request is being sent. Please enter your M-Pesa PIN on your phone',
+            'payment_id': payment.id,
+            'adoption_request_id': adoption_request.id,
+            'status_url': reverse('payment-payment-status', args=[payment.id], request=request)
+        }, status=status.HTTP_202_ACCEPTED)
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def adopt(self, request, pk=None):
         """Adopt a tree"""
         tree = self.get_object()
         
-        # Check if already adopted by this user
-        if TreeAdoption.objects.filter(user=request.user, tree=tree, is_active=True).exists():
+        adoption, created = adopt(request.user, tree, request.data.get('notes', ''))
+        if not created:
             return Response(
                 {'error': 'You have already adopted this tree'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create adoption
-        adoption = TreeAdoption.objects.create(
-            user=request.user,
-            tree=tree,
-            notes=request.data.get('notes', '')
-        )
-        
-        # Update tree and user stats
-        tree.is_adopted = True
-        tree.adoption_count += 1
-        tree.save()
-        
-        request.user.trees_adopted_count += 1
-        request.user.save()
-        
-        # Award badges
-        self._award_adoption_badges(request.user)
-        
         serializer = TreeAdoptionSerializer(adoption)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
-    
-    def _award_adoption_badges(self, user):
-        """Award badges based on adoption count"""
-        count = user.trees_adopted_count
-        badge_types = []
-        
-        if count == 1:
-            badge_types.append(('first_adoption', 'Adopted your first tree!'))
-        if count == 5:
-            badge_types.append(('five_adoptions', 'Adopted 5 trees!'))
-        if count == 10:
-            badge_types.append(('ten_adoptions', 'Adopted 10 trees!'))
-        
-        for badge_type, description in badge_types:
-            Badge.objects.get_or_create(
-                user=user,
-                badge_type=badge_type,
-                defaults={'description': description}
-            )
 
 
 class TreeAdoptionViewSet(viewsets.ReadOnlyModelViewSet):
@@ -239,47 +186,25 @@ class AdoptionRequestViewSet(viewsets.ModelViewSet):
         
         # Get amount from request or use default
         amount = request.data.get('amount', 500)  # Default 500 KES
-        phone_number = adoption_request.phone_number
         
-        # Import M-Pesa service
-        from monitoring.mpesa import MpesaService
-        mpesa = MpesaService()
-        
-        # Initiate STK push
-        result = mpesa.initiate_stk_push(
-            phone_number=phone_number,
-            amount=amount,
-            account_reference=f"ADOPT-{adoption_request.tree.tree_id}",
-            transaction_desc=f"Tree Adoption Fee for {adoption_request.tree.tree_id}"
-        )
-        
-        if result['success']:
-            # Create payment record
-            payment = Payment.objects.create(
-                user=request.user,
-                tree=adoption_request.tree,
-                amount=amount,
-                phone_number=phone_number,
-                mpesa_checkout_request_id=result['checkout_request_id'],
-                status='pending'
+        with transaction.atomic():
+            # A double submit must not send two STK pushes
+            locked = AdoptionRequest.objects.select_for_update().get(id=adoption_request.id)
+            if locked.status != 'pending':
+                return Response(
+                    {'error': 'This adoption request is not pending'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            payment = queue_adoption_payment(
+                locked, amount, f"Tree Adoption Fee for {adoption_request.tree.tree_id}"
             )
-            
-            # Link payment to adoption request
-            adoption_request.payment = payment
-            adoption_request.status = 'payment_pending'
-            adoption_request.save()
-            
-            return Response({
-                'success': True,
-                'message': 'Payment initiated. Please enter your M-Pesa PIN',
-                'checkout_request_id': result['checkout_request_id'],
-                'payment_id': payment.id
-            })
-        else:
-            return Response({
-                'success': False,
-                'error': result.get('error', 'Payment initiation failed')
-            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'success': True,
+            'message': 'Payment request is being sent. Please enter your M-Pesa PIN',
+            'payment_id': payment.id,
+            'status_url': reverse('payment-payment-status', args=[payment.id], request=request)
+        }, status=status.HTTP_202_ACCEPTED)
     
     @action(detail=False, methods=['get'])
     def my_requests(self, request):
@@ -309,8 +234,6 @@ class AdoptionRequestViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         """Approve adoption request (rangers only)"""
-        from django.utils import timezone
-        
         if request.user.user_type not in ['ranger', 'admin']:
             return Response(
                 {'error': 'Only rangers can approve adoption requests'},
@@ -326,37 +249,10 @@ class AdoptionRequestViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create actual TreeAdoption
-        tree_adoption = TreeAdoption.objects.create(
-            user=adoption_request.user,
-            tree=adoption_request.tree,
-            notes=adoption_request.message
-        )
-        
-        # Update tree
-        adoption_request.tree.is_adopted = True
-        adoption_request.tree.adoption_count += 1
-        adoption_request.tree.save()
-        
-        # Update user stats
-        adoption_request.user.trees_adopted_count += 1
-        adoption_request.user.save()
-        
-        # Update request status
-        adoption_request.status = 'completed'
-        adoption_request.reviewed_by = request.user
-        adoption_request.reviewed_at = timezone.now()
-        adoption_request.ranger_notes = request.data.get('notes', '')
-        adoption_request.save()
-        
-        # Send SMS confirmation
-        from monitoring.tasks import send_adoption_sms
-        send_adoption_sms.delay(
-            adoption_request.phone_number,
-            adoption_request.user.username,
-            tree_adoption.tree.tree_id,
-            tree_adoption.tree.species.name,
-            tree_adoption.certificate_number
+        tree_adoption, _ = complete_adoption_request(
+            adoption_request.id,
+            reviewed_by=request.user,
+            ranger_notes=request.data.get('notes', '')
         )
         
         return Response({
@@ -389,6 +285,31 @@ class AdoptionRequestViewSet(viewsets.ModelViewSet):
         })
 
 
+def queue_adoption_payment(adoption_request, amount, transaction_desc):
+    """
+    Create the Payment for an adoption request and queue its STK push
+    
+    Call inside a transaction; the push is only queued once it commits.
+    """
+    from monitoring.tasks import initiate_adoption_payment
+    
+    payment = Payment.objects.create(
+        user=adoption_request.user,
+        tree=adoption_request.tree,
+        amount=amount,
+        phone_number=adoption_request.phone_number,
+        status='initiating'
+    )
+    
+    # Link payment to adoption request
+    adoption_request.payment = payment
+    adoption_request.status = 'payment_pending'
+    adoption_request.save(update_fields=['payment', 'status', 'updated_at'])
+    
+    transaction.on_commit(lambda: initiate_adoption_payment.delay(payment.id, transaction_desc))
+    return payment
+
+
 class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for viewing payments"""
     
@@ -402,51 +323,59 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
             return self.queryset
         return self.queryset.filter(user=self.request.user)
     
+    @action(detail=True, methods=['get'], url_path='status')
+    def payment_status(self, request, pk=None):
+        """
+        Lightweight payment status for clients polling after an adoption
+        
+        Reads a single row without serializing the payment's relations.
+        """
+        payment = self.get_queryset().filter(pk=pk).values(
+            'id', 'status', 'result_description', 'mpesa_receipt_number',
+            'adoption_request__id', 'adoption_request__status', 'updated_at'
+        ).first()
+        if payment is None:
+            return Response({'error': 'Payment not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        settled = payment['status'] in ('completed', 'failed', 'cancelled')
+        return Response({
+            'id': payment['id'],
+            'status': payment['status'],
+            'result_description': payment['result_description'],
+            'receipt_number': payment['mpesa_receipt_number'],
+            'adoption_request_id': payment['adoption_request__id'],
+            'adoption_request_status': payment['adoption_request__status'],
+            'updated_at': payment['updated_at'],
+            'final': settled,
+            # Seconds the client should wait before asking again
+            'poll_after': None if settled else 3,
+        })
+    
     @action(detail=False, methods=['post'])
     def callback(self, request):
         """M-Pesa payment callback webhook"""
-        from django.utils import timezone
-        
         # Extract M-Pesa callback data
-        callback_data = request.data
-        result_code = callback_data.get('Body', {}).get('stkCallback', {}).get('ResultCode')
-        checkout_request_id = callback_data.get('Body', {}).get('stkCallback', {}).get('CheckoutRequestID')
+        callback_data = request.data.get('Body', {}).get('stkCallback', {})
+        result_code = callback_data.get('ResultCode')
+        checkout_request_id = callback_data.get('CheckoutRequestID')
+        
+        if not checkout_request_id:
+            return Response({'error': 'Invalid callback data'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        receipt_number = None
+        for item in callback_data.get('CallbackMetadata', {}).get('Item', []):
+            if item.get('Name') == 'MpesaReceiptNumber':
+                receipt_number = item.get('Value')
         
         try:
-            payment = Payment.objects.get(mpesa_checkout_request_id=checkout_request_id)
-            
-            if result_code == 0:  # Success
-                # Extract metadata
-                callback_metadata = callback_data.get('Body', {}).get('stkCallback', {}).get('CallbackMetadata', {}).get('Item', [])
-                receipt_number = None
-                transaction_date = None
-                
-                for item in callback_metadata:
-                    if item.get('Name') == 'MpesaReceiptNumber':
-                        receipt_number = item.get('Value')
-                    elif item.get('Name') == 'TransactionDate':
-                        transaction_date = item.get('Value')
-                
-                payment.status = 'completed'
-                payment.mpesa_receipt_number = receipt_number
-                payment.transaction_date = timezone.now()
-                payment.result_description = 'Payment successful'
-                payment.save()
-                
-                # Update adoption request status
-                if hasattr(payment, 'adoption_request'):
-                    payment.adoption_request.status = 'pending'  # Ready for ranger approval
-                    payment.adoption_request.save()
-            else:
-                payment.status = 'failed'
-                payment.result_description = callback_data.get('Body', {}).get('stkCallback', {}).get('ResultDesc', 'Payment failed')
-                payment.save()
-                
-                # Update adoption request
-                if hasattr(payment, 'adoption_request'):
-                    payment.adoption_request.status = 'payment_failed'
-                    payment.adoption_request.save()
-            
+            # A paid request goes back to 'pending' for ranger approval
+            settle_payment(
+                checkout_request_id,
+                succeeded=result_code == 0,
+                receipt_number=receipt_number,
+                result_description='Payment successful' if result_code == 0 else callback_data.get('ResultDesc', 'Payment failed'),
+                complete=False
+            )
             return Response({'success': True})
         except Payment.DoesNotExist:
             return Response({'error': 'Payment not found'}, status=status.HTTP_404_NOT_FOUND)
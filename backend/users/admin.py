@@ -7,7 +7,7 @@ from .models import User
 class UserAdmin(BaseUserAdmin):
     list_display = ['username', 'email', 'user_type', 'trees_adopted_count', 'reports_submitted_count', 'created_at']
     list_filter = ['user_type', 'is_staff', 'is_active']
-    search_fields = ['username', 'email', 'phone_number']
+    search_fields = ['username', 'email', 'phone_number', 'phone_e164']
     
     fieldsets = BaseUserAdmin.fieldsets + (
         ('Nilocate Info', {
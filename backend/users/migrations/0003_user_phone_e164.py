@@ -0,0 +1,58 @@
+import re
+
+from django.db import migrations, models
+
+
+def normalize_phone_number(value, country_code='254'):
+    """Frozen copy of users.phone.normalize_phone_number as of this migration"""
+    if not value:
+        return None
+    
+    digits = re.sub(r'[^\d+]', '', str(value))
+    if digits.startswith('+'):
+        digits = digits[1:]
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif digits.startswith('0'):
+        digits = country_code + digits[1:]
+    elif len(digits) == 9:
+        digits = country_code + digits
+    
+    if not digits.isdigit() or not 8 <= len(digits) <= 15:
+        return None
+    return f'+{digits}'
+
+
+def populate_phone_e164(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    seen = set()
+    batch = []
+    # Oldest account keeps a number shared by several users
+    for user in User.objects.exclude(phone_number='').order_by('id').only('id', 'phone_number').iterator(chunk_size=1000):
+        e164 = normalize_phone_number(user.phone_number)
+        if not e164 or e164 in seen:
+            continue
+        seen.add(e164)
+        user.phone_e164 = e164
+        batch.append(user)
+        if len(batch) >= 1000:
+            User.objects.bulk_update(batch, ['phone_e164'])
+            batch = []
+    if batch:
+        User.objects.bulk_update(batch, ['phone_e164'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_assigned_forest_user_certification_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='phone_e164',
+            field=models.CharField(blank=True, editable=False, help_text='Canonical E.164 form of phone_number', max_length=16, null=True, unique=True),
+        ),
+        migrations.RunPython(populate_phone_e164, migrations.RunPython.noop),
+    ]
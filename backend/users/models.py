@@ -1,6 +1,9 @@
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.db import models
 
+from .phone import normalize_phone_number, forget_phone_number
+
 
 class User(AbstractUser):
     """Custom user model for Nilocate platform"""
@@ -13,6 +16,8 @@ class User(AbstractUser):
     
     user_type = models.CharField(max_length=20, choices=USER_TYPE_CHOICES, default='citizen')
     phone_number = models.CharField(max_length=20, blank=True)
+    phone_e164 = models.CharField(max_length=16, unique=True, null=True, blank=True, editable=False,
+                                  help_text="Canonical E.164 form of phone_number")
     bio = models.TextField(blank=True)
     profile_picture = models.ImageField(upload_to='profiles/', blank=True, null=True)
     location = models.CharField(max_length=200, blank=True)
@@ -31,5 +36,35 @@ class User(AbstractUser):
     def __str__(self):
         return f"{self.username} ({self.get_user_type_display()})"
     
+    def _phone_taken(self, e164):
+        """Whether another account already owns the normalized number"""
+        return bool(e164) and User.objects.filter(phone_e164=e164).exclude(pk=self.pk).exists()
+    
+    def clean(self):
+        super().clean()
+        e164 = normalize_phone_number(self.phone_number)
+        stored = User.objects.filter(pk=self.pk).values_list('phone_number', flat=True).first() if self.pk else None
+        # An unresolved duplicate may keep the number it already had
+        if e164 != normalize_phone_number(stored) and self._phone_taken(e164):
+            raise ValidationError({'phone_number': "This phone number is already registered"})
+    
+    def save(self, *args, **kwargs):
+        previous_e164 = self.phone_e164
+        e164 = normalize_phone_number(self.phone_number)
+        # Duplicates left by migration 0003 stay unresolved; the owner keeps the number
+        if e164 != previous_e164 and self._phone_taken(e164):
+            e164 = None
+        self.phone_e164 = e164
+        
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone_number' in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['phone_e164']
+        
+        super().save(*args, **kwargs)
+        
+        if previous_e164 != self.phone_e164:
+            forget_phone_number(previous_e164)
+            forget_phone_number(self.phone_e164)
+    
     class Meta:
         ordering = ['-created_at']
@@ -0,0 +1,83 @@
+"""
+Phone number normalization and phone -> user resolution
+Every phone-based lookup (SMS, USSD, M-Pesa, notifications) goes through
+here so that "0712 345 678", "254712345678" and "+254712345678" all
+resolve to the same user.
+"""
+import re
+
+from django.core.cache import cache
+
+DEFAULT_COUNTRY_CODE = '254'
+
+RESOLVER_TTL = 600
+MISS_TTL = 60
+
+
+def normalize_phone_number(value, country_code=DEFAULT_COUNTRY_CODE):
+    """
+    Convert a phone number to E.164 (e.g. +254712345678)
+    
+    Local Kenyan forms (07.., 01.., 7.., 1..) get the default country code.
+    Returns None when the value cannot be a valid number.
+    """
+    if not value:
+        return None
+    
+    digits = re.sub(r'[^\d+]', '', str(value))
+    if digits.startswith('+'):
+        digits = digits[1:]
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif digits.startswith('0'):
+        digits = country_code + digits[1:]
+    elif len(digits) == 9:
+        digits = country_code + digits
+    
+    if not digits.isdigit() or not 8 <= len(digits) <= 15:
+        return None
+    return f'+{digits}'
+
+
+def mpesa_phone_number(value):
+    """Daraja expects the E.164 digits without the plus (2547XXXXXXXX)"""
+    e164 = normalize_phone_number(value)
+    return e164[1:] if e164 else None
+
+
+def _cache_key(e164):
+    return f'phone-user:{e164}'
+
+
+def resolve_user_id(phone_number):
+    """
+    Return the id of the user owning a phone number, or None
+    
+    Hits and misses are cached; User.save() clears the entry when a
+    number is added or changed.
+    """
+    from .models import User
+    
+    e164 = normalize_phone_number(phone_number)
+    if not e164:
+        return None
+    
+    user_id = cache.get(_cache_key(e164))
+    if user_id is None:
+        user_id = User.objects.filter(phone_e164=e164).values_list('id', flat=True).first() or 0
+        cache.set(_cache_key(e164), user_id, RESOLVER_TTL if user_id else MISS_TTL)
+    return user_id or None
+
+
+def resolve_user(phone_number):
+    from .models import User
+    
+    user_id = resolve_user_id(phone_number)
+    if user_id is None:
+        return None
+    return User.objects.filter(pk=user_id).first()
+
+
+def forget_phone_number(e164):
+    if e164:
+        cache.delete(_cache_key(e164))
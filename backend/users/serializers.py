@@ -1,6 +1,28 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import User
+from .phone import normalize_phone_number
+
+
+def validate_unique_phone_number(value, instance=None):
+    """Reject numbers that are invalid or already registered in another format"""
+    if not value:
+        return value
+    
+    e164 = normalize_phone_number(value)
+    if not e164:
+        raise serializers.ValidationError("Enter a valid phone number")
+    
+    if instance is not None and normalize_phone_number(instance.phone_number) == e164:
+        # Unchanged, including duplicates left unresolved by migration 0003
+        return value
+    
+    existing = User.objects.filter(phone_e164=e164)
+    if instance is not None:
+        existing = existing.exclude(pk=instance.pk)
+    if existing.exists():
+        raise serializers.ValidationError("This phone number is already registered")
+    return value
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -14,6 +36,9 @@ class UserSerializer(serializers.ModelSerializer):
                   'certification_number', 'years_of_experience', 'assigned_forest', 'specialization',
                   'created_at']
         read_only_fields = ['id', 'trees_adopted_count', 'reports_submitted_count', 'created_at']
+    
+    def validate_phone_number(self, value):
+        return validate_unique_phone_number(value, self.instance)
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -32,6 +57,9 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
                   'last_name', 'user_type', 'phone_number', 'location',
                   'certification_number', 'years_of_experience', 'assigned_forest', 'specialization']
     
+    def validate_phone_number(self, value):
+        return validate_unique_phone_number(value)
+    
     def validate(self, data):
         if data['password'] != data['password_confirm']:
             raise serializers.ValidationError("Passwords do not match")
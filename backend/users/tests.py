@@ -1,3 +1,69 @@
+import importlib
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from .models import User
+from .phone import normalize_phone_number, resolve_user
+
+populate_phone_e164 = importlib.import_module('users.migrations.0003_user_phone_e164').populate_phone_e164
+
 
-# Create your tests here.
+class PhoneNumberTests(TestCase):
+    """Phone normalization, the phone -> user resolver and duplicate numbers"""
+    
+    def setUp(self):
+        cache.clear()
+    
+    def test_local_and_international_forms_resolve_to_one_user(self):
+        user = User.objects.create(username='wanjiru', phone_number='0712 345 678')
+        
+        self.assertEqual(user.phone_e164, '+254712345678')
+        for number in ['254712345678', '+254712345678', '712345678', '00254712345678']:
+            self.assertEqual(normalize_phone_number(number), '+254712345678')
+            self.assertEqual(resolve_user(number), user)
+        self.assertIsNone(resolve_user('0799 000 000'))
+        
+        # Changing the number clears the cached resolution
+        user.phone_number = '0799 000 000'
+        user.save()
+        self.assertIsNone(resolve_user('0712345678'))
+        self.assertEqual(resolve_user('+254799000000'), user)
+    
+    def test_migration_leaves_duplicates_with_the_oldest_account(self):
+        owner = User.objects.create(username='owner', phone_number='0712345678')
+        duplicate = User.objects.create(username='duplicate', phone_number='254712345678')
+        User.objects.update(phone_e164=None)
+        
+        populate_phone_e164(apps, None)
+        
+        owner.refresh_from_db()
+        duplicate.refresh_from_db()
+        self.assertEqual(owner.phone_e164, '+254712345678')
+        self.assertIsNone(duplicate.phone_e164)
+        
+        # Ordinary saves of the duplicate keep working
+        duplicate.reports_submitted_count += 1
+        duplicate.save()
+        duplicate.refresh_from_db()
+        self.assertIsNone(duplicate.phone_e164)
+        duplicate.clean()
+        self.assertEqual(resolve_user('0712345678'), owner)
+    
+    def test_new_duplicates_are_rejected(self):
+        User.objects.create(username='owner', phone_number='0712345678')
+        
+        response = APIClient(HTTP_HOST='localhost').post('/api/users/', {
+            'username': 'copycat', 'email': 'copycat@example.com', 'password': 'longpassword',
+            'password_confirm': 'longpassword', 'phone_number': '+254 712 345 678',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('phone_number', response.json())
+        
+        other = User.objects.create(username='other', phone_number='0799000000')
+        other.phone_number = '254712345678'
+        with self.assertRaises(ValidationError):
+            other.clean()
@@ -253,8 +253,13 @@ function MapPage() {
       // Determine which image to use: tree image > species image > placeholder
       // Backend URL without /api suffix for media files
       const baseUrl = (process.env.REACT_APP_API_URL || 'http://localhost:8000/api').replace('/api', '');
-      const treeImageUrl = tree.image 
+      // Popups are small, so use the thumbnail variant when it has been generated
+      const treeImageUrl = tree.image_variants
+        ? tree.image_variants.thumb
+        : tree.image
         ? `${baseUrl}/media/${tree.image}`
+        : tree.species__image_variants
+        ? tree.species__image_variants.thumb
         : tree.species__image
         ? `${baseUrl}/media/${tree.species__image}`
         : `https://images.unsplash.com/photo-1502082553048-f009c37129b9?w=400&h=300&fit=crop`;
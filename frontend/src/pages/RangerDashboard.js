@@ -184,11 +184,8 @@ function RangerDashboard() {
     setAiAnalysis(null);
 
     try {
-      const response = await axios.post(`${baseUrl}/api/reports/${report.id}/analyze_ai/`, {}, {
-        headers: { Authorization: `Bearer ${localStorage.getItem('access_token')}` }
-      });
-      
-      setAiAnalysis(response.data);
+      const analysis = await aiService.analyzeImage(report.id);
+      setAiAnalysis(analysis);
     } catch (error) {
       alert('Failed to analyze image with AI');
       console.error(error);
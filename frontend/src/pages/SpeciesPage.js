@@ -59,7 +59,9 @@ function SpeciesPage() {
               <div key={sp.id} className="bg-white rounded-2xl shadow-xl overflow-hidden hover:shadow-2xl transition transform hover:-translate-y-2">
                 <div className="relative h-64 overflow-hidden">
                   <img 
-                    src={imageUrl} 
+                    src={sp.image_variants ? sp.image_variants.medium : imageUrl} 
+                    srcSet={sp.image_variants ? sp.image_variants.srcset : undefined}
+                    sizes="(min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw"
                     alt={sp.name} 
                     className="w-full h-full object-cover hover:scale-110 transition duration-500"
                     onError={(e) => {
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
-import { treeService } from '../services/api';
+import { treeService, paymentService } from '../services/api';
 import { useAuth } from '../context/AuthContext';
 
 function TreeDetailPage() {
@@ -55,10 +55,23 @@ function TreeDetailPage() {
       if (response.success) {
         alert('M-Pesa payment request sent! Please check your phone and enter your PIN.\n\nYou will receive an SMS confirmation after payment is completed.');
         
-        // Optionally poll for payment status
-        setTimeout(() => {
-          loadTree();
-        }, 10000); // Reload after 10 seconds to see if payment completed
+        // Poll the payment until M-Pesa reports an outcome
+        const pollPayment = async (attempt = 0) => {
+          try {
+            const payment = await paymentService.getPaymentStatus(response.payment_id);
+            if (payment.final) {
+              if (payment.status !== 'completed') {
+                alert(payment.result_description || 'M-Pesa payment was not completed');
+              }
+              loadTree();
+            } else if (attempt < 40) {
+              setTimeout(() => pollPayment(attempt + 1), (payment.poll_after || 3) * 1000);
+            }
+          } catch (pollError) {
+            console.error('Error checking payment status:', pollError);
+          }
+        };
+        pollPayment();
       }
     } catch (error) {
       alert(error.response?.data?.error || 'Failed to initiate adoption payment');
@@ -90,6 +90,13 @@ export const treeService = {
   },
 };
 
+export const paymentService = {
+  getPaymentStatus: async (paymentId) => {
+    const response = await api.get(`/payments/${paymentId}/status/`);
+    return response.data;
+  },
+};
+
 export const adoptionService = {
   getMyAdoptions: async () => {
     const response = await api.get('/adoptions/my_adoptions/');
@@ -133,7 +140,11 @@ export const reportService = {
 
   analyzeReport: async (reportId) => {
     const response = await api.post(`/reports/${reportId}/analyze/`);
-    return response.data;
+    if (response.status !== 202) {
+      return response.data;
+    }
+    const result = await analysisService.waitForResult(response.data.job_id);
+    return result.analysis;
   },
 
   verifyReport: async (reportId, notes) => {
@@ -198,10 +209,33 @@ export const incidentService = {
   },
 };
 
+export const analysisService = {
+  getJob: async (jobId) => {
+    const response = await api.get(`/analysis-jobs/${jobId}/`);
+    return response.data;
+  },
+
+  // AI analysis runs in the background; poll the job until it finishes
+  waitForResult: async (jobId, maxAttempts = 60) => {
+    for (let attempt = 0; attempt < maxAttempts; attempt++) {
+      const job = await analysisService.getJob(jobId);
+      if (job.final) {
+        if (job.status !== 'succeeded') {
+          throw new Error(job.error || 'AI analysis failed');
+        }
+        return job.result;
+      }
+      await new Promise((resolve) => setTimeout(resolve, (job.poll_after || 2) * 1000));
+    }
+    throw new Error('AI analysis is taking longer than expected');
+  },
+};
+
 export const aiService = {
   analyzeImage: async (reportId) => {
     const response = await api.post(`/reports/${reportId}/analyze_ai/`);
-    return response.data;
+    const result = await analysisService.waitForResult(response.data.job_id);
+    return result.dashboard;
   },
 
   analyzePlantHealth: async (imageFile) => {